@@ -1,10 +1,25 @@
 import streamlit as st
-from supabase_client import get_client
+import pandas as pd
+from supabase_client import get_client, get_client_manager
+from file_cache import get_listing_cache, is_folder
+from file_actions import export_path
+from file_service import FileService
+from file_types import CATEGORY_ICONS, classify, file_icon
+from limits import QuotaExceeded, get_limits
+from jobs import ACTIVE_STATUSES, DONE, PRIORITY_BACKGROUND, get_job_queue
+from metadata_index import get_metadata_index
+from metrics import get_metrics, start_metrics_server
+from signed_urls import download_url
+from thumbnails import get_thumbnail_service
+from uploads import MAX_CONCURRENT_UPLOADS, BatchItem, items_from_zip
+import logging
 import os
+import posixpath
 import time
+import uuid
 import base64
-import mimetypes
 from datetime import datetime
+from functools import lru_cache
 
 # Set page configuration
 st.set_page_config(
@@ -71,6 +86,12 @@ st.markdown("""
         border-radius: 5px;
         margin-top: 10px;
     }
+    .file-thumbnail {
+        max-height: 64px;
+        max-width: 96px;
+        border-radius: 4px;
+        margin-bottom: 5px;
+    }
     .sidebar-title {
         font-weight: 700;
         color: #1E88E5;
@@ -96,36 +117,66 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize basic client for auth operations
-supabase = get_client()
+# Initialize basic client for auth operations, reusing the pooled HTTP connections
+client_manager = get_client_manager()
+supabase = get_client(http_client=client_manager.http_client)
+
+# Timings, byte counts and errors of every storage and auth request
+metrics = get_metrics()
+
+# Errors the UI recovers from are logged here with their tracebacks
+logger = logging.getLogger(__name__)
+if os.environ.get("FILESHARE_METRICS_PORT"):
+    # Prometheus scrapes /metrics on this port; started once per process
+    start_metrics_server(int(os.environ["FILESHARE_METRICS_PORT"]))
+
+# Users (by email) who see the Performance tab
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get("FILESHARE_ADMINS", "").split(",") if email.strip()}
+
+# Folder listings shared by the My Files and Stats tabs
+listing_cache = get_listing_cache()
+
+# Local index of file metadata and content hashes, used for search, stats and deduplication
+metadata_index = get_metadata_index()
+
+# Thumbnails are generated in the background and shared by all sessions
+thumbnail_service = get_thumbnail_service()
+
+# Uploads, bulk deletes and reindexing run as background jobs so reruns never wait on them
+job_queue = get_job_queue()
+
+# Job kinds listed in the jobs panel; thumbnail, scrub and version cleanup jobs run silently
+VISIBLE_JOB_KINDS = ["upload", "delete", "reindex", "export", "verify", "adopt"]
+
+# Seconds between two background integrity checks (scrubs) of a user's files
+SCRUB_INTERVAL = 60 * 60
+
+# Seconds between two cleanups of a user's old file versions
+VERSION_GC_INTERVAL = 60 * 60
+
+# Seconds between job status polls while a job is queued or running
+JOB_POLL_INTERVAL = 1
+
+# Page sizes offered in the My Files tab
+PAGE_SIZES = [25, 50, 100, 200]
+
+# Sort orders offered in the My Files tab: label -> (index column, descending)
+SORT_OPTIONS = {
+    "Name": ("name", False),
+    "Newest first": ("updated", True),
+    "Oldest first": ("updated", False),
+    "Largest first": ("size", True),
+    "Smallest first": ("size", False),
+}
+
+# Lifetimes offered for share links: label -> seconds
+SHARE_DURATIONS = {"1 hour": 60 * 60, "1 day": 24 * 60 * 60, "7 days": 7 * 24 * 60 * 60}
 
 # -------------------------
 # Helper Functions
 # -------------------------
 
-def get_file_icon(mime_type):
-    """Return an appropriate icon for file type"""
-    if mime_type.startswith('image/'):
-        return "🖼️"
-    elif mime_type.startswith('video/'):
-        return "🎬"
-    elif mime_type.startswith('audio/'):
-        return "🎵"
-    elif mime_type.startswith('text/'):
-        return "📝"
-    elif 'pdf' in mime_type:
-        return "📑"
-    elif 'word' in mime_type or 'document' in mime_type:
-        return "📄"
-    elif 'excel' in mime_type or 'spreadsheet' in mime_type:
-        return "📊"
-    elif 'presentation' in mime_type or 'powerpoint' in mime_type:
-        return "📽️"
-    elif 'zip' in mime_type or 'compressed' in mime_type:
-        return "🗜️"
-    else:
-        return "📁"
-
+@lru_cache(maxsize=4096)
 def format_size(size_bytes):
     """Format file size in human-readable format"""
     if size_bytes < 1024:
@@ -137,19 +188,878 @@ def format_size(size_bytes):
     else:
         return f"{size_bytes/(1024*1024*1024):.1f} GB"
 
-def get_file_preview(file_url, mime_type, file_name):
-    """Generate preview HTML based on file type"""
+@lru_cache(maxsize=1024)
+def get_file_preview(file_url, mime_type, file_name, thumbnail_url=None):
+    """Generate preview HTML based on file type
+    
+    When a thumbnail is available it is shown instead of the original, and
+    media only starts downloading once the user presses play.
+    """
     if mime_type.startswith('image/'):
-        return f'<img src="{file_url}" class="preview-image" alt="{file_name}">'
+        return f'<img src="{thumbnail_url or file_url}" class="preview-image" alt="{file_name}" loading="lazy">'
     elif mime_type.startswith('video/'):
-        return f'<video controls width="100%" height="200"><source src="{file_url}" type="{mime_type}">Your browser does not support video preview.</video>'
+        poster = f' poster="{thumbnail_url}"' if thumbnail_url else ''
+        return f'<video controls preload="none"{poster} width="100%" height="200"><source src="{file_url}" type="{mime_type}">Your browser does not support video preview.</video>'
     elif mime_type.startswith('audio/'):
-        return f'<audio controls style="width:100%"><source src="{file_url}" type="{mime_type}">Your browser does not support audio preview.</audio>'
+        return f'<audio controls preload="none" style="width:100%"><source src="{file_url}" type="{mime_type}">Your browser does not support audio preview.</audio>'
     elif mime_type == 'application/pdf':
+        if thumbnail_url:
+            return f'<img src="{thumbnail_url}" class="preview-image" alt="{file_name}" loading="lazy">'
         return f'<iframe src="{file_url}" width="100%" height="200" style="border:none;"></iframe>'
     else:
         # For other file types, show a simple icon
-        return f'<div style="text-align:center; font-size:64px;">{get_file_icon(mime_type)}</div>'
+        return f'<div style="text-align:center; font-size:64px;">{file_icon(mime_type)}</div>'
+
+@lru_cache(maxsize=4096)
+def card_details(file_name, mime_type, size, timestamp):
+    """Return (mime type, icon, size, last modified) as shown on a file card
+    
+    Memoized, since the My Files panel redraws the same cards on every rerun.
+    The type is the one stored with the object, falling back to the
+    extension. Sizes and timestamps come straight from listing entries, so
+    anything malformed is shown as unknown rather than failing the card.
+    """
+    mime_type, _, icon = classify(file_name, mime_type)
+    
+    try:
+        if not isinstance(size, (int, float)):
+            size = int(float(str(size or 0).strip()))
+        file_size = format_size(size)
+    except (ValueError, TypeError):
+        file_size = "Unknown"
+    
+    try:
+        if isinstance(timestamp, str):
+            try:
+                timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                timestamp = float(timestamp)
+        elif not isinstance(timestamp, (int, float)):
+            timestamp = 0
+        last_modified = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+    except (ValueError, TypeError, OverflowError, OSError):
+        last_modified = "Unknown date"
+    
+    return mime_type, icon, file_size, last_modified
+
+def clean_folder(value):
+    """Normalise a folder path typed by the user, e.g. '/photos//2024/' to 'photos/2024'
+    
+    Returns:
+        The folder relative to the user folder, "" for the top, or None if
+        it leaves the user folder or names a hidden folder
+    """
+    folder = posixpath.normpath(value.strip().replace("\\", "/")).strip("/")
+    if folder == ".":
+        return ""
+    if any(part.startswith(".") for part in folder.split("/")):
+        return None
+    return folder
+
+def upload_file_job(files, uploaded_file, compress, folder=""):
+    """Build a job storing one uploaded file, reporting progress in bytes"""
+    def run(job):
+        return files.store(
+            posixpath.join(folder, uploaded_file.name),
+            uploaded_file,
+            uploaded_file.size,
+            content_type=uploaded_file.type,
+            compress=compress,
+            progress=lambda sent, total: job.progress(sent / total if total else 1.0, f"{format_size(sent)} of {format_size(total)}")
+        )
+    return run
+
+def upload_batch_job(files, items, concurrency, compress):
+    """Build a job uploading BatchItems in parallel, reporting progress per file"""
+    def run(job):
+        finished = []
+        def on_result(result):
+            finished.append(result)
+            job.progress(len(finished) / len(items), f"{len(finished)} of {len(items)} files")
+        return files.upload_batch(items, concurrency, compress=compress, on_result=on_result)
+    return run
+
+def delete_job(files, names):
+    """Build a job deleting files in batches and patching the caches"""
+    def run(job):
+        return files.delete(names, on_progress=lambda done, total: job.progress(done / total, f"{done} of {total} files"))
+    return run
+
+def adopt_job(files, legacy_folder, owner_id):
+    """Build a job moving the user's own uploads out of their old email-named folder"""
+    def run(job):
+        return files.adopt_folder(legacy_folder, owner_id, on_progress=lambda done, total: job.progress(done / total, f"{done} of {total} files"))
+    return run
+
+def export_job(files, names=None):
+    """Build a job zipping the given files, or the whole folder when names is None
+    
+    The finished archive is downloaded through a share link to it.
+    """
+    def run(job):
+        result = files.export_zip(
+            export_path(f"{job.id}.zip"),
+            names,
+            on_progress=lambda done, total: job.progress(done / total, f"{done} of {total} files")
+        )
+        result["url"] = files.share_export(result["archive"])["url"]
+        return result
+    return run
+
+def schedule_reindex(files):
+    """Queue a resync of the user's metadata index unless one is pending"""
+    if job_queue.is_active(files.user_folder, "reindex"):
+        return
+    job_queue.submit(files.user_folder, "reindex", "Refresh file index", lambda job: files.reindex())
+
+def verify_job(files, names):
+    """Build a job checking files against their upload checksums"""
+    def run(job):
+        return files.verify(names, on_progress=lambda done, total: job.progress(done / total, f"{done} of {total} files"))
+    return run
+
+def schedule_scrub(files):
+    """Queue an incremental re-verification of the user's files now and then
+    
+    Each run reads a bounded number of bytes at a limited rate, so scrubbing
+    a large folder is spread over many visits. It does not count against
+    the user's job limit, so their uploads never wait for it.
+    """
+    if job_queue.is_active(files.user_folder, "scrub"):
+        return
+    last = job_queue.jobs_for(files.user_folder, ["scrub"], limit=1)
+    if last and time.time() - last[0]["created_at"] < SCRUB_INTERVAL:
+        return
+    job_queue.submit(files.user_folder, "scrub", "Verify stored files", lambda job: files.scrub(),
+                     priority=PRIORITY_BACKGROUND, limited=False)
+
+def schedule_folder_adoption(files, legacy_folder, owner_id):
+    """Queue moving the user's own uploads out of their old email-named folder
+    
+    Checked once per session with a one-row listing, so users without
+    files in an old folder never get a job. That folder was shared by every
+    account whose email address starts the same way; files other accounts
+    uploaded stay there.
+    """
+    if st.session_state.get("legacy_folder_checked") or legacy_folder == files.user_folder:
+        return
+    st.session_state["legacy_folder_checked"] = True
+    if job_queue.is_active(files.user_folder, "adopt"):
+        return
+    try:
+        if not files.has_legacy_files(legacy_folder):
+            return
+    except Exception as e:
+        st.warning(f"Could not check your old folder: {str(e)}")
+        return
+    job_queue.submit(files.user_folder, "adopt", "Move your files to your new folder",
+                     adopt_job(files, legacy_folder, owner_id))
+
+def schedule_version_gc(files):
+    """Queue a cleanup of the user's superseded file versions now and then
+    
+    Like the scrub, it does not count against the user's job limit.
+    """
+    if job_queue.is_active(files.user_folder, "versions"):
+        return
+    last = job_queue.jobs_for(files.user_folder, ["versions"], limit=1)
+    if last and time.time() - last[0]["created_at"] < VERSION_GC_INTERVAL:
+        return
+    job_queue.submit(files.user_folder, "versions", "Remove old file versions", lambda job: files.collect_versions(),
+                     priority=PRIORITY_BACKGROUND, limited=False)
+
+def describe_job_result(job):
+    """One line summary of a finished job's outcome"""
+    result = job["result"]
+    if job["kind"] in ("upload", "delete", "verify") and isinstance(result, list):
+        failed = [r for r in result if not r["ok"]]
+        verb = {"upload": "Uploaded", "delete": "Deleted", "verify": "Verified"}[job["kind"]]
+        if failed:
+            return f"⚠️ {verb} {len(result) - len(failed)} of {len(result)} files. {len(failed)} failed."
+        return f"✅ {verb} {len(result)} files"
+    if job["kind"] == "upload" and isinstance(result, dict):
+        return {
+            "unchanged": "✅ This file is already uploaded with the same content.",
+            "copied": "✅ File uploaded successfully! Identical content was already stored, so no data had to be transferred.",
+        }.get(result["status"], "✅ File uploaded successfully!")
+    if job["kind"] == "export" and result:
+        failed = [r for r in result["files"] if not r["ok"]]
+        summary = f"{len(result['files']) - len(failed)} files, {format_size(result['size'])}"
+        return f"⚠️ Zip ready with {summary}. {len(failed)} files failed." if failed else f"✅ Zip ready: {summary}"
+    if job["kind"] == "adopt" and result:
+        if not result["moved"] and not result["failed"]:
+            return "✅ None of the files in your old folder were uploaded by you"
+        if result["failed"]:
+            return f"⚠️ Moved {result['moved']} files. {len(result['failed'])} could not be moved."
+        return f"✅ Moved {result['moved']} files to your folder"
+    if job["kind"] == "reindex" and result:
+        return f"✅ Index refreshed: {result['added']} added, {result['updated']} updated, {result['removed']} removed"
+    return "✅ Done"
+
+def show_jobs(user_folder):
+    """Show the user's recent jobs, polling while any of them is unfinished
+    
+    Only the jobs panel reruns while polling. Once the last job finishes the
+    whole page reruns, so the file list and stats pick up the changes.
+    """
+    had_active = any(job["status"] in ACTIVE_STATUSES for job in job_queue.jobs_for(user_folder, VISIBLE_JOB_KINDS, limit=5))
+    
+    @st.fragment(run_every=JOB_POLL_INTERVAL if had_active else None)
+    def jobs_panel():
+        jobs = job_queue.jobs_for(user_folder, VISIBLE_JOB_KINDS, limit=5)
+        active = [job for job in jobs if job["status"] in ACTIVE_STATUSES]
+        if had_active and not active:
+            st.rerun()
+        if not jobs:
+            return
+        with st.expander(f"⚙️ Background jobs ({len(active)} running)" if active else "⚙️ Background jobs", expanded=bool(active)):
+            for job in jobs:
+                if job["status"] in ACTIVE_STATUSES:
+                    label = "Queued" if job["status"] == "queued" else job["message"] or "Working..."
+                    st.progress(job["progress"], text=f"{job['description']} • {label}")
+                    if job["status"] == "queued":
+                        st.button("Cancel", key=f"cancel_job_{job['id']}", on_click=job_queue.cancel, args=(user_folder, job["id"]))
+                elif job["status"] == DONE:
+                    st.markdown(f"**{job['description']}** • {describe_job_result(job)}")
+                    if job["kind"] == "export" and job["result"].get("url") and os.path.exists(job["result"]["archive"]):
+                        # share_server.py streams the archive from disk; the app never reads it
+                        st.link_button("📦 Download zip", job["result"]["url"])
+                    results = {"export": "files", "adopt": "failed"}.get(job["kind"])
+                    results = job["result"][results] if results else job["result"]
+                    failed = [r for r in results if not r["ok"]] if isinstance(results, list) else []
+                    if failed:
+                        st.dataframe([{"File": r["name"], "Error": r["error"]} for r in failed], use_container_width=True, hide_index=True)
+                else:
+                    st.markdown(f"**{job['description']}** • ❌ {job['status'].capitalize()}: {job['error'] or ''}")
+    
+    jobs_panel()
+
+def show_performance():
+    """Show request metrics of all users, to find what saturates the storage API"""
+    st.markdown('<p class="sub-header">Storage API Performance</p>', unsafe_allow_html=True)
+    st.caption(f"Since {datetime.fromtimestamp(metrics.started_at).strftime('%Y-%m-%d %H:%M')}. "
+               "Latency percentiles are estimated from histogram buckets.")
+    
+    def rows(summaries, label):
+        # Busiest first: total time spent waiting is what saturates the API
+        return [
+            {
+                label: name,
+                "Requests": s["requests"],
+                "Errors": s["errors"],
+                "Error rate": f"{s['error_rate']:.1%}",
+                "Retries": s["retries"],
+                "p50 (ms)": round(s["p50"] * 1000, 1),
+                "p95 (ms)": round(s["p95"] * 1000, 1),
+                "p99 (ms)": round(s["p99"] * 1000, 1),
+                "Total time (s)": round(s["total_time"], 2),
+                "Sent": format_size(s["bytes_sent"]),
+                "Received": format_size(s["bytes_received"]),
+            }
+            for name, s in sorted(summaries.items(), key=lambda item: item[1]["total_time"], reverse=True)
+        ]
+    
+    by_operation = metrics.by_operation()
+    if not by_operation:
+        st.info("No requests recorded yet.")
+        return
+    
+    in_flight = metrics.in_flight()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Requests", sum(s["requests"] for s in by_operation.values()))
+    col2.metric("Errors", sum(s["errors"] for s in by_operation.values()))
+    col3.metric("In flight now", sum(current for current, _ in in_flight.values()))
+    
+    st.markdown("### By operation")
+    operation_rows = rows(by_operation, "Operation")
+    for row in operation_rows:
+        row["Peak concurrent"] = in_flight.get(row["Operation"], (0, 0))[1]
+    st.dataframe(operation_rows, hide_index=True, use_container_width=True)
+    
+    st.markdown("### By user")
+    st.dataframe(rows(metrics.by_user(), "User"), hide_index=True, use_container_width=True)
+    
+    with st.expander("By user and operation"):
+        st.dataframe(
+            rows({f"{user} • {operation}": s for (operation, user), s in metrics.series().items()}, "User • Operation"),
+            hide_index=True,
+            use_container_width=True,
+        )
+    
+    errors = metrics.recent_errors()
+    if errors:
+        st.markdown("### Recent errors")
+        st.dataframe(
+            [
+                {"Time": datetime.fromtimestamp(e["time"]).strftime("%H:%M:%S"), "Operation": e["operation"],
+                 "User": e["user"], "Error": e["error"], "Latency (ms)": round(e["seconds"] * 1000, 1)}
+                for e in errors
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+    
+    st.markdown("### Client cache")
+    st.json(client_manager.stats())
+    
+    st.markdown("### Upload limits")
+    st.json(get_limits().stats())
+    st.download_button("⬇️ Export metrics (Prometheus text)", data=metrics.render(), file_name="fileshare-metrics.txt",
+                       mime="text/plain", on_click="ignore")
+
+@st.fragment
+def upload_panel(files):
+    """The Upload Files tab
+
+    A fragment, so picking files and changing options rerun only this panel
+    rather than redrawing the file list. Submitting reruns the whole page so
+    the jobs panel starts polling.
+    """
+    st.markdown('<p class="sub-header">Upload New Files</p>', unsafe_allow_html=True)
+    user_folder = files.user_folder
+    
+    usage = files.usage()
+    if usage["max_bytes"]:
+        st.progress(min(usage["total_size"] / usage["max_bytes"], 1.0),
+                    text=f"{format_size(usage['total_size'])} of {format_size(usage['max_bytes'])} used"
+                         + (f", {format_size(usage['versions_size'])} by earlier versions" if usage["versions_size"] else ""))
+    if usage["max_files"]:
+        st.caption(f"{usage['file_count']} of {usage['max_files']} files")
+    
+    with st.container():
+        st.markdown('<div class="upload-area">', unsafe_allow_html=True)
+        upload_mode = st.radio("Upload mode", ["Single file", "Multiple files"], horizontal=True, label_visibility="collapsed")
+        compress_uploads = st.checkbox("Compress text, CSV, JSON and log files", value=True, help="Compressible files are stored compressed and decompressed again when downloaded")
+        # Defaults to the folder open on the My Files tab
+        if "upload_folder" not in st.session_state:
+            st.session_state["upload_folder"] = st.session_state.get("files_folder", "")
+        folder = clean_folder(st.text_input("Upload to folder", key="upload_folder", placeholder="📁 Top folder, or e.g. photos/2024"))
+        if folder is None:
+            st.error("❌ Folder names cannot start with a dot or lead outside your folder.")
+        if upload_mode == "Single file":
+            uploaded_file = st.file_uploader("Choose a file to upload", accept_multiple_files=False, label_visibility="collapsed")
+            uploaded_files = []
+        else:
+            uploaded_file = None
+            uploaded_files = st.file_uploader("Choose files to upload", accept_multiple_files=True, label_visibility="collapsed")
+        
+        if uploaded_file:
+            file_details = {
+                "Filename": uploaded_file.name,
+                "File size": format_size(uploaded_file.size),
+                "File type": uploaded_file.type if uploaded_file.type else "Unknown"
+            }
+            
+            # Display file details
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                st.markdown(f"<div style='font-size:50px; text-align:center;'>{classify(uploaded_file.name, uploaded_file.type)[2]}</div>", unsafe_allow_html=True)
+            
+            with col2:
+                for key, value in file_details.items():
+                    st.markdown(f"**{key}:** {value}")
+            
+            # Upload button
+            if st.button("📤 Upload File", type="primary", use_container_width=True, disabled=folder is None):
+                try:
+                    # Rejected here rather than after the job has hashed the file
+                    files.check_quota(uploaded_file.size)
+                except QuotaExceeded as e:
+                    st.error(f"❌ {e}")
+                else:
+                    # The upload runs in the background; its progress shows in the jobs panel
+                    job_queue.submit(user_folder, "upload", f"Upload {uploaded_file.name}", upload_file_job(files, uploaded_file, compress_uploads, folder))
+                    st.rerun()
+        elif uploaded_files:
+            col1, col2 = st.columns(2)
+            with col1:
+                extract_zips = st.checkbox("Extract .zip files as folders", value=True)
+            with col2:
+                concurrency = st.slider("Parallel uploads", min_value=1, max_value=16, value=MAX_CONCURRENT_UPLOADS)
+            
+            total_size = sum(f.size for f in uploaded_files)
+            st.markdown(f"**{len(uploaded_files)} files selected** • {format_size(total_size)}")
+            
+            if st.button(f"📤 Upload {len(uploaded_files)} Files", type="primary", use_container_width=True, disabled=folder is None):
+                try:
+                    items = []
+                    for f in uploaded_files:
+                        if extract_zips and f.name.lower().endswith(".zip"):
+                            # The archive's name becomes a folder, so it follows the same rules
+                            folder_name = clean_folder(os.path.splitext(f.name)[0])
+                            if not folder_name:
+                                raise ValueError(f"{f.name} cannot be extracted: folder names cannot start with a dot")
+                            items.extend(items_from_zip(f, f"{files.folder_path(folder)}/{folder_name}"))
+                        else:
+                            items.append(BatchItem(f.name, f"{files.folder_path(folder)}/{f.name}", f.size, lambda f=f: f, content_type=f.type))
+                except Exception as e:
+                    st.error(f"❌ Error reading files: {str(e)}")
+                    items = []
+                
+                if items:
+                    try:
+                        files.check_quota(sum(item.size for item in items), len(items))
+                    except QuotaExceeded as e:
+                        st.error(f"❌ {e}")
+                        items = []
+                
+                if items:
+                    job_queue.submit(user_folder, "upload", f"Upload {len(items)} files", upload_batch_job(files, items, concurrency, compress_uploads))
+                    st.rerun()
+        else:
+            st.markdown("""
+                <div style="text-align:center; padding:30px;">
+                    <div style="font-size:40px; margin-bottom:20px;">🔽</div>
+                    <div style="color:#666;">Drag and drop your files here or click to browse</div>
+                </div>
+            """, unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def file_card(files, file_info, file_url, thumbnail_url, encoding, folder=""):
+    """One file on the My Files tab, with download, delete and preview
+    
+    A fragment, so confirming a delete or toggling the preview reruns only
+    this card. The selection checkbox is drawn by the panel instead, since
+    the batch buttons count the selection. The name is shown relative to
+    the open ``folder``.
+    """
+    file_name = file_info['name']
+    label = file_name[len(folder) + 1:] if folder else file_name
+    metadata = file_info.get('metadata') or {}
+    mime_type, icon, file_size, last_modified = card_details(
+        file_name,
+        metadata.get('mimetype'),
+        metadata.get('size'),
+        file_info.get("updated_at") or file_info.get("created_at")
+    )
+    
+    # Widget keys stay per file name so state survives paging and reruns
+    confirm_key = f"confirm_delete_{file_name}"
+    
+    def set_confirm(value):
+        st.session_state[confirm_key] = value
+    
+    # File name and basic info
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        if thumbnail_url:
+            st.markdown(f'<img src="{thumbnail_url}" class="file-thumbnail" alt="{file_name}" loading="lazy">', unsafe_allow_html=True)
+        st.markdown(f'<div class="file-name">{icon} {label}</div>', unsafe_allow_html=True)
+        compressed_note = " • 🗜️ Compressed" if encoding else ""
+        st.markdown(f'<div class="file-info">Size: {file_size} • Last modified: {last_modified}{compressed_note}</div>', unsafe_allow_html=True)
+    
+    with col2:
+        col_a, col_b, col_c, col_d = st.columns(4)
+        with col_a:
+            if encoding:
+                st.download_button(
+                    "📥",
+                    # Checked against the upload checksum before it is decompressed
+                    data=lambda: files.download(file_name),
+                    file_name=file_name,
+                    mime=mime_type,
+                    key=f"download_{file_name}",
+                    on_click="ignore",
+                )
+            else:
+                st.markdown(f'<a href="{download_url(file_url, file_name)}" target="_blank"><button style="border-radius:20px; padding:2px 10px; background-color:#2E7D32; color:white; border:none; width:100%;">📥</button></a>', unsafe_allow_html=True)
+        
+        with col_b:
+            if st.session_state.get(confirm_key):
+                confirmed = st.button("✓", key=f"confirm_delete_button_{file_name}", help="Confirm deletion")
+                st.button("✗", key=f"cancel_delete_{file_name}", help="Cancel deletion", on_click=set_confirm, args=(False,))
+                if confirmed:
+                    st.session_state[confirm_key] = False
+                    files.delete([file_name])
+                    st.session_state["selected_files"].discard(file_name)
+                    # The listing cache is already patched, so the card is gone
+                    # from the next rerun of the panel; until then it says so
+                    st.success(f"✅ Deleted {file_name}")
+                    return
+            else:
+                st.button("🗑️", key=f"delete_{file_name}", help="Delete file", on_click=set_confirm, args=(True,))
+        
+        with col_c:
+            with st.popover("🔗", help="Share a download link"):
+                duration = st.selectbox("Link expires after", list(SHARE_DURATIONS), index=1, key=f"share_duration_{file_name}")
+                if st.button("Create link", key=f"share_{file_name}", use_container_width=True):
+                    try:
+                        st.session_state[f"share_link_{file_name}"] = files.share(file_name, SHARE_DURATIONS[duration])
+                    except Exception as e:
+                        st.error(f"❌ Could not share {file_name}: {str(e)}")
+                link = st.session_state.get(f"share_link_{file_name}")
+                if link and link["expires_at"] > time.time():
+                    st.code(link["url"], language=None)
+                    st.caption(f"Works until {datetime.fromtimestamp(link['expires_at']).strftime('%Y-%m-%d %H:%M')}")
+        
+        with col_d:
+            with st.popover("🕘", help="Earlier versions"):
+                versions = files.versions_of(file_name)
+                if len(versions) < 2:
+                    st.caption("No earlier versions. Uploading a file with the same name keeps this one as a version.")
+                for version in versions:
+                    created = datetime.fromtimestamp(version["created_at"]).strftime('%Y-%m-%d %H:%M')
+                    ver_col, restore_col = st.columns([3, 1])
+                    ver_col.markdown(f"{created} • {format_size(version['size'])}{' • current' if version['current'] else ''}")
+                    if not version["current"] and restore_col.button("Restore", key=f"restore_{file_name}_{version['version']}"):
+                        try:
+                            files.restore(file_name, version["version"])
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"❌ Could not restore {file_name}: {str(e)}")
+    
+    # The preview is only rendered while open, so a page of cards does not
+    # embed a player or document viewer per file
+    if st.toggle("Preview", key=f"preview_{file_name}"):
+        st.markdown(get_file_preview(file_url, mime_type, file_name, thumbnail_url), unsafe_allow_html=True)
+        if not encoding:
+            st.markdown(f'<a href="{file_url}" target="_blank" style="text-decoration:none;"><button style="margin-top:10px; width:100%; padding:5px; background-color:#1976D2; color:white; border:none; border-radius:4px;">Open in New Tab</button></a>', unsafe_allow_html=True)
+
+@st.fragment
+def files_panel(files):
+    """The My Files tab: search, batch actions and one page of file cards
+    
+    A fragment, so searching, sorting, paging and selecting rerun only this
+    panel. Each card is a fragment of its own within it.
+    """
+    st.markdown('<p class="sub-header">My Files</p>', unsafe_allow_html=True)
+    try:
+        user_folder = files.user_folder
+        
+        def reset_page():
+            st.session_state["files_page"] = 0
+        
+        # The open sub-folder, relative to the user folder; only its own
+        # listing is fetched, sub-folders are listed when they are opened
+        folder = st.session_state.get("files_folder", "")
+        
+        def open_folder(path):
+            st.session_state["files_folder"] = path
+            # Uploads go where the user is looking
+            st.session_state["upload_folder"] = path
+            reset_page()
+        
+        # Names of files ticked for batch actions, kept across pages
+        if "selected_files" not in st.session_state:
+            st.session_state["selected_files"] = set()
+        selected_files = st.session_state["selected_files"]
+        
+        def set_selected(names, value):
+            for name in names:
+                if value:
+                    selected_files.add(name)
+                else:
+                    selected_files.discard(name)
+                st.session_state[f"select_{name}"] = value
+        
+        def toggle_selected(name):
+            set_selected([name], st.session_state[f"select_{name}"])
+        
+        # Create a search box, type, sort and page size selectors and a button to refresh the file list
+        col1, col2, col3, col4, col5 = st.columns([2, 1, 1, 1, 1])
+        with col1:
+            name_filter = st.text_input("Search by name", placeholder="🔍 Search by name", key="files_filter", on_change=reset_page, label_visibility="collapsed")
+        with col2:
+            type_filter = st.selectbox("File type", [None, *CATEGORY_ICONS], key="files_type", on_change=reset_page, label_visibility="collapsed",
+                                       format_func=lambda category: f"{CATEGORY_ICONS[category]} {category.capitalize()}" if category else "All types")
+        with col3:
+            sort_label = st.selectbox("Sort by", list(SORT_OPTIONS), key="files_sort", on_change=reset_page, label_visibility="collapsed")
+        with col4:
+            page_size = st.selectbox("Files per page", PAGE_SIZES, index=1, key="files_page_size", on_change=reset_page, label_visibility="collapsed", format_func=lambda size: f"{size} per page")
+        with col5:
+            if st.button("🔄 Refresh", use_container_width=True):
+                # Drops the cached listings of the user folder and every folder below it
+                listing_cache.invalidate(user_folder)
+                schedule_reindex(files)
+                # Rerun the whole page so the jobs panel follows the reindex
+                st.rerun()
+        
+        sort_column, sort_descending = SORT_OPTIONS[sort_label]
+        use_index = bool(name_filter) or bool(type_filter) or sort_label != "Name"
+        if use_index and metadata_index.needs_sync(user_folder):
+            # Searching and sorting are answered by the local index, which is resynced with the bucket once a day
+            schedule_reindex(files)
+            if metadata_index.synced_at(user_folder) is None:
+                st.info("⏳ Indexing your files for search and sorting. Results will appear shortly.")
+        page = st.session_state.get("files_page", 0)
+        
+        def load_page(page):
+            # Only the current page is fetched and rendered; later pages load when visited.
+            # Searches and filters cover the open folder and everything below it.
+            return files.list_page(page, page_size, name_filter, sort=sort_column, descending=sort_descending, category=type_filter, folder=folder)
+        
+        def select_matching():
+            set_selected([f["name"] for f in metadata_index.search(user_folder, name_filter, limit=None, category=type_filter, folder=folder or None)], True)
+        
+        entries, has_more = load_page(page)
+        if not entries and page > 0:
+            # The page emptied out, e.g. after deletes; go back to the start
+            reset_page()
+            page = 0
+            entries, has_more = load_page(page)
+        folders = [entry for entry in entries if is_folder(entry)]
+        file_list = [entry for entry in entries if not is_folder(entry)]
+        
+        if folder:
+            col1, col2 = st.columns([1, 5])
+            col1.button("⬆️ Up", use_container_width=True, on_click=open_folder, args=(posixpath.dirname(folder),))
+            col2.markdown(f"📂 **{folder}**")
+        if folders:
+            columns = st.columns(4)
+            for i, entry in enumerate(folders):
+                columns[i % 4].button(f"📁 {posixpath.basename(entry['name'])}", key=f"folder_{entry['name']}", use_container_width=True,
+                                      on_click=open_folder, args=(entry["name"],))
+        
+        # Files the scrubber or a download found damaged or gone
+        issues = metadata_index.integrity_issues(user_folder)
+        if issues:
+            offset = len(user_folder) + 1
+            st.warning(f"⚠️ {len(issues)} files failed integrity checks and should be uploaded again: "
+                       + ", ".join(f"{path[offset:]} ({status})" for path, status in list(issues.items())[:10])
+                       + (" ..." if len(issues) > 10 else ""))
+        
+        shared = files.shared_links()
+        if shared:
+            with st.expander(f"🔗 {len(shared)} shared links"):
+                for link in shared:
+                    col1, col2, col3 = st.columns([2, 3, 1])
+                    col1.markdown(f"**{link['name']}**  \nuntil {datetime.fromtimestamp(link['expires_at']).strftime('%Y-%m-%d %H:%M')}")
+                    col2.code(link["url"], language=None)
+                    col3.button("Revoke", key=f"revoke_{link['token']}", on_click=files.revoke_shares, args=([link["token"]],))
+        
+        # Batch actions on the selection
+        col1, col2, col3, col4, col5 = st.columns([1, 1, 1, 1, 1])
+        with col1:
+            if (name_filter or type_filter) and file_list:
+                st.button(f"☑️ Select all {metadata_index.count(user_folder, name_filter, category=type_filter, folder=folder or None)} matching", use_container_width=True, on_click=select_matching)
+            else:
+                st.button("☑️ Select page", use_container_width=True, disabled=not file_list, on_click=set_selected, args=([f["name"] for f in file_list], True))
+        with col2:
+            st.button("Clear selection", use_container_width=True, disabled=not selected_files, on_click=set_selected, args=(list(selected_files), False))
+        with col3:
+            if st.button(f"🗑️ Delete {len(selected_files)} selected", use_container_width=True, disabled=not selected_files):
+                st.session_state["confirm_batch_delete"] = True
+        with col4:
+            # Archives are built in the background and offered in the jobs panel
+            if selected_files:
+                if st.button(f"📦 Zip {len(selected_files)} selected", use_container_width=True):
+                    job_queue.submit(user_folder, "export", f"Zip {len(selected_files)} files", export_job(files, sorted(selected_files)))
+                    st.rerun()
+            elif st.button("📦 Zip whole folder", use_container_width=True, disabled=not file_list):
+                job_queue.submit(user_folder, "export", "Zip whole folder", export_job(files))
+                st.rerun()
+        with col5:
+            # Reads the files back from storage; large ones in parallel ranges
+            if st.button(f"🛡️ Verify {len(selected_files)} selected", use_container_width=True, disabled=not selected_files):
+                job_queue.submit(user_folder, "verify", f"Verify {len(selected_files)} files", verify_job(files, sorted(selected_files)))
+                st.rerun()
+        
+        if st.session_state.get("confirm_batch_delete") and selected_files:
+            st.warning(f"Delete {len(selected_files)} files? This cannot be undone.")
+            col1, col2 = st.columns(2)
+            with col1:
+                confirm_batch = st.button("✓ Delete files", type="primary", use_container_width=True)
+            with col2:
+                if st.button("✗ Cancel", use_container_width=True):
+                    st.session_state["confirm_batch_delete"] = False
+            
+            if confirm_batch:
+                st.session_state["confirm_batch_delete"] = False
+                names = sorted(selected_files)
+                # The files are deleted in the background and the caches patched as batches finish
+                job_queue.submit(user_folder, "delete", f"Delete {len(names)} files", delete_job(files, names))
+                set_selected(names, False)
+                st.rerun()
+        
+        if not file_list and name_filter:
+            st.info("🔍 No files match the filter.")
+        elif not file_list and (folder or folders):
+            if not folders:
+                st.info("📂 This folder is empty.")
+        elif not file_list:
+            st.info("📂 You haven't uploaded any files yet.")
+            st.markdown("""
+                <div style="text-align:center; padding:50px; color:#666;">
+                    <div style="font-size:60px;">🗂️</div>
+                    <div style="margin-top:20px;">Your files will appear here after upload</div>
+                </div>
+            """, unsafe_allow_html=True)
+        else:
+            # Sign the whole page in one request; cached URLs are reused on later reruns.
+            # Thumbnails are built in the background; until one is ready the card shows the icon.
+            # Files stored compressed are decompressed by the app when downloaded.
+            links = files.page_links(file_list)
+            file_urls = links["urls"]
+            encodings = links["encodings"]
+            thumbnails = links["thumbnails"]
+            thumbnail_urls = links["thumbnail_urls"]
+            
+            # Display files with download and delete options
+            for file_info in file_list:
+                try:
+                    file_name = file_info['name']
+                    file_path = files.path(file_name)
+                    thumbnail = thumbnails[file_name]
+                    
+                    with st.container():
+                        st.markdown('<div class="file-card">', unsafe_allow_html=True)
+                        # Selecting changes the batch buttons above, so the
+                        # checkbox reruns the panel rather than just the card
+                        select_key = f"select_{file_name}"
+                        if select_key not in st.session_state:
+                            st.session_state[select_key] = file_name in selected_files
+                        st.checkbox("Select", key=select_key, on_change=toggle_selected, args=(file_name,), label_visibility="collapsed")
+                        file_card(
+                            files,
+                            file_info,
+                            file_urls[file_path],
+                            thumbnail_urls[thumbnail] if thumbnail else None,
+                            encodings.get(file_path),
+                            folder
+                        )
+                        st.markdown('</div>', unsafe_allow_html=True)
+                except Exception as e:
+                    st.error(f"Error processing file {file_info.get('name', 'unknown')}: {e}")
+                    # Failed storage requests are already counted in metrics by the instrumented transport
+                    logger.exception("Could not show file %s", file_info.get("name"))
+                    continue  # Skip to the next file if there's an error
+        
+        # Page navigation; a page may hold only sub-folders
+        if entries:
+            def change_page(step):
+                st.session_state["files_page"] = page + step
+            
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                st.button("◀ Previous", disabled=page == 0, on_click=change_page, args=(-1,), use_container_width=True)
+            with col2:
+                st.markdown(f'<div style="text-align:center; padding-top:8px;">Page {page + 1}</div>', unsafe_allow_html=True)
+            with col3:
+                st.button("Next ▶", disabled=not has_more, on_click=change_page, args=(1,), use_container_width=True)
+    except Exception as e:
+        st.error(f"Error loading files: {str(e)}")
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def load_stats(_files, user_folder, generation):
+    """Storage statistics of a user, cached per generation of their index
+    
+    Any upload, delete or resync bumps the generation, so the Stats tab only
+    queries the index again after something changed.
+    """
+    return _files.stats()
+
+@st.fragment
+def stats_panel(files):
+    """The Stats tab
+    
+    A fragment with its own refresh button, so picking up changes made by
+    background jobs does not redraw the file list.
+    """
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.markdown('<p class="sub-header">Storage Statistics</p>', unsafe_allow_html=True)
+    with col2:
+        st.button("🔄 Refresh stats", key="refresh_stats", use_container_width=True)
+    
+    try:
+        user_folder = files.user_folder
+        
+        # Totals are maintained by the metadata index, so reading them does not walk the folder
+        if metadata_index.needs_sync(user_folder):
+            schedule_reindex(files)
+            if metadata_index.synced_at(user_folder) is None:
+                st.info("⏳ Indexing your files. Statistics will appear shortly.")
+        stats = load_stats(files, user_folder, metadata_index.generation(user_folder))
+        total_files = stats["file_count"]
+        total_size = stats["total_size"]
+        
+        # Display statistics in columns
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.markdown("""
+                <div style="background-color:#000000; padding:20px; border-radius:10px; text-align:center;">
+                    <div style="font-size:30px;">📁</div>
+                    <div style="font-size:36px; font-weight:bold;">{}</div>
+                    <div style="color:#666;">Total Files</div>
+                </div>
+            """.format(total_files), unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown("""
+                <div style="background-color:#000000; padding:20px; border-radius:10px; text-align:center;">
+                    <div style="font-size:30px;">💾</div>
+                    <div style="font-size:36px; font-weight:bold;">{}</div>
+                    <div style="color:#666;">Storage Used</div>
+                </div>
+            """.format(format_size(total_size)), unsafe_allow_html=True)
+        
+        with col3:
+            # Same categories as the file icons and the type filter
+            if total_files > 0 and stats["categories"]:
+                most_common_type = max(stats["categories"].items(), key=lambda item: item[1][0])[0]
+                type_display = f"{CATEGORY_ICONS.get(most_common_type, '📁')} {most_common_type.capitalize()}"
+            else:
+                type_display = "None"
+            
+            st.markdown("""
+                <div style="background-color:#000000; padding:20px; border-radius:10px; text-align:center;">
+                    <div style="font-size:30px;">📊</div>
+                    <div style="font-size:36px; font-weight:bold;">{}</div>
+                    <div style="color:#666;">Most Common Type</div>
+                </div>
+            """.format(type_display), unsafe_allow_html=True)
+        
+        # Breakdowns below are read from aggregates the index maintains on every change
+        if total_files > 0:
+            st.markdown("### Storage over time")
+            growth = stats["growth"]
+            st.line_chart(
+                pd.DataFrame(
+                    {"Storage used (MB)": [size / (1024 * 1024) for _, _, size in growth]},
+                    index=pd.to_datetime([day for day, _, _ in growth]),
+                )
+            )
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("### File sizes")
+                histogram = stats["histogram"]
+                st.bar_chart(
+                    pd.DataFrame(
+                        {"Files": [count for _, count, _ in histogram]},
+                        index=pd.CategoricalIndex([label for label, _, _ in histogram],
+                                                  categories=[label for label, _, _ in histogram], ordered=True),
+                    )
+                )
+            with col2:
+                st.markdown("### Space by type")
+                categories = sorted(stats["categories"].items(),
+                                    key=lambda item: item[1][1], reverse=True)
+                st.dataframe(
+                    [
+                        {"Type": f"{CATEGORY_ICONS.get(category, '📁')} {category.capitalize()}", "Files": count, "Size": format_size(size)}
+                        for category, (count, size) in categories
+                    ],
+                    hide_index=True,
+                    use_container_width=True,
+                )
+            
+            st.markdown("### Largest files")
+            st.dataframe(
+                [
+                    {"Name": entry["name"], "Size": format_size(entry["metadata"]["size"]),
+                     "Uploaded": entry["created_at"]}
+                    for entry in stats["largest"]
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+        
+    except Exception as e:
+        st.error(f"Error generating statistics: {str(e)}")
 
 # -------------------------
 # Sidebar Authentication
@@ -180,9 +1090,9 @@ if "user" not in st.session_state:
                             st.session_state["user"] = auth_response.user
                             st.session_state["access_token"] = auth_response.session.access_token
                             st.session_state["refresh_token"] = auth_response.session.refresh_token
-                            st.success("✅ Logged in successfully!")
-                            time.sleep(1)
-                             # Rerun to refresh the page with the new user
+                            st.session_state["client_session_id"] = uuid.uuid4().hex
+                            # Rerun to refresh the page with the new user
+                            st.rerun()
                         else:
                             st.error("❌ Invalid credentials")
                     except Exception as e:
@@ -214,17 +1124,17 @@ else:
         # Logout button
         if st.button("🚪 Logout", use_container_width=True):
             try:
-                supabase.auth.sign_out()
+                session_client = client_manager.remove(st.session_state.get("client_session_id"))
+                (session_client or supabase).auth.sign_out()
             except:
                 pass  # Ignore errors during logout
             
             # Clear session state
-            for key in ["user", "access_token", "refresh_token"]:
+            for key in ["user", "access_token", "refresh_token", "client_session_id"]:
                 if key in st.session_state:
                     st.session_state.pop(key)
             
-            st.success("Logged out successfully!")
-            time.sleep(1)
+            st.rerun()
             
         
         # Add some useful info
@@ -244,318 +1154,59 @@ else:
 if "user" in st.session_state:
     user = st.session_state["user"]
     
-    # IMPORTANT: Get an authenticated Supabase client using both tokens
-    authenticated_supabase = get_client(
-        access_token=st.session_state["access_token"],
-        refresh_token=st.session_state["refresh_token"]
+    # IMPORTANT: Get the authenticated Supabase client for this session. The
+    # manager reuses it across reruns and only refreshes tokens near expiry.
+    if "client_session_id" not in st.session_state:
+        st.session_state["client_session_id"] = uuid.uuid4().hex
+    authenticated_supabase, access_token, refresh_token = client_manager.get(
+        st.session_state["client_session_id"],
+        st.session_state["access_token"],
+        st.session_state["refresh_token"]
+    )
+    st.session_state["access_token"] = access_token
+    st.session_state["refresh_token"] = refresh_token
+    
+    # Storage operations on the user's folder, shared by the tabs and background jobs.
+    # Folders are named after the user ID, which unlike the email is unique and never changes.
+    files = FileService(
+        authenticated_supabase,
+        user.id,
+        thumbnail_service=thumbnail_service,
+        http_client=client_manager.http_client,
+        clients=client_manager
     )
 
     # Main content
     st.markdown('<h1 class="main-header">📁 FileShare Hub</h1>', unsafe_allow_html=True)
     
+    # Uploads and deletes keep running when the page reloads; their progress is shown here
+    show_jobs(user.id)
+    
+    # Files uploaded when folders were named after the email move over by themselves
+    if user.email:
+        schedule_folder_adoption(files, user.email.split('@')[0], user.id)
+    
+    # Stored files are re-verified against their upload checksums in the background
+    schedule_scrub(files)
+    # Versions beyond FILESHARE_KEEP_VERSIONS are removed in the background as well
+    schedule_version_gc(files)
+    
     # Create tabs for upload and view functionality
-    tabs = st.tabs(["📤 Upload Files", "📋 My Files", "📊 Stats"])
+    is_admin = user.email.lower() in ADMIN_EMAILS
+    tabs = st.tabs(["📤 Upload Files", "📋 My Files", "📊 Stats"] + (["⚡ Performance"] if is_admin else []))
     
     with tabs[0]:  # Upload Files tab
-        st.markdown('<p class="sub-header">Upload New Files</p>', unsafe_allow_html=True)
-        
-        with st.container():
-            st.markdown('<div class="upload-area">', unsafe_allow_html=True)
-            uploaded_file = st.file_uploader("Choose a file to upload", accept_multiple_files=False, label_visibility="collapsed")
-            
-            if uploaded_file:
-                file_details = {
-                    "Filename": uploaded_file.name,
-                    "File size": format_size(uploaded_file.size),
-                    "File type": uploaded_file.type if uploaded_file.type else "Unknown"
-                }
-                
-                # Display file details
-                col1, col2 = st.columns([1, 3])
-                with col1:
-                    st.markdown(f"<div style='font-size:50px; text-align:center;'>{get_file_icon(uploaded_file.type)}</div>", unsafe_allow_html=True)
-                
-                with col2:
-                    for key, value in file_details.items():
-                        st.markdown(f"**{key}:** {value}")
-                
-                # Upload button
-                if st.button("📤 Upload File", type="primary", use_container_width=True):
-                    try:
-                        # Create a folder path using the user's email
-                        user_folder = user.email.split('@')[0]  # Use username part of email
-                        path_on_supabase = f"{user_folder}/{uploaded_file.name}"
-
-                        # Read file content
-                        file_data = uploaded_file.read()
-
-                        # Upload to Supabase with authenticated client
-                        result = authenticated_supabase.storage.from_("fileuploads").upload(
-                            path_on_supabase,
-                            file=file_data,
-                            file_options={"content-type": uploaded_file.type}
-                        )
-                        
-                        st.success("✅ File uploaded successfully!")
-                        time.sleep(1)  # Give a moment for the success message to be seen
-                         # Refresh to update file list
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error uploading file: {str(e)}")
-            else:
-                st.markdown("""
-                    <div style="text-align:center; padding:30px;">
-                        <div style="font-size:40px; margin-bottom:20px;">🔽</div>
-                        <div style="color:#666;">Drag and drop your files here or click to browse</div>
-                    </div>
-                """, unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-                
+        upload_panel(files)
     
     with tabs[1]:  # My Files tab
-        st.markdown('<p class="sub-header">My Files</p>', unsafe_allow_html=True)
-        try:
-            # Get user folder name from email (same logic as when uploading)
-            user_folder = user.email.split('@')[0]
-            
-            # Create a button to refresh the file list
-            col1, col2 = st.columns([3, 1])
-            with col2:
-                if st.button("🔄 Refresh", use_container_width=True):
-                    file_list = authenticated_supabase.storage.from_("fileuploads").list(user_folder)
-            
-            if not file_list:
-                st.info("📂 You haven't uploaded any files yet.")
-                st.markdown("""
-                    <div style="text-align:center; padding:50px; color:#666;">
-                        <div style="font-size:60px;">🗂️</div>
-                        <div style="margin-top:20px;">Your files will appear here after upload</div>
-                    </div>
-                """, unsafe_allow_html=True)
-            else:
-                # Define a safer format_size function in case the original is causing issues
-                def safe_format_size(size_bytes):
-                    """
-                    A safer version that ensures we're working with integers
-                    """
-                    try:
-                        # Make sure we have an integer
-                        if not isinstance(size_bytes, (int, float)):
-                            try:
-                                size_bytes = int(float(str(size_bytes).strip()))
-                            except (ValueError, TypeError):
-                                size_bytes = 0
-                        
-                        # Now format the size
-                        if size_bytes < 1024:
-                            return f"{size_bytes} B"
-                        elif size_bytes < 1024 * 1024:
-                            return f"{size_bytes/1024:.1f} KB"
-                        elif size_bytes < 1024 * 1024 * 1024:
-                            return f"{size_bytes/(1024*1024):.1f} MB"
-                        else:
-                            return f"{size_bytes/(1024*1024*1024):.1f} GB"
-                    except Exception as e:
-                        print(f"Error in safe_format_size: {e}")
-                        return "0 B"
-
-                # Display files with download and delete options
-                for file_info in file_list:
-                    try:
-                        file_name = file_info['name']
-                        
-                        # More robust size handling
-                        try:
-                            file_size_value = file_info.get('metadata', {}).get('size', 0)
-                            if file_size_value is None:
-                                file_size_value = 0
-                            
-                            # Try using our safer function
-                            file_size = safe_format_size(file_size_value)
-                        except Exception as e:
-                            print(f"Error processing file size for {file_name}: {e}")
-                            file_size = "Unknown"
-                        
-                        file_path = f"{user_folder}/{file_name}"
-                        
-                        # Safer timestamp handling
-                        try:
-                            created_at = file_info.get("Added on", 0)
-                            if created_at is None:
-                                created_at = 0
-                            
-                            # Convert string timestamp to integer if needed
-                            if isinstance(created_at, str):
-                                created_at = int(float(created_at))
-                            elif not isinstance(created_at, (int, float)):
-                                created_at = 0
-                                
-                            last_modified = datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M")
-                        except Exception as e:
-                            print(f"Error processing timestamp for {file_name}: {e}")
-                            last_modified = "Unknown date"
-                        
-                        # Guess the mime type from file extension
-                        mime_type, _ = mimetypes.guess_type(file_name)
-                        mime_type = mime_type if mime_type else "application/octet-stream"
-                        
-                        # Create a container for each file with actions
-                        with st.container():
-                            st.markdown(f'<div class="file-card">', unsafe_allow_html=True)
-                            
-                            # File name and basic info
-                            col1, col2 = st.columns([3, 1])
-                            
-                            with col1:
-                                st.markdown(f'<div class="file-name">{get_file_icon(mime_type)} {file_name}</div>', unsafe_allow_html=True)
-                                st.markdown(f'<div class="file-info">Size: {file_size} • Last modified: {last_modified}</div>', unsafe_allow_html=True)
-                            
-                            with col2:
-                                # Generate a download URL
-                                file_url = authenticated_supabase.storage.from_("fileuploads").get_public_url(file_path)
-                                
-                                col_a, col_b = st.columns(2)
-                                with col_a:
-                                    st.markdown(f'<a href="{file_url}" target="_blank"><button style="border-radius:20px; padding:2px 10px; background-color:#2E7D32; color:white; border:none; width:100%;">📥</button></a>', unsafe_allow_html=True)
-                                
-                                with col_b:
-                                    # Create a unique key for each delete button
-                                    delete_key = f"delete_{file_name}"
-                                    
-                                    # Create a session state key for each file's delete confirmation
-                                    confirm_key = f"confirm_delete_{file_name}"
-                                    if confirm_key not in st.session_state:
-                                        st.session_state[confirm_key] = False
-                                    
-                                    if st.session_state[confirm_key]:
-                                        if st.button("✓", key=f"confirm_{delete_key}", help="Confirm deletion"):
-                                            authenticated_supabase.storage.from_("fileuploads").remove([file_path])
-                                            st.success(f"✅ Deleted {file_name}")
-                                            st.session_state[confirm_key] = False
-                                            time.sleep(1)
-                                            
-                                        if st.button("✗", key=f"cancel_{delete_key}", help="Cancel deletion"):
-                                            st.session_state[confirm_key] = False
-                                            
-                                    else:
-                                        if st.button("🗑️", key=delete_key, help="Delete file"):
-                                            st.session_state[confirm_key] = True
-                                            
-                            
-                            # File preview
-                            with st.expander("Preview"):
-                                file_url = authenticated_supabase.storage.from_("fileuploads").get_public_url(file_path)
-                                st.markdown(get_file_preview(file_url, mime_type, file_name), unsafe_allow_html=True)
-                                st.markdown(f'<a href="{file_url}" target="_blank" style="text-decoration:none;"><button style="margin-top:10px; width:100%; padding:5px; background-color:#1976D2; color:white; border:none; border-radius:4px;">Open in New Tab</button></a>', unsafe_allow_html=True)
-                            
-                            st.markdown('</div>', unsafe_allow_html=True)
-                    except Exception as e:
-                        st.error(f"Error processing file {file_info.get('name', 'unknown')}: {e}")
-                        print(f"Detailed error for file: {e}")
-                        continue  # Skip to the next file if there's an error
-                        
-                        with col2:
-                            # Generate a download URL
-                            file_url = authenticated_supabase.storage.from_("fileuploads").get_public_url(file_path)
-                            
-                            col_a, col_b = st.columns(2)
-                            with col_a:
-                                st.markdown(f'<a href="{file_url}" target="_blank"><button style="border-radius:20px; padding:2px 10px; background-color:#2E7D32; color:white; border:none; width:100%;">📥</button></a>', unsafe_allow_html=True)
-                            
-                            with col_b:
-                                # Create a unique key for each delete button
-                                delete_key = f"delete_{file_name}"
-                                
-                                # Create a session state key for each file's delete confirmation
-                                confirm_key = f"confirm_delete_{file_name}"
-                                if confirm_key not in st.session_state:
-                                    st.session_state[confirm_key] = False
-                                
-                                if st.session_state[confirm_key]:
-                                    if st.button("✓", key=f"confirm_{delete_key}", help="Confirm deletion"):
-                                        authenticated_supabase.storage.from_("fileuploads").remove([file_path])
-                                        st.success(f"✅ Deleted {file_name}")
-                                        st.session_state[confirm_key] = False
-                                        time.sleep(1)
-                                        
-                                    if st.button("✗", key=f"cancel_{delete_key}", help="Cancel deletion"):
-                                        st.session_state[confirm_key] = False
-                                        
-                                else:
-                                    if st.button("🗑️", key=delete_key, help="Delete file"):
-                                        st.session_state[confirm_key] = True
-                                        
-                        
-                        # File preview
-                        with st.expander("Preview"):
-                            file_url = authenticated_supabase.storage.from_("fileuploads").get_public_url(file_path)
-                            st.markdown(get_file_preview(file_url, mime_type, file_name), unsafe_allow_html=True)
-                            st.markdown(f'<a href="{file_url}" target="_blank" style="text-decoration:none;"><button style="margin-top:10px; width:100%; padding:5px; background-color:#1976D2; color:white; border:none; border-radius:4px;">Open in New Tab</button></a>', unsafe_allow_html=True)
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
-        except Exception as e:
-            st.error(f"Error generating statistics: {str(e)}")        
+        files_panel(files)
     
     with tabs[2]:  # Stats tab
-        st.markdown('<p class="sub-header">Storage Statistics</p>', unsafe_allow_html=True)
-        
-        try:
-            # Get user folder name from email
-            user_folder = user.email.split('@')[0]
-            
-            # List files in the user's folder
-            file_list = authenticated_supabase.storage.from_("fileuploads").list(user_folder)
-            
-            # Calculate statistics
-            total_files = len(file_list)
-            total_size = sum(file_info.get('metadata', {}).get('size', 0) for file_info in file_list)
-            
-            # Display statistics in columns
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                st.markdown("""
-                    <div style="background-color:#000000; padding:20px; border-radius:10px; text-align:center;">
-                        <div style="font-size:30px;">📁</div>
-                        <div style="font-size:36px; font-weight:bold;">{}</div>
-                        <div style="color:#666;">Total Files</div>
-                    </div>
-                """.format(total_files), unsafe_allow_html=True)
-            
-            with col2:
-                st.markdown("""
-                    <div style="background-color:#000000; padding:20px; border-radius:10px; text-align:center;">
-                        <div style="font-size:30px;">💾</div>
-                        <div style="font-size:36px; font-weight:bold;">{}</div>
-                        <div style="color:#666;">Storage Used</div>
-                    </div>
-                """.format(format_size(total_size)), unsafe_allow_html=True)
-            
-            with col3:
-                # Sample file type distribution
-                if total_files > 0:
-                    file_types = {}
-                    for file_info in file_list:
-                        file_name = file_info['name']
-                        ext = os.path.splitext(file_name)[1].lower()
-                        file_types[ext] = file_types.get(ext, 0) + 1
-                    
-                    most_common_type = max(file_types.items(), key=lambda x: x[1])[0] if file_types else "None"
-                    type_display = most_common_type if most_common_type else "None"
-                else:
-                    type_display = "None"
-                
-                st.markdown("""
-                    <div style="background-color:#000000; padding:20px; border-radius:10px; text-align:center;">
-                        <div style="font-size:30px;">📊</div>
-                        <div style="font-size:36px; font-weight:bold;">{}</div>
-                        <div style="color:#666;">Most Common Type</div>
-                    </div>
-                """.format(type_display), unsafe_allow_html=True)
-            
-            
-        except Exception as e:
-            st.error(f"Error generating statistics: {str(e)}")
+        stats_panel(files)
+    
+    if is_admin:
+        with tabs[3]:  # Performance tab
+            show_performance()
 
 else:
     # Welcome screen for non-logged in users
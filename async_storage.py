@@ -0,0 +1,145 @@
+"""Async storage calls on one event loop shared by all sessions
+
+Streamlit runs each session's script in a thread of its own. Storage calls
+that do not depend on each other are handed to a single asyncio loop
+running in a daemon thread and awaited together, so a rerun waits for the
+slowest of them instead of their sum. All of them share one pooled
+httpx.AsyncClient.
+
+    io = get_event_loop_thread()
+    storage = AsyncStorage(client, "fileuploads")
+    listing, urls = io.gather(storage.bucket.list(folder), storage.bucket.create_signed_urls(paths, 3600))
+"""
+import asyncio
+import os
+import threading
+
+import httpx
+from storage3 import AsyncStorageClient
+
+from file_cache import LIST_PAGE_SIZE, list_options, split_entries
+from metrics import InstrumentedAsyncTransport
+
+# Connections the shared async client keeps open to storage
+MAX_CONNECTIONS = int(os.environ.get("FILESHARE_ASYNC_CONNECTIONS", 100))
+
+# Requests one operation (e.g. moving a folder) may have in flight at once
+MAX_CONCURRENT_REQUESTS = 16
+
+
+class EventLoopThread:
+    """An asyncio event loop running forever in a daemon thread
+
+    Coroutines are submitted from any thread and their results waited for
+    there; the loop itself never blocks, so one session waiting on a slow
+    request does not hold up another's.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self.loop = asyncio.new_event_loop()
+        # Used only from the loop; httpx binds it to the loop on first use
+        self.http_client = httpx.AsyncClient(
+            transport=InstrumentedAsyncTransport(httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 5),
+                http2=True,
+            )),
+            timeout=httpx.Timeout(20.0),
+            follow_redirects=True,
+        )
+        self._thread = threading.Thread(target=self.loop.run_forever, name="storage-io", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop
+
+        Returns:
+            concurrent.futures.Future of its result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result"""
+        return self.submit(coro).result(timeout)
+
+    def gather(self, *coros):
+        """Run coroutines concurrently and return their results in order
+
+        The first exception raised by any of them is raised here, after
+        the others have finished.
+        """
+        return self.run(_gather(coros))
+
+
+async def _gather(coros):
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def gather_limited(coros, limit=MAX_CONCURRENT_REQUESTS):
+    """Await coroutines with at most ``limit`` running at a time
+
+    Returns:
+        Their results in order; exceptions are returned, not raised, so one
+        failure does not abandon the rest
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(limited(coro) for coro in coros), return_exceptions=True)
+
+
+class AsyncStorage:
+    """Async counterpart of a Supabase client's storage bucket
+
+    ``bucket`` is a storage3 AsyncBucketProxy with the same methods as the
+    sync bucket, as coroutines. It sends the same credentials as the client
+    it was built from, so it is built per rerun like FileService.
+    """
+
+    def __init__(self, client, bucket, io=None):
+        self.io = io or get_event_loop_thread()
+        self.bucket = AsyncStorageClient(
+            str(client.storage_url), client.options.headers, http_client=self.io.http_client
+        ).from_(bucket)
+
+    async def list_folder(self, folder, page_size=LIST_PAGE_SIZE):
+        """List every entry of a folder, paging like file_cache.list_folder()"""
+        entries = []
+        while True:
+            page = await self.bucket.list(folder, list_options(len(entries), page_size))
+            entries.extend(page)
+            if len(page) < page_size:
+                return entries
+
+    async def walk_folder(self, folder):
+        """Return [(path, entry)] of every file under a folder
+
+        Sibling folders are listed concurrently, so a tree costs one round
+        trip per level rather than one per folder. The same folders are
+        skipped as by file_cache.walk_folder().
+        """
+        files, folders = split_entries(folder, await self.list_folder(folder))
+        for nested in await gather_limited([self.walk_folder(path) for path in folders]):
+            if isinstance(nested, BaseException):
+                raise nested
+            files.extend(nested)
+        return files
+
+
+_io = None
+_io_lock = threading.Lock()
+
+
+def get_event_loop_thread():
+    """Return the process-wide EventLoopThread, starting it on first use"""
+    global _io
+    with _io_lock:
+        if _io is None:
+            _io = EventLoopThread()
+        return _io
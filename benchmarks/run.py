@@ -0,0 +1,327 @@
+"""Benchmark the storage code paths against the local storage stub
+
+Usage:
+    python -m benchmarks.run [--scale quick|full] [--save-baseline FILE]
+                             [--baseline FILE] [--threshold 0.25]
+                             [--metric p50_ms|p99_ms|peak_mb ...]
+
+Every case drives the real functions (supabase_client, file_service and
+the modules behind it) over HTTP against benchmarks.stub_server, which runs
+in a separate process so its work does not count towards the results.
+Runs are compared with the committed baseline.json unless --baseline names
+another file, and exit 1 when a case regressed.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import httpx
+
+from benchmarks.stub_server import ANON_KEY, start_process
+
+# Keep the index and job database of benchmark runs away from the app's own,
+# and the credentials away from .env; both must be set before the project
+# modules are imported. SUPABASE_URL is replaced once the stub is running.
+os.environ["FILESHARE_DATA_DIR"] = tempfile.mkdtemp(prefix="fileshare-bench-")
+os.environ["SUPABASE_URL"] = "http://127.0.0.1"
+os.environ["SUPABASE_KEY"] = ANON_KEY
+
+from file_cache import list_folder  # noqa: E402
+from file_service import BUCKET, FileService  # noqa: E402
+from signed_urls import SignedUrlCache  # noqa: E402
+from supabase_client import ClientManager, get_client  # noqa: E402
+from uploads import BatchItem  # noqa: E402
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+# File counts and file sizes measured at each scale
+SCALES = {
+    "quick": {"counts": [10, 1000], "sizes": [KB, MB, 16 * MB]},
+    "full": {"counts": [10, 1000, 100000], "sizes": [KB, MB, 16 * MB, 100 * MB, GB]},
+}
+
+# Timed iterations per case; big cases get fewer so a run stays bounded
+MAX_REPEAT = 20
+REPEAT_BYTES = 64 * MB
+REPEAT_FILES = 2000
+
+# Files per page, as shown on the My Files tab
+PAGE_SIZE = 50
+
+# A case regresses when it is this much slower (or hungrier) than baseline
+REGRESSION_THRESHOLD = 0.25
+
+# Results of a quick run of the current code, refreshed with --save-baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Differences below these are noise, whatever the ratio
+MIN_LATENCY_DELTA_MS = 2.0
+MIN_MEMORY_DELTA_MB = 1.0
+
+# Metrics compared with the baseline, with their noise floors
+METRICS = {"p50_ms": MIN_LATENCY_DELTA_MS, "p99_ms": MIN_LATENCY_DELTA_MS, "peak_mb": MIN_MEMORY_DELTA_MB}
+
+
+def _size_label(size):
+    for unit, label in ((GB, "GB"), (MB, "MB"), (KB, "KB")):
+        if size >= unit:
+            return f"{size // unit} {label}"
+    return f"{size} B"
+
+
+def _count_label(count):
+    return f"{count // 1000}k" if count >= 1000 else str(count)
+
+
+def _percentile(samples, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def measure(run, setup=None, repeat=MAX_REPEAT, units=1):
+    """Time a case, then run it once more under tracemalloc
+
+    Args:
+        run: Callable taking the value setup() returned; the timed part
+        setup: Optional callable preparing one iteration, not timed
+        repeat: Number of timed iterations
+        units: Work done per iteration (files, bytes, ...) for throughput
+
+    Returns:
+        Dict with p50_ms, p99_ms, mean_ms, throughput (units per second),
+        peak_mb (Python allocations of one iteration) and runs
+    """
+    samples = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        samples.append(time.perf_counter() - start)
+
+    state = setup() if setup else None
+    tracemalloc.start()
+    try:
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    mean = sum(samples) / len(samples)
+    return {
+        "p50_ms": _percentile(samples, 50) * 1000,
+        "p99_ms": _percentile(samples, 99) * 1000,
+        "mean_ms": mean * 1000,
+        "throughput": units / mean if mean else 0.0,
+        "peak_mb": peak / MB,
+        "runs": repeat,
+    }
+
+
+class Bench:
+    """State shared by the cases: the stub, an authenticated client, results"""
+
+    def __init__(self, url, repeat=MAX_REPEAT, only=None):
+        self.url = url
+        self.repeat = repeat
+        self.only = only
+        self.admin = httpx.Client(base_url=url, timeout=httpx.Timeout(300.0))
+        self.manager = ClientManager()
+        self.results = {}
+
+    def login(self, email="bench@example.com"):
+        session = get_client().auth.sign_in_with_password({"email": email, "password": "benchmark"}).session
+        return session.access_token, session.refresh_token
+
+    def service(self, folder):
+        client = self.manager.get("bench", *self.tokens)[0]
+        return FileService(client, folder, signed_urls=SignedUrlCache(), http_client=self.manager.http_client,
+                           clients=self.manager)
+
+    def seed(self, folder, count, size=KB):
+        """Create objects directly in the stub; returns their names"""
+        response = self.admin.post("/_stub/seed", json={"bucket": BUCKET, "folder": folder, "count": count, "size": size})
+        response.raise_for_status()
+        return [entry["name"] for entry in list_folder(self.service(folder).bucket, folder)]
+
+    def case(self, name, unit, run, setup=None, repeat=None, units=1):
+        if self.only and self.only not in name:
+            return
+        repeat = max(1, min(repeat or self.repeat, self.repeat))
+        result = measure(run, setup, repeat, units)
+        result["unit"] = unit
+        self.results[name] = result
+        print(_format_row(name, result), flush=True)
+
+    def run(self, scale):
+        self.tokens = self.login()
+        self.client_cases()
+        for size in SCALES[scale]["sizes"]:
+            self.upload_cases(size)
+        for count in SCALES[scale]["counts"]:
+            self.count_cases(count)
+
+    def client_cases(self):
+        access_token, refresh_token = self.tokens
+        self.case("get_client", "clients/s", lambda _: get_client())
+        self.case("get_client (session)", "clients/s", lambda _: get_client(access_token, refresh_token))
+        self.case("client_manager.get (cached)", "calls/s",
+                  lambda _: self.manager.get("bench", *self.tokens))
+        self.case("client_manager.get (new session)", "calls/s",
+                  lambda tokens: self.manager.get(uuid.uuid4().hex, *tokens),
+                  setup=self.login)
+
+    def upload_cases(self, size):
+        files = self.service(f"upload-{_size_label(size).replace(' ', '')}")
+        label = _size_label(size)
+        repeat = max(1, REPEAT_BYTES // size)
+        # The source lives on disk like a spooled Streamlit upload would;
+        # a fresh header per iteration keeps deduplication out of the way
+        source = tempfile.TemporaryFile()
+        block = os.urandom(min(size, MB))
+        for _ in range(size // len(block)):
+            source.write(block)
+        source.write(block[:size % len(block)])
+
+        def fresh():
+            source.seek(0)
+            source.write(uuid.uuid4().bytes)
+            return f"{uuid.uuid4().hex}.bin"
+
+        self.case(f"upload {label}", "MB/s",
+                  lambda name: files.store(name, source, size, "application/octet-stream"),
+                  setup=fresh, repeat=repeat, units=size / MB)
+        if size <= MB:
+            name = fresh()
+            files.store(name, source, size, "application/octet-stream")
+            self.case(f"upload {label} (unchanged)", "MB/s",
+                      lambda _: files.store(name, source, size, "application/octet-stream"),
+                      repeat=repeat, units=size / MB)
+        source.close()
+
+    def count_cases(self, count):
+        label = _count_label(count)
+        repeat = max(1, REPEAT_FILES // count)
+        folder = f"count-{label}"
+        files = self.service(folder)
+        names = self.seed(folder, count)
+        paths = [files.path(name) for name in names]
+        files.reindex()
+
+        def batch():
+            target = self.service(f"batch-{label}-{uuid.uuid4().hex[:8]}")
+            items = [
+                BatchItem(f"f{i}.txt", target.path(f"f{i}.txt"), KB,
+                          lambda data=uuid.uuid4().bytes * (KB // 16): io.BytesIO(data), "text/plain")
+                for i in range(count)
+            ]
+            return target, items
+
+        def forget_index():
+            files.index.forget(folder, paths)
+
+        def fresh_urls():
+            files.signed_urls = SignedUrlCache()
+            return files.list_page(0, PAGE_SIZE)[0]
+
+        def seed_deletable():
+            target = self.service(f"delete-{label}-{uuid.uuid4().hex[:8]}")
+            return target, self.seed(target.user_folder, count)
+
+        self.case(f"upload batch {label} x 1 KB", "files/s",
+                  lambda state: state[0].upload_batch(state[1]), setup=batch, repeat=repeat, units=count)
+        self.case(f"list folder {label}", "files/s", lambda _: list_folder(files.bucket, folder),
+                  repeat=repeat, units=count)
+        self.case(f"list page {label}", "pages/s", lambda _: files.list_page(0, PAGE_SIZE),
+                  setup=lambda: files.listing_cache.invalidate(folder))
+        self.case(f"search {label}", "pages/s", lambda _: files.list_page(0, PAGE_SIZE, query="file1"))
+        self.case(f"reindex {label}", "files/s", lambda _: files.reindex(),
+                  setup=forget_index, repeat=repeat, units=count)
+        self.case(f"signed urls page {label}", "urls/s", lambda entries: files.page_links(entries),
+                  setup=fresh_urls, units=min(count, PAGE_SIZE))
+        self.case(f"signed urls folder {label}", "urls/s", lambda _: SignedUrlCache().get_many(files.bucket, paths),
+                  repeat=repeat, units=count)
+        self.case(f"stats {label}", "calls/s", lambda _: files.stats())
+        self.case(f"delete {label}", "files/s", lambda state: state[0].delete(state[1]),
+                  setup=seed_deletable, repeat=repeat, units=count)
+
+
+def _format_row(name, result):
+    return (f"{name:<40} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f} "
+            f"{result['throughput']:>12.1f} {result['unit']:<10} {result['peak_mb']:>9.2f} {result['runs']:>5}")
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, metrics=None):
+    """List the cases that got slower or use more memory than the baseline
+
+    Args:
+        metrics: Names of the metrics to compare; all of METRICS by default
+
+    Returns:
+        List of (case, metric, baseline value, current value)
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in metrics or METRICS:
+            floor = METRICS[metric]
+            if result[metric] > base[metric] * (1 + threshold) and result[metric] - base[metric] > floor:
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark FileShare Hub against a local storage stub")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="quick",
+                        help="quick: up to 1k files and 16 MB; full: up to 100k files and 1 GB")
+    parser.add_argument("--repeat", type=int, default=MAX_REPEAT, help="maximum timed iterations per case")
+    parser.add_argument("--only", help="run only cases whose name contains this text")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay the stub adds to every request")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="JSON results to compare against; the committed baseline by default")
+    parser.add_argument("--save-baseline", help="write the results as JSON to this file")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--metric", action="append", choices=sorted(METRICS),
+                        help="compare only this metric; repeat for several (default: all)")
+    args = parser.parse_args(argv)
+
+    process, url = start_process(latency=args.latency_ms / 1000)
+    os.environ["SUPABASE_URL"] = url
+    try:
+        print(f"{'case':<40} {'p50 ms':>10} {'p99 ms':>10} {'throughput':>12} {'':<10} {'peak MB':>9} {'runs':>5}")
+        bench = Bench(url, repeat=args.repeat, only=args.only)
+        bench.run(args.scale)
+    finally:
+        process.terminate()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"scale": args.scale, "latency_ms": args.latency_ms, "results": bench.results}, f, indent=2)
+        print(f"Saved results to {args.save_baseline}")
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(bench.results, baseline, args.threshold, args.metric)
+        for name, metric, before, after in regressions:
+            print(f"REGRESSION {name}: {metric} {before:.2f} -> {after:.2f}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,711 @@
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Object bodies larger than this are kept on disk instead of in memory
+MEMORY_LIMIT = 8 * 1024 * 1024
+
+# Lifetime of issued access tokens, in seconds
+TOKEN_TTL = 60 * 60
+
+# Bytes written per step when sending a body
+SEND_CHUNK_SIZE = 1024 * 1024
+
+# Anon key accepted by supabase-py; the stub does not check it
+ANON_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoiYW5vbiJ9.c3R1Yg"
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64url_json(value):
+    return _b64url(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode_token(token):
+    """Return the payload of a token issued by the stub, or None"""
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _multipart(content_type, body):
+    """Yield (field name, content type, bytes) for each multipart/form-data part"""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode("latin-1")
+    for part in body.split(b"--" + boundary)[1:]:
+        if part.startswith(b"--"):
+            break
+        head, _, payload = part.partition(b"\r\n\r\n")
+        head = head.decode("latin-1")
+        name = re.search(r'\bname="([^"]*)"', head)
+        part_type = re.search(r"content-type:\s*([^\r\n]+)", head, re.I)
+        yield (name.group(1) if name else None, part_type.group(1).strip() if part_type else "application/octet-stream",
+               payload[:-2] if payload.endswith(b"\r\n") else payload)
+
+
+class _Object:
+    """A stored object; ``body`` is bytes, a file path, or None for zeros
+
+    ``owner`` is the ID of the user whose token uploaded it, as storage
+    records it; seeded objects have none.
+    """
+
+    def __init__(self, size, mimetype, metadata=None, body=None, owner=None):
+        self.size = size
+        self.mimetype = mimetype or "application/octet-stream"
+        self.metadata = metadata or {}
+        self.body = body
+        self.owner = owner
+        self.created_at = self.updated_at = _now_iso()
+        self.etag = '"' + uuid.uuid4().hex + '"'
+
+    def entry(self, name):
+        return {
+            "name": name,
+            "id": self.etag.strip('"'),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "last_accessed_at": self.updated_at,
+            "metadata": {
+                "eTag": self.etag,
+                "size": self.size,
+                "mimetype": self.mimetype,
+                "cacheControl": "max-age=3600",
+                "lastModified": self.updated_at,
+                "contentLength": self.size,
+                "httpStatusCode": 200,
+            },
+        }
+
+    def read(self, start, end):
+        """Yield the body bytes in [start, end] in chunks"""
+        if isinstance(self.body, bytes):
+            yield self.body[start:end + 1]
+            return
+        if self.body is None:
+            while start <= end:
+                length = min(SEND_CHUNK_SIZE, end - start + 1)
+                yield bytes(length)
+                start += length
+            return
+        with open(self.body, "rb") as f:
+            f.seek(start)
+            while start <= end:
+                chunk = f.read(min(SEND_CHUNK_SIZE, end - start + 1))
+                if not chunk:
+                    return
+                start += len(chunk)
+                yield chunk
+
+
+class StubStorage:
+    """In-memory state of the stub: buckets of objects, uploads and users
+
+    Objects are also indexed per folder so list() stays cheap with many
+    thousands of files, as it does on the real service.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects = {}
+        self.uploads = {}
+        self.refresh_tokens = {}
+        self.requests = {}
+        self._children = {}
+        self._sorted = {}
+        self._lock = threading.RLock()
+
+    def count(self, route):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def _link(self, bucket, path):
+        parts = path.split("/")
+        for depth in range(len(parts)):
+            folder = "/".join(parts[:depth])
+            children = self._children.setdefault((bucket, folder), set())
+            if parts[depth] not in children:
+                children.add(parts[depth])
+                self._sorted.pop((bucket, folder), None)
+
+    def _unlink(self, bucket, path):
+        parts = path.split("/")
+        for depth in range(len(parts) - 1, -1, -1):
+            folder = "/".join(parts[:depth])
+            children = self._children.get((bucket, folder))
+            if children is None:
+                return
+            child = "/".join(parts[:depth + 1])
+            if (bucket, child) in self.objects or self._children.get((bucket, child)):
+                return
+            children.discard(parts[depth])
+            self._sorted.pop((bucket, folder), None)
+            if children:
+                return
+            del self._children[(bucket, folder)]
+
+    def put(self, bucket, path, obj, upsert=True):
+        """Store an object; returns False if it exists and upsert is off"""
+        with self._lock:
+            old = self.objects.get((bucket, path))
+            if old is not None and not upsert:
+                return False
+            if old is not None:
+                obj.created_at = old.created_at
+                self._discard_body(old)
+            self.objects[(bucket, path)] = obj
+            self._link(bucket, path)
+        return True
+
+    def get(self, bucket, path):
+        with self._lock:
+            return self.objects.get((bucket, path))
+
+    def move(self, bucket, source, destination):
+        """Rename an object; returns False if the source is missing or the destination exists"""
+        with self._lock:
+            obj = self.objects.get((bucket, source))
+            if obj is None or (bucket, destination) in self.objects:
+                return False
+            del self.objects[(bucket, source)]
+            self._unlink(bucket, source)
+            self.objects[(bucket, destination)] = obj
+            self._link(bucket, destination)
+        return True
+
+    def remove(self, bucket, paths):
+        removed = []
+        with self._lock:
+            for path in paths:
+                obj = self.objects.pop((bucket, path), None)
+                if obj is not None:
+                    self._unlink(bucket, path)
+                    self._discard_body(obj)
+                    removed.append(path)
+        return removed
+
+    def _discard_body(self, obj):
+        if isinstance(obj.body, str):
+            try:
+                os.remove(obj.body)
+            except OSError:
+                pass
+
+    def spill(self, data):
+        """Keep a body in memory, or on disk when it is large"""
+        if len(data) <= MEMORY_LIMIT:
+            return bytes(data)
+        path = os.path.join(self.root, uuid.uuid4().hex)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def list(self, bucket, prefix, limit=100, offset=0, sort_by=None, search=""):
+        folder = prefix.strip("/")
+        sort_by = sort_by or {}
+        by_name = sort_by.get("column", "name") == "name"
+        with self._lock:
+            names = self._sorted.get((bucket, folder))
+            if names is None:
+                names = self._sorted[(bucket, folder)] = sorted(self._children.get((bucket, folder), ()))
+            if search:
+                names = [name for name in names if name.lower().startswith(search.lower())]
+            if by_name:
+                # Only the requested page needs entries built
+                if sort_by.get("order") == "desc":
+                    names = names[::-1]
+                names = names[offset:offset + limit]
+            rows = [self._entry(bucket, folder, name) for name in names]
+        if not by_name:
+            rows.sort(key=lambda row: row.get(sort_by["column"]) or "", reverse=sort_by.get("order") == "desc")
+            rows = rows[offset:offset + limit]
+        return rows
+
+    def _entry(self, bucket, folder, name):
+        obj = self.objects.get((bucket, f"{folder}/{name}" if folder else name))
+        if obj is None:
+            return {"name": name, "id": None, "updated_at": None, "created_at": None,
+                    "last_accessed_at": None, "metadata": None}
+        return obj.entry(name)
+
+    def seed(self, bucket, folder, count, size=1024, mimetype="text/plain", prefix="file"):
+        """Create objects without transferring their bytes
+
+        Seeded bodies read back as zeros, which is all benchmarks of listing,
+        signing, deleting and indexing need.
+        """
+        width = len(str(max(count - 1, 0)))
+        with self._lock:
+            for i in range(count):
+                path = f"{folder}/{prefix}{i:0{width}d}.txt"
+                self.objects[(bucket, path)] = _Object(size, mimetype)
+                self._link(bucket, path)
+        return count
+
+    def reset(self):
+        with self._lock:
+            for obj in self.objects.values():
+                self._discard_body(obj)
+            self.objects.clear()
+            self.uploads.clear()
+            self.requests.clear()
+            self._children.clear()
+            self._sorted.clear()
+
+    def issue_session(self, email, user_id=None, token_ttl=TOKEN_TTL):
+        now = int(time.time())
+        user_id = user_id or str(uuid.uuid5(uuid.NAMESPACE_URL, email))
+        user = {
+            "id": user_id,
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": email,
+            "app_metadata": {"provider": "email"},
+            "user_metadata": {},
+            "created_at": "2024-01-01T00:00:00Z",
+        }
+        access_token = ".".join([
+            _b64url_json({"alg": "HS256", "typ": "JWT"}),
+            _b64url_json({"sub": user_id, "email": email, "role": "authenticated", "aud": "authenticated",
+                          "iat": now, "exp": now + token_ttl, "session_id": uuid.uuid4().hex}),
+            _b64url(hashlib.sha256(uuid.uuid4().bytes).digest()),
+        ])
+        refresh_token = uuid.uuid4().hex
+        with self._lock:
+            self.refresh_tokens[refresh_token] = user
+        return {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_type": "bearer",
+            "expires_in": token_ttl,
+            "expires_at": now + token_ttl,
+            "user": user,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "StorageStub/1.0"
+    # Headers and body go out as separate writes; without this every small
+    # response waits on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    @property
+    def storage(self):
+        return self.server.storage
+
+    def log_message(self, format, *args):
+        pass
+
+    # Responses
+
+    def _send(self, status, body=b"", headers=None, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _json(self, value, status=200):
+        self._send(status, json.dumps(value).encode("utf-8"))
+
+    def _error(self, status, error, message, code=None):
+        self._json({"statusCode": str(code or status), "error": error, "message": message}, status)
+
+    def _caller(self):
+        """ID of the user whose token sent the request, or None"""
+        payload = _decode_token(self.headers.get("Authorization", "").removeprefix("Bearer ")) or {}
+        return payload.get("sub")
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self):
+        body = self._body()
+        return json.loads(body) if body else {}
+
+    def _route(self):
+        url = urlsplit(self.path)
+        return unquote(url.path), parse_qs(url.query)
+
+    def _dispatch(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        path, query = self._route()
+        try:
+            if path.startswith("/storage/v1/"):
+                self._storage(path[len("/storage/v1/"):], query)
+            elif path.startswith("/auth/v1/"):
+                self._auth(path[len("/auth/v1/"):], query)
+            elif path.startswith("/_stub/"):
+                self._admin(path[len("/_stub/"):])
+            else:
+                self._error(404, "not_found", "Unknown endpoint")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_PATCH = _dispatch
+
+    # Storage API
+
+    def _storage(self, path, query):
+        method = self.command
+        if path.startswith("upload/resumable"):
+            self.storage.count(f"{method} upload/resumable")
+            return self._tus(path[len("upload/resumable"):].strip("/"))
+        for route in ("object/list/", "object/sign/", "object/info/", "object/public/", "object/authenticated/"):
+            if path.startswith(route):
+                self.storage.count(f"{method} {route}")
+                bucket, _, key = path[len(route):].partition("/")
+                return getattr(self, "_" + route.split("/")[1])(bucket, key, query)
+        if path == "object/copy" and method == "POST":
+            self.storage.count("POST object/copy")
+            return self._copy()
+        if path == "object/move" and method == "POST":
+            self.storage.count("POST object/move")
+            options = self._json_body()
+            if not self.storage.move(options["bucketId"], options["sourceKey"], options["destinationKey"]):
+                return self._error(400, "not_found", "Object not found or destination exists", 404)
+            return self._json({"message": "Successfully moved"})
+        if path.startswith("object/"):
+            self.storage.count(f"{method} object/")
+            bucket, _, key = path[len("object/"):].partition("/")
+            if method == "DELETE" and not key:
+                removed = self.storage.remove(bucket, self._json_body().get("prefixes", []))
+                return self._json([{"name": name, "bucket_id": bucket} for name in removed])
+            if method in ("POST", "PUT"):
+                return self._upload(bucket, key)
+            if method in ("GET", "HEAD"):
+                return self._download(bucket, key, self.headers.get("Range"))
+        self._error(404, "not_found", "Unknown storage endpoint")
+
+    def _list(self, bucket, key, query):
+        options = self._json_body()
+        rows = self.storage.list(bucket, options.get("prefix", ""), options.get("limit", 100),
+                                 options.get("offset", 0), options.get("sortBy"), options.get("search") or "")
+        self._json(rows)
+
+    def _sign(self, bucket, key, query):
+        if self.command == "GET":
+            token = (query.get("token") or [""])[0]
+            payload = _decode_token(token) or {}
+            if payload.get("url") != f"{bucket}/{key}" or payload.get("exp", 0) < time.time():
+                return self._error(400, "InvalidJWT", "invalid signature")
+            return self._download(bucket, key, self.headers.get("Range"))
+        options = self._json_body()
+        paths = options.get("paths") or ([key] if key else [])
+        expires_at = int(time.time()) + int(options.get("expiresIn", 60))
+        signed = []
+        for path in paths:
+            if self.storage.get(bucket, path) is None:
+                signed.append({"path": path, "signedURL": None, "error": "Either the object does not exist or you do not have access to it"})
+                continue
+            token = ".".join([_b64url_json({"alg": "none"}), _b64url_json({"url": f"{bucket}/{path}", "exp": expires_at}), ""])
+            signed.append({"path": path, "signedURL": f"/object/sign/{bucket}/{path}?token={token}", "error": None})
+        if key:
+            return self._json(signed[0])
+        self._json(signed)
+
+    def _info(self, bucket, key, query):
+        obj = self.storage.get(bucket, key)
+        if obj is None:
+            return self._error(400, "not_found", "Object not found", 404)
+        self._json({
+            "id": obj.etag.strip('"'),
+            "name": key,
+            "bucket_id": bucket,
+            "size": obj.size,
+            "content_type": obj.mimetype,
+            "cache_control": "max-age=3600",
+            "etag": obj.etag,
+            "metadata": obj.metadata,
+            "created_at": obj.created_at,
+            "last_modified": obj.updated_at,
+            "owner_id": obj.owner,
+        })
+
+    def _public(self, bucket, key, query):
+        self._download(bucket, key, self.headers.get("Range"))
+
+    _authenticated = _public
+
+    def _copy(self):
+        options = self._json_body()
+        bucket = options["bucketId"]
+        source = self.storage.get(bucket, options["sourceKey"])
+        if source is None:
+            return self._error(400, "not_found", "Object not found", 404)
+        body = source.body
+        if isinstance(body, str):
+            body = self.storage.spill(open(body, "rb").read())
+        obj = _Object(source.size, source.mimetype, dict(source.metadata), body, self._caller())
+        if not self.storage.put(bucket, options["destinationKey"], obj, upsert=self.headers.get("x-upsert") == "true"):
+            return self._error(400, "Duplicate", "The resource already exists", 409)
+        self._json({"Key": f"{bucket}/{options['destinationKey']}"})
+
+    def _upload(self, bucket, key):
+        content_type = self.headers.get("Content-Type", "")
+        body = self._body()
+        data, mimetype, fields = body, content_type, {}
+        if content_type.startswith("multipart/form-data"):
+            for name, part_type, payload in _multipart(content_type, body):
+                if name == "file":
+                    data, mimetype = payload, part_type
+                else:
+                    fields[name] = payload.decode("utf-8")
+        metadata = json.loads(fields["metadata"]) if fields.get("metadata") else {}
+        upsert = self.command == "PUT" or self.headers.get("x-upsert") == "true"
+        obj = _Object(len(data), mimetype, metadata, self.storage.spill(data), self._caller())
+        if not self.storage.put(bucket, key, obj, upsert=upsert):
+            return self._error(400, "Duplicate", "The resource already exists", 409)
+        self._json({"Key": f"{bucket}/{key}", "Id": obj.etag.strip('"')})
+
+    def _download(self, bucket, key, range_header):
+        obj = self.storage.get(bucket, key)
+        if obj is None:
+            if self.command == "HEAD":
+                return self._send(400)
+            return self._error(400, "not_found", "Object not found", 404)
+        start, end, status = 0, obj.size - 1, 200
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].split(",")[0].partition("-")
+            if first:
+                start, end = int(first), min(int(last), obj.size - 1) if last else obj.size - 1
+            elif last:
+                start = max(obj.size - int(last), 0)
+            if start > end or start >= obj.size:
+                return self._send(416, headers={"Content-Range": f"bytes */{obj.size}"})
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", obj.mimetype)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", obj.etag)
+        self.send_header("Cache-Control", "max-age=3600")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{obj.size}")
+        self.end_headers()
+        if self.command != "HEAD" and obj.size:
+            for chunk in obj.read(start, end):
+                self.wfile.write(chunk)
+
+    def _tus(self, upload_id):
+        method = self.command
+        if method == "POST" and not upload_id:
+            metadata = {}
+            for pair in (self.headers.get("Upload-Metadata") or "").split(","):
+                if pair.strip():
+                    name, _, value = pair.strip().partition(" ")
+                    metadata[name] = base64.b64decode(value).decode("utf-8")
+            bucket, key = metadata.get("bucketName"), metadata.get("objectName")
+            if self.storage.get(bucket, key) is not None and self.headers.get("x-upsert") != "true":
+                return self._error(409, "Duplicate", "The resource already exists")
+            upload_id = uuid.uuid4().hex
+            target = os.path.join(self.storage.root, upload_id)
+            open(target, "wb").close()
+            self.storage.uploads[upload_id] = {
+                "bucket": bucket,
+                "key": key,
+                "length": int(self.headers["Upload-Length"]),
+                "offset": 0,
+                "file": target,
+                "mimetype": metadata.get("contentType"),
+                "metadata": json.loads(metadata["metadata"]) if metadata.get("metadata") else {},
+                "owner": self._caller(),
+            }
+            return self._send(201, headers={"Location": f"/storage/v1/upload/resumable/{upload_id}", "Tus-Resumable": "1.0.0"})
+
+        upload = self.storage.uploads.get(upload_id)
+        if upload is None:
+            self._body()
+            return self._send(404)
+        if method == "HEAD":
+            return self._send(200, headers={"Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["length"])})
+        if method == "PATCH":
+            chunk = self._body()
+            if int(self.headers.get("Upload-Offset", -1)) != upload["offset"]:
+                return self._send(409)
+            with open(upload["file"], "ab") as f:
+                f.write(chunk)
+            upload["offset"] += len(chunk)
+            if upload["offset"] >= upload["length"]:
+                del self.storage.uploads[upload_id]
+                body = upload["file"]
+                if upload["length"] <= MEMORY_LIMIT:
+                    with open(body, "rb") as f:
+                        body = f.read()
+                    os.remove(upload["file"])
+                self.storage.put(upload["bucket"], upload["key"],
+                                 _Object(upload["length"], upload["mimetype"], upload["metadata"], body,
+                                         upload["owner"]))
+            return self._send(204, headers={"Upload-Offset": str(upload["offset"]), "Tus-Resumable": "1.0.0"})
+        self._send(405)
+
+    # Auth API
+
+    def _auth(self, path, query):
+        self.storage.count(f"{self.command} auth/{path}")
+        if path == "token" and self.command == "POST":
+            body = self._json_body()
+            grant_type = (query.get("grant_type") or [""])[0]
+            if grant_type == "password" and body.get("email"):
+                return self._json(self.storage.issue_session(body["email"], token_ttl=self.server.token_ttl))
+            if grant_type == "refresh_token":
+                with self.storage._lock:
+                    user = self.storage.refresh_tokens.pop(body.get("refresh_token"), None)
+                if user is not None:
+                    return self._json(self.storage.issue_session(user["email"], user["id"], self.server.token_ttl))
+            return self._json({"code": 400, "error_code": "invalid_grant", "msg": "Invalid login credentials"}, 400)
+        if path == "signup" and self.command == "POST":
+            return self._json(self.storage.issue_session(self._json_body().get("email", "user@example.com"),
+                                                         token_ttl=self.server.token_ttl))
+        if path == "user" and self.command == "GET":
+            payload = _decode_token(self.headers.get("Authorization", "").removeprefix("Bearer ")) or {}
+            if not payload.get("sub") or payload.get("exp", 0) < time.time():
+                return self._json({"code": 401, "error_code": "bad_jwt", "msg": "invalid JWT"}, 401)
+            return self._json({"id": payload["sub"], "aud": "authenticated", "role": "authenticated",
+                               "email": payload.get("email"), "app_metadata": {}, "user_metadata": {},
+                               "created_at": "2024-01-01T00:00:00Z"})
+        if path == "logout":
+            self._body()
+            return self._send(204)
+        self._json({"code": 404, "msg": "Unknown auth endpoint"}, 404)
+
+    # Control endpoints used by the benchmark runner
+
+    def _admin(self, path):
+        if path == "seed":
+            options = self._json_body()
+            created = self.storage.seed(options["bucket"], options["folder"], options["count"],
+                                        options.get("size", 1024), options.get("mimetype", "text/plain"))
+            return self._json({"created": created})
+        if path == "reset":
+            self._body()
+            self.storage.reset()
+            return self._json({})
+        if path == "stats":
+            with self.storage._lock:
+                return self._json({"objects": len(self.storage.objects), "requests": dict(self.storage.requests)})
+        self._error(404, "not_found", "Unknown control endpoint")
+
+
+class StubServer(ThreadingHTTPServer):
+    """Local stand-in for the Supabase Storage and Auth HTTP APIs
+
+    Implements the endpoints supabase-py and uploads.ResumableUpload call:
+    password and refresh-token login, object upload (plain and TUS), list,
+    copy, move, remove, info, exists, download with Range, and batch signing.
+    Any email and password log in. ``latency`` adds a fixed delay to every
+    request to mimic the round trip to a hosted project.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_ttl=TOKEN_TTL, root=None):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self._owns_root = root is None
+        self.storage = StubStorage(root or tempfile.mkdtemp(prefix="storage-stub-"))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a daemon thread; returns the base URL"""
+        self._thread = threading.Thread(target=self.serve_forever, name="storage-stub", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._owns_root:
+            shutil.rmtree(self.storage.root, ignore_errors=True)
+
+
+def _watch_parent(connection, server):
+    # recv() fails once the parent process is gone, however it ended
+    try:
+        connection.recv()
+    except (EOFError, OSError):
+        pass
+    server.shutdown()
+
+
+def _serve_child(connection, latency, token_ttl):
+    server = StubServer(latency=latency, token_ttl=token_ttl)
+    connection.send(server.url)
+    threading.Thread(target=_watch_parent, args=(connection, server), daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.stop()
+
+
+def start_process(latency=0.0, token_ttl=TOKEN_TTL):
+    """Run a StubServer in a separate process
+
+    Keeps the stub's CPU time and memory out of the measurements of the
+    process under test.
+
+    Returns:
+        Tuple of (process, base URL); terminate() the process when done
+    """
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=_serve_child, args=(child, latency, token_ttl), daemon=True)
+    process.start()
+    url = parent.recv()
+    # The stub shuts down when this end closes, i.e. when the caller exits
+    process.control = parent
+    return process, url
+
+
+def main(argv=None):
+    """Run the stub in the foreground, e.g. to point the app at it"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every request")
+    args = parser.parse_args(argv)
+    server = StubServer(args.host, args.port, latency=args.latency_ms / 1000)
+    print(f"Storage stub listening on {server.url}")
+    print(f"SUPABASE_URL={server.url} SUPABASE_KEY={ANON_KEY}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
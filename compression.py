@@ -0,0 +1,143 @@
+import gzip
+import shutil
+import tempfile
+
+try:
+    import zstandard  # optional, preferred over gzip when installed
+except ImportError:
+    zstandard = None
+
+from file_types import mime_category
+
+# Compression levels; moderate levels keep uploads CPU-light
+ZSTD_LEVEL = 6
+GZIP_LEVEL = 6
+
+# Files smaller than this are stored as-is; the gain would not be noticeable
+MIN_COMPRESS_SIZE = 4 * 1024
+
+# The compressed copy is only kept if it is at most this share of the original
+MAX_COMPRESSED_RATIO = 0.9
+
+# Compressed output is kept in memory up to this size, then spilled to disk
+SPOOL_MEMORY = 8 * 1024 * 1024
+
+# Bytes read per step while streaming through a codec
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# File categories (see file_types.mime_category) worth compressing
+COMPRESSIBLE_CATEGORIES = {"text"}
+
+# Text-like types outside the "text/" family
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/javascript",
+    "application/sql",
+    "application/x-sh",
+    "application/x-tar",
+    "application/rtf",
+    "application/x-yaml",
+}
+
+ZSTD = "zstd"
+GZIP = "gzip"
+
+_MAGIC = {ZSTD: b"\x28\xb5\x2f\xfd", GZIP: b"\x1f\x8b"}
+
+
+def choose_encoding(mime_type):
+    """Return the codec to store a file of this type with, or None
+
+    Text, CSV, JSON, logs and uncompressed archives compress well. Media,
+    office documents and zip files are already compressed and are stored
+    as they are.
+    """
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    if mime_type in COMPRESSIBLE_TYPES or mime_category(mime_type) in COMPRESSIBLE_CATEGORIES:
+        return ZSTD if zstandard is not None else GZIP
+    return None
+
+
+def compress_file(fileobj, size, encoding):
+    """Stream a file through a codec into a spooled temporary file
+
+    Output is deterministic for the same input, so re-uploading identical
+    content produces an identical object.
+
+    Args:
+        fileobj: Seekable binary file object, rewound before and after
+        size: Size of the file in bytes
+        encoding: ZSTD or GZIP
+
+    Returns:
+        Tuple of (spooled file positioned at 0, compressed size)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+    fileobj.seek(0)
+    if encoding == ZSTD:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        with compressor.stream_writer(spool, size=size, closefd=False) as writer:
+            shutil.copyfileobj(fileobj, writer, STREAM_CHUNK_SIZE)
+    else:
+        # mtime=0 keeps the gzip header identical between runs
+        with gzip.GzipFile(fileobj=spool, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as writer:
+            shutil.copyfileobj(fileobj, writer, STREAM_CHUNK_SIZE)
+    fileobj.seek(0)
+    compressed_size = spool.tell()
+    spool.seek(0)
+    return spool, compressed_size
+
+
+def maybe_compress(fileobj, size, mime_type):
+    """Compress a file if its type is compressible and it actually shrinks
+
+    Returns:
+        Tuple of (fileobj, size, encoding); the original file, its size and
+        None when it is stored uncompressed
+    """
+    encoding = choose_encoding(mime_type)
+    if encoding is None or size < MIN_COMPRESS_SIZE:
+        return fileobj, size, None
+    spool, compressed_size = compress_file(fileobj, size, encoding)
+    if compressed_size > size * MAX_COMPRESSED_RATIO:
+        spool.close()
+        return fileobj, size, None
+    return spool, compressed_size, encoding
+
+
+def detect_encoding(data, mime_type):
+    """Guess the encoding of stored bytes when the index does not know it
+
+    Only files of a compressible type can have been compressed on upload,
+    so a real .gz or .zst file the user uploaded is never mistaken for one.
+    """
+    if choose_encoding(mime_type) is None:
+        return None
+    for encoding, magic in _MAGIC.items():
+        if data[:len(magic)] == magic:
+            return encoding
+    return None
+
+
+def decompress(data, encoding):
+    """Return the original bytes of a stored object"""
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed; cannot decompress this file")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    return data
+
+
+def open_decoded(fileobj, encoding):
+    """Wrap a binary stream of stored bytes so reads return the original"""
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed; cannot decompress this file")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    if encoding == GZIP:
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    return fileobj
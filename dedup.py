@@ -0,0 +1,111 @@
+import hashlib
+import sys
+
+from compression import decompress, detect_encoding
+from file_cache import walk_folder
+from integrity import BLOCK_SIZE, checksum_bytes
+from metadata_index import get_metadata_index
+from supabase_client import get_client
+
+# Bytes hashed per read while streaming a file through the hasher
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(fileobj, chunk_size=HASH_CHUNK_SIZE, hasher=None):
+    """Return the SHA-256 hex digest of a file object, read in chunks
+
+    The file is rewound before and after hashing. An optional
+    integrity.BlockHasher is fed the same chunks, so block checksums come
+    out of the same read.
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def verify_index(index, bucket, owner, folder, repair=False):
+    """Compare the index with what is actually in storage
+
+    Args:
+        index: metadata_index.MetadataIndex
+        bucket: Storage bucket proxy
+        owner: Index partition, normally the user folder
+        folder: Folder to check
+        repair: Drop index rows whose object is gone or changed size
+
+    Returns:
+        Dict with lists of ``missing`` (indexed but not stored),
+        ``changed`` (size differs) and ``unindexed`` (stored but not indexed)
+        paths
+    """
+    indexed = index.entries(owner)
+    stored = {path: (entry.get("metadata") or {}).get("size") or 0 for path, entry in walk_folder(bucket, folder)}
+    report = {
+        "missing": sorted(path for path in indexed if path not in stored),
+        "changed": sorted(path for path, (_, size) in indexed.items() if path in stored and stored[path] != size),
+        "unindexed": sorted(path for path in stored if path not in indexed),
+    }
+    if repair:
+        index.forget(owner, report["missing"] + report["changed"])
+    return report
+
+
+def rebuild_index(index, bucket, owner, folder):
+    """Re-hash every object in a folder and replace the owner's index
+
+    Every object is downloaded once, so this is meant for occasional repair
+    runs rather than the request path. Objects stored compressed are hashed
+    by their original content, as on upload. Checksums of the stored bytes
+    are taken afresh, so the current state of storage becomes the baseline
+    later verification compares against.
+
+    Returns:
+        Number of objects indexed
+    """
+    stored = dict(walk_folder(bucket, folder))
+    index.forget(owner, [path for path in index.entries(owner) if path not in stored])
+    for path, entry in stored.items():
+        data = bucket.download(path)
+        mime_type = (entry.get("metadata") or {}).get("mimetype")
+        encoding = detect_encoding(data, mime_type)
+        index.record(owner, path, len(data), mime_type,
+                     content_hash=hashlib.sha256(decompress(data, encoding)).hexdigest(),
+                     created_at=entry.get("created_at"), updated_at=entry.get("updated_at"),
+                     encoding=encoding or "")
+        index.record_checksum(owner, path, *checksum_bytes(data), BLOCK_SIZE)
+    return len(stored)
+
+
+def main(argv):
+    """Command line entry point: python dedup.py (verify|repair|rebuild) FOLDER
+
+    Uses the credentials in SUPABASE_URL / SUPABASE_KEY, which need read
+    access to the whole folder (e.g. the service role key).
+    """
+    if len(argv) != 2 or argv[0] not in ("verify", "repair", "rebuild"):
+        print(main.__doc__)
+        return 2
+    command, folder = argv
+    index = get_metadata_index()
+    bucket = get_client().storage.from_("fileuploads")
+    if command == "rebuild":
+        print(f"Indexed {rebuild_index(index, bucket, folder, folder)} objects")
+        return 0
+    report = verify_index(index, bucket, folder, folder, repair=command == "repair")
+    for key, paths in report.items():
+        print(f"{key}: {len(paths)}")
+        for path in paths:
+            print(f"  {path}")
+    return 0 if command == "repair" or not (report["missing"] or report["changed"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from compression import STREAM_CHUNK_SIZE, choose_encoding, open_decoded
+from file_types import guess_type
+from integrity import BlockHasher, IntegrityError
+from local_db import DATA_DIR
+
+# Maximum number of paths sent in a single remove() call
+DELETE_BATCH_SIZE = 100
+
+
+def delete_files(bucket, folder, names, batch_size=DELETE_BATCH_SIZE, on_progress=None):
+    """Delete many files with one remove() call per batch of paths
+
+    Args:
+        bucket: Storage bucket proxy, e.g. client.storage.from_("fileuploads")
+        folder: Folder the files live in
+        names: File names inside the folder
+        batch_size: Maximum number of paths per remove() call
+        on_progress: Optional callback called with (done, total) after
+            each batch
+
+    Returns:
+        List of result dicts with name, ok and error, one per file
+    """
+    names = list(names)
+    results = []
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        paths = [f"{folder}/{name}" for name in batch]
+        try:
+            removed = bucket.remove(paths)
+        except Exception as e:
+            results.extend({"name": name, "ok": False, "error": str(e)} for name in batch)
+        else:
+            # remove() only reports the objects it actually deleted
+            removed_paths = {obj.get("name") for obj in removed or []}
+            for name, path in zip(batch, paths):
+                if path in removed_paths:
+                    results.append({"name": name, "ok": True, "error": None})
+                else:
+                    results.append({"name": name, "ok": False, "error": "File not found"})
+        if on_progress:
+            on_progress(min(start + batch_size, len(names)), len(names))
+    return results
+
+
+# Objects fetched at the same time while building a zip archive
+ZIP_WORKERS = 4
+
+# Fetched objects are kept in memory up to this size, then spilled to disk
+ZIP_SPOOL_MEMORY = 8 * 1024 * 1024
+
+# Finished archives are written here, under the app's data directory
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+
+# Archives older than this (seconds) are removed when a new one is built
+EXPORT_MAX_AGE = 24 * 60 * 60
+
+
+def fetch_object(http_client, url, checksum=None):
+    """Stream one object into a spooled temporary file
+
+    With a ``checksum`` row from MetadataIndex.checksums() the bytes are
+    hashed as they arrive and IntegrityError is raised if they differ from
+    what was uploaded.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MEMORY)
+    hasher = BlockHasher(checksum["block_size"]) if checksum else None
+    try:
+        with http_client.stream("GET", url) as response:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+                spool.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        if hasher is not None and hasher.checksum() != checksum["checksum"]:
+            raise IntegrityError("Checksum mismatch: the stored file is corrupt", checksum["path"])
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def zip_files(http_client, files, out, max_workers=ZIP_WORKERS, on_progress=None):
+    """Write objects into a zip archive as they are fetched
+
+    Objects are downloaded concurrently by a bounded pool and each one is
+    added to the archive as soon as it arrives. At most ``max_workers``
+    downloads are in flight and no more finished downloads than that wait
+    to be written, so memory use does not grow with the number of files.
+
+    Args:
+        http_client: httpx.Client used for the downloads
+        files: Iterable of (arcname, url, encoding, checksum) tuples;
+            encoding is the codec the object is stored compressed with, and
+            checksum its MetadataIndex.checksums() row to verify it against.
+            Either may be None
+        out: Path or writable binary file object for the archive
+        max_workers: Maximum number of concurrent downloads
+        on_progress: Optional callback called with (done, total) after each
+            file
+
+    Returns:
+        List of result dicts with name, ok and error, one per file
+    """
+    files = list(files)
+    results = []
+    pending = {}
+    queue = iter(files)
+    with zipfile.ZipFile(out, "w", allowZip64=True) as archive, \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        def refill():
+            for arcname, url, encoding, checksum in queue:
+                pending[pool.submit(fetch_object, http_client, url, checksum)] = (arcname, encoding)
+                if len(pending) >= max_workers:
+                    break
+
+        refill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                arcname, encoding = pending.pop(future)
+                try:
+                    with future.result() as spool:
+                        # Media is already compressed; deflating it again only costs CPU
+                        mime_type = guess_type(arcname)
+                        compressible = encoding or mime_type is None or choose_encoding(mime_type)
+                        method = zipfile.ZIP_DEFLATED if compressible else zipfile.ZIP_STORED
+                        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                        info.compress_type = method
+                        with archive.open(info, "w", force_zip64=True) as entry:
+                            shutil.copyfileobj(open_decoded(spool, encoding), entry, STREAM_CHUNK_SIZE)
+                    results.append({"name": arcname, "ok": True, "error": None})
+                except Exception as e:
+                    results.append({"name": arcname, "ok": False, "error": str(e)})
+                if on_progress:
+                    on_progress(len(results), len(files))
+            refill()
+    return results
+
+
+def purge_exports(max_age=EXPORT_MAX_AGE):
+    """Remove archives built longer than ``max_age`` seconds ago"""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+def export_path(name):
+    """Path of a new archive in EXPORT_DIR, clearing out old ones first"""
+    purge_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    return os.path.join(EXPORT_DIR, name)
@@ -0,0 +1,256 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timezone
+
+# Seconds a cached folder listing stays valid before it is fetched again
+LISTING_TTL = 120
+
+# Number of objects requested per list() call when loading a whole folder
+LIST_PAGE_SIZE = 1000
+
+# Listings are requested in name order so offsets stay stable between calls
+LIST_SORT = {"column": "name", "order": "asc"}
+
+
+def list_options(offset, page_size=LIST_PAGE_SIZE):
+    """Options of the list() call fetching the page that starts at ``offset``"""
+    return {"limit": page_size, "offset": offset, "sortBy": LIST_SORT}
+
+
+def split_entries(folder, entries):
+    """Split a folder listing into files and the sub-folders to descend into
+
+    Folders starting with a dot hold derived data such as thumbnails and
+    are skipped.
+
+    Returns:
+        Tuple of ([(path, entry)] of files, [path] of sub-folders)
+    """
+    files, folders = [], []
+    for entry in entries:
+        path = f"{folder}/{entry['name']}"
+        if not is_folder(entry):
+            files.append((path, entry))
+        elif not entry["name"].startswith("."):
+            folders.append(path)
+    return files, folders
+
+
+def list_folder(bucket, folder, page_size=LIST_PAGE_SIZE):
+    """List every object in a folder, following list() pagination
+
+    Args:
+        bucket: Storage bucket proxy, e.g. client.storage.from_("fileuploads")
+        folder: Folder path inside the bucket
+
+    Returns:
+        List of object dicts as returned by storage list()
+    """
+    objects = []
+    offset = 0
+    while True:
+        page = bucket.list(folder, list_options(offset, page_size))
+        objects.extend(page)
+        if len(page) < page_size:
+            return objects
+        offset += page_size
+
+
+def walk_folder(bucket, folder):
+    """Yield (path, entry) for every file under a folder, recursively
+
+    Files of a folder come before those of its sub-folders; see
+    split_entries() for the folders skipped.
+    """
+    files, folders = split_entries(folder, list_folder(bucket, folder))
+    yield from files
+    for path in folders:
+        yield from walk_folder(bucket, path)
+
+
+def make_entry(name, size, mime_type):
+    """Build a listing entry for a freshly uploaded object
+
+    The shape matches what storage list() returns, so cached listings can be
+    patched in place without refetching the folder.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "name": name,
+        "id": None,
+        "created_at": now,
+        "updated_at": now,
+        "last_accessed_at": now,
+        "metadata": {"size": size, "mimetype": mime_type},
+    }
+
+
+def make_folder_entry(name):
+    """Build a listing entry for a sub-folder, as storage list() returns them"""
+    return {"name": name, "id": None, "created_at": None, "updated_at": None, "last_accessed_at": None,
+            "metadata": None}
+
+
+def is_folder(entry):
+    """Whether a listing entry is a sub-folder rather than a file"""
+    return entry.get("metadata") is None
+
+
+class _Snapshot:
+    """The part of a folder listing loaded so far
+
+    Entries are a name-ordered prefix of the server listing. ``server_offset``
+    is the list() offset of the first row not loaded yet; it is adjusted when
+    the snapshot is patched so later pages line up with the server again.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.entries = {}
+        self.server_offset = 0
+        self.complete = False
+        self.fetched_at = time.monotonic()
+
+    def frontier(self):
+        """Name of the last loaded entry, or None when nothing is loaded"""
+        return self.names[-1] if self.names else None
+
+    def extend(self, rows, limit):
+        self.server_offset += len(rows)
+        if len(rows) < limit:
+            self.complete = True
+        for row in rows:
+            # Sub-folders come back without metadata and are kept, so a
+            # folder can be browsed one level at a time; dot-folders hold
+            # derived data and are never shown
+            if row["name"] in self.entries or (row.get("metadata") is None and row["name"].startswith(".")):
+                continue
+            bisect.insort(self.names, row["name"])
+            self.entries[row["name"]] = row
+
+
+class ListingCache:
+    """Per-user cache of folder listings with a TTL
+
+    Every folder prefix has a snapshot of its own, holding its files and
+    sub-folders but nothing below them, so browsing a deep tree only lists
+    the folders that are opened. Listings are loaded lazily, one list()
+    page at a time, so showing the first page of a huge folder never lists
+    the whole folder. Uploads and deletes patch the cached snapshot in
+    place, so a change to a single object never forces the folder to be
+    listed again.
+    """
+
+    def __init__(self, ttl=LISTING_TTL):
+        self.ttl = ttl
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def _snapshot(self, folder):
+        snapshot = self._snapshots.get(folder)
+        if snapshot is None or time.monotonic() - snapshot.fetched_at >= self.ttl:
+            self._purge_expired()
+            snapshot = self._snapshots[folder] = _Snapshot()
+        return snapshot
+
+    def _load(self, bucket, folder, count, chunk_size):
+        """Make sure at least ``count`` entries are loaded, or the folder is"""
+        while True:
+            with self._lock:
+                snapshot = self._snapshot(folder)
+                if snapshot.complete or (count is not None and len(snapshot.names) >= count):
+                    return snapshot
+                offset = snapshot.server_offset
+
+            rows = bucket.list(folder, list_options(offset, chunk_size))
+            with self._lock:
+                self.fetches += 1
+                # Another session may have loaded the same rows meanwhile
+                if snapshot.server_offset == offset:
+                    snapshot.extend(rows, chunk_size)
+
+    def get(self, bucket, folder):
+        """Return the complete listing for a folder, fetching what is missing
+
+        Returns:
+            List of object and sub-folder dicts sorted by name
+        """
+        snapshot = self._load(bucket, folder, None, LIST_PAGE_SIZE)
+        with self._lock:
+            return [snapshot.entries[name] for name in snapshot.names]
+
+    def get_page(self, bucket, folder, page, page_size):
+        """Return one page of a folder listing, loading it on first use
+
+        Args:
+            bucket: Storage bucket proxy
+            folder: Folder path inside the bucket
+            page: Zero-based page number
+            page_size: Number of entries per page
+
+        Returns:
+            Tuple of (entries, has_more) where has_more tells whether a
+            later page exists. Sub-folders are entries too; see is_folder().
+        """
+        start = page * page_size
+        # One extra entry tells us whether there is a next page
+        snapshot = self._load(bucket, folder, start + page_size + 1, page_size + 1)
+        with self._lock:
+            names = snapshot.names[start:start + page_size]
+            has_more = len(snapshot.names) > start + page_size or not snapshot.complete
+            return [snapshot.entries[name] for name in names], has_more
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for folder in [key for key, snap in self._snapshots.items() if now - snap.fetched_at >= self.ttl]:
+            del self._snapshots[folder]
+
+    def invalidate(self, folder):
+        """Drop the snapshots of a folder and its sub-folders so the next reads refetch them"""
+        with self._lock:
+            for key in [key for key in self._snapshots if key == folder or key.startswith(f"{folder}/")]:
+                del self._snapshots[key]
+
+    def add_entry(self, folder, entry):
+        """Insert or replace one object in a cached listing"""
+        with self._lock:
+            snapshot = self._snapshots.get(folder)
+            if snapshot is None:
+                return
+            name = entry["name"]
+            if name in snapshot.entries:
+                snapshot.entries[name] = entry
+                return
+            frontier = snapshot.frontier()
+            if snapshot.complete or (frontier is not None and name < frontier):
+                bisect.insort(snapshot.names, name)
+                snapshot.entries[name] = entry
+                if not snapshot.complete:
+                    snapshot.server_offset += 1
+            # Names past the loaded frontier arrive with a later page
+
+    def remove_entries(self, folder, names):
+        """Remove objects from a cached listing by name"""
+        with self._lock:
+            snapshot = self._snapshots.get(folder)
+            if snapshot is None:
+                return
+            for name in names:
+                if snapshot.entries.pop(name, None) is not None:
+                    del snapshot.names[bisect.bisect_left(snapshot.names, name)]
+                    snapshot.server_offset -= 1
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_listing_cache():
+    """Return the process-wide ListingCache shared by all Streamlit sessions"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ListingCache()
+        return _cache
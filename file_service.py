@@ -0,0 +1,647 @@
+import io
+import os
+import posixpath
+import shutil
+import time
+from pathlib import Path
+
+import httpx
+
+from async_storage import AsyncStorage, gather_limited, get_event_loop_thread
+from compression import STREAM_CHUNK_SIZE, open_decoded
+from file_actions import DELETE_BATCH_SIZE, EXPORT_MAX_AGE, delete_files, fetch_object, zip_files
+from file_cache import get_listing_cache, is_folder, make_entry, make_folder_entry
+from file_types import classify
+from integrity import (CORRUPT, MISSING, SCRUB_BYTES_PER_RUN, SCRUB_MAX_AGE, UNVERIFIED, VERIFIED, IntegrityError,
+                       verify_url)
+from limits import get_limits
+from metadata_index import get_metadata_index
+from shares import SHARE_MAX_TTL, SHARE_TTL, get_share_links, share_url
+from signed_urls import get_signed_url_cache
+from supabase_client import get_client_manager
+from thumbnails import forget_thumbnails
+from uploads import MAX_CONCURRENT_UPLOADS, publish_version, store_file, upload_many
+from versions import get_version_store
+
+# Bucket holding every user's files
+BUCKET = "fileuploads"
+
+
+def _storage_owner(info):
+    """ID of the user who uploaded an object, from its info(); None if not reported"""
+    return info.get("owner_id") or info.get("owner")
+
+
+class FileService:
+    """Storage operations of one user, independent of the Streamlit UI
+
+    Wraps the storage calls the app makes for a user folder and keeps the
+    shared caches (folder listings, metadata index, signed URLs) in step
+    with them. The app builds one per rerun; benchmarks and scripts can
+    call it directly.
+
+    File names are paths relative to the user folder and may contain
+    sub-folders, e.g. ``photos/2024/beach.jpg``.
+
+    Storage calls that do not depend on each other are sent together
+    through an async_storage.AsyncStorage on the shared event loop thread.
+
+    Background jobs keep using the FileService of the rerun that queued
+    them, so ``client``, ``bucket`` and ``storage`` refresh the access token
+    through the ClientManager whenever it is about to expire.
+    """
+
+    def __init__(self, client, user_folder, listing_cache=None, index=None, signed_urls=None,
+                 thumbnail_service=None, http_client=None, limits=None, share_links=None, versions=None, io=None,
+                 clients=None):
+        self._client = client
+        self.user_folder = user_folder
+        self.listing_cache = listing_cache or get_listing_cache()
+        self.index = index or get_metadata_index()
+        self.signed_urls = signed_urls or get_signed_url_cache()
+        self.thumbnail_service = thumbnail_service
+        self.http_client = http_client
+        self.limits = limits or get_limits()
+        self.share_links = share_links or get_share_links()
+        self.versions = versions or get_version_store()
+        self.io = io or get_event_loop_thread()
+        self.clients = clients or get_client_manager()
+        self._storage = None
+        self._storage_authorization = None
+
+    @property
+    def client(self):
+        """The Supabase client, its access token refreshed if about to expire"""
+        self.clients.ensure_fresh(self._client)
+        return self._client
+
+    @property
+    def bucket(self):
+        """Storage bucket proxy with the client's current token"""
+        return self.client.storage.from_(BUCKET)
+
+    @property
+    def storage(self):
+        """AsyncStorage of the bucket, with the client's current token"""
+        authorization = self.client.options.headers["Authorization"]
+        if self._storage is None or self._storage_authorization != authorization:
+            self._storage = AsyncStorage(self._client, BUCKET, self.io)
+            self._storage_authorization = authorization
+        return self._storage
+
+    def path(self, name):
+        return f"{self.user_folder}/{name}"
+
+    def folder_path(self, folder=""):
+        """Storage prefix of a sub-folder given relative to the user folder"""
+        return f"{self.user_folder}/{folder}" if folder else self.user_folder
+
+    def _cache_add(self, name, size, content_type):
+        """Patch a stored file, and any new folders on its path, into the cached listings"""
+        folder, base = posixpath.split(name)
+        self.listing_cache.add_entry(self.folder_path(folder), make_entry(base, size, content_type))
+        while folder:
+            parent, base = posixpath.split(folder)
+            self.listing_cache.add_entry(self.folder_path(parent), make_folder_entry(base))
+            folder = parent
+
+    def _cache_remove(self, names):
+        """Remove deleted files from the cached listings of their folders"""
+        by_folder = {}
+        for name in names:
+            folder, base = posixpath.split(name)
+            by_folder.setdefault(folder, []).append(base)
+        for folder, bases in by_folder.items():
+            self.listing_cache.remove_entries(self.folder_path(folder), bases)
+
+    def _usage(self):
+        """(file_count, total_size) counted against the quota
+
+        Earlier versions take storage of their own, so their bytes count
+        towards the size.
+        """
+        file_count, total_size = self.index.usage(self.user_folder)
+        return file_count, total_size + self.versions.stored_size(self.user_folder)
+
+    def usage(self):
+        """Return the user's quota and how much of it is used
+
+        Returns:
+            Dict with ``file_count`` and ``total_size`` from the maintained
+            counters, the part of the size taken by earlier versions as
+            ``versions_size``, and ``max_bytes`` and ``max_files`` (0 for
+            unlimited)
+        """
+        file_count, total_size = self._usage()
+        max_bytes, max_files = self.limits.quota(self.user_folder)
+        return {"file_count": file_count, "total_size": total_size,
+                "versions_size": self.versions.stored_size(self.user_folder),
+                "max_bytes": max_bytes, "max_files": max_files}
+
+    def check_quota(self, size, count=1):
+        """Raise limits.QuotaExceeded if files of ``size`` bytes in total do not fit"""
+        self.limits.check(self.user_folder, self._usage, size, count)
+
+    def _throttle(self, size):
+        self.limits.throttle(self.user_folder, size)
+
+    def _before_item(self):
+        self.limits.wait_for_file(self.user_folder)
+        # A batch can take longer than the token it started with lasts
+        self.clients.ensure_fresh(self._client)
+
+    def store(self, name, fileobj, size, content_type=None, compress=False, progress=None):
+        """Upload one file into the user folder, skipping identical content
+
+        The upload is admitted against the user's quota before the file is
+        read and then waits on the file and bandwidth limits. A file of the
+        same name is replaced by a new version; see versions().
+
+        Returns:
+            The store_file() result dict
+
+        Raises:
+            limits.QuotaExceeded: The file does not fit the user's quota
+        """
+        path = self.path(name)
+        with self.limits.admit(self.user_folder, self._usage, size):
+            self.limits.wait_for_file(self.user_folder)
+            stored = store_file(self.client, BUCKET, path, fileobj, size, self.user_folder, self.index,
+                                content_type=content_type, progress=progress, compress=compress,
+                                throttle=self._throttle, versions=self.versions)
+        # Patch the cached listing instead of refetching the folder
+        self._cache_add(name, stored["size"], stored["content_type"])
+        self.signed_urls.forget(self.bucket, [path])
+        return stored
+
+    def upload_batch(self, items, concurrency=MAX_CONCURRENT_UPLOADS, compress=False, on_result=None):
+        """Upload uploads.BatchItem objects in parallel
+
+        The whole batch is admitted against the user's quota before any
+        file is opened; workers then wait on the file and bandwidth limits.
+
+        Returns:
+            The upload_many() result dicts
+
+        Raises:
+            limits.QuotaExceeded: The batch does not fit the user's quota
+        """
+        items = list(items)
+        sizes = {item.path: item.size for item in items}
+        reservation = self.limits.admit(self.user_folder, self._usage, sum(sizes.values()), len(items))
+
+        def record(result):
+            # Finished files are in the usage counters now, failed ones never will be
+            reservation.release(sizes.get(result["path"], 0))
+            if result["ok"]:
+                self._cache_add(result["path"][len(self.user_folder) + 1:], result["size"], result["content_type"])
+            if on_result:
+                on_result(result)
+
+        with reservation:
+            results = upload_many(self.client, BUCKET, items, max_workers=concurrency, on_result=record,
+                                  owner=self.user_folder, index=self.index, compress=compress,
+                                  before_item=self._before_item,
+                                  throttle=self._throttle, versions=self.versions)
+        self.signed_urls.forget(self.bucket, [r["path"] for r in results if r["ok"]])
+        return results
+
+    def delete(self, names, on_progress=None):
+        """Delete files of the user folder in batches
+
+        Returns:
+            The delete_files() result dicts
+        """
+        results = delete_files(self.bucket, self.user_folder, names, on_progress=on_progress)
+        deleted = [r["name"] for r in results if r["ok"]]
+        paths = [self.path(name) for name in deleted]
+        self._cache_remove(deleted)
+        self.index.forget(self.user_folder, paths)
+        self.signed_urls.forget(self.bucket, paths)
+        self.share_links.forget(self.user_folder, paths)
+        self._remove(self.versions.forget(self.user_folder, paths) + forget_thumbnails(self.user_folder, paths))
+        return results
+
+    def _remove(self, keys):
+        """Delete objects by path in concurrent batches, ignoring ones already gone"""
+        batches = [keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(keys), DELETE_BATCH_SIZE)]
+        if batches:
+            self.io.gather(*(self.storage.bucket.remove(batch) for batch in batches))
+
+    def versions_of(self, name):
+        """Return the stored versions of a file, newest first
+
+        Returns:
+            List of dicts with ``version``, ``size``, ``content_type``,
+            ``created_at`` and whether it is the ``current`` one
+        """
+        return [
+            {key: row[key] for key in ("version", "size", "content_type", "created_at", "current")}
+            for row in self.versions.history(self.user_folder, self.path(name))
+        ]
+
+    def restore(self, name, version):
+        """Make an earlier version of a file the current one
+
+        The version's object is published to the file's path the same way
+        an upload is, and the index is brought back to its size, type and
+        checksum.
+
+        Raises:
+            FileNotFoundError: The version does not exist or was collected
+        """
+        path = self.path(name)
+        row = self.versions.get(self.user_folder, path, version)
+        if row is None:
+            raise FileNotFoundError(f"{name} has no version {version}")
+        with self.versions.lock(self.user_folder, path):
+            if self.versions.current(self.user_folder, path) == version:
+                return
+            publish_version(self.client, BUCKET, self.versions, self.user_folder, path, row["storage_key"])
+            self.versions.point(self.user_folder, path, version)
+        # The restored version's bytes are at the path now
+        self._remove([row["storage_key"]])
+        self.index.record(self.user_folder, path, row["size"], row["content_type"], content_hash=row["hash"],
+                          encoding=row["encoding"] or "")
+        if row["checksum"] is not None:
+            self.index.record_checksum(self.user_folder, path, row["checksum"], row["blocks"], row["block_size"])
+        self._cache_add(name, row["size"], row["content_type"])
+        self.signed_urls.forget(self.bucket, [path])
+
+    def collect_versions(self, keep=None):
+        """Delete versions beyond the newest ``keep`` and abandoned uploads
+
+        Works from the version table alone, so no folder is listed.
+
+        Returns:
+            Dict with the number of versions ``removed``
+        """
+        doomed = self.versions.collectable(self.user_folder, keep)
+        self._remove([key for _, _, _, key in doomed])
+        self.versions.drop(doomed)
+        return {"removed": len(doomed)}
+
+    def has_legacy_files(self, legacy_folder):
+        """Whether a folder named the old way holds anything, with a one-row listing"""
+        return bool(self.bucket.list(legacy_folder, {"limit": 1}))
+
+    def adopt_folder(self, legacy_folder, owner_id, on_progress=None):
+        """Move the user's own files out of a folder named the old way
+
+        User folders used to be named after the part of the email address
+        before the @, which users of different domains shared, so only
+        objects whose storage owner is ``owner_id`` are moved; the rest stay
+        where they are for their own uploaders. Objects whose owner storage
+        does not report are left alone too. Moved files go into the user
+        folder server-side and keep their index rows and checksums; their
+        earlier versions, thumbnails and share links are dropped.
+
+        Args:
+            legacy_folder: The old folder name
+            owner_id: ID of the user whose uploads are moved
+            on_progress: Optional callback called with (done, total)
+
+        Returns:
+            Dict with the number of files ``moved``, the number ``skipped``
+            as uploaded by someone else, and the result dicts, with name, ok
+            and error, of those that ``failed``
+        """
+        offset = len(legacy_folder) + 1
+        stored = self.io.run(self.storage.walk_folder(legacy_folder))
+        infos = self.io.run(gather_limited([self.storage.bucket.info(path) for path, _ in stored]))
+        failed = [{"name": path[offset:], "ok": False, "error": str(info)}
+                  for (path, _), info in zip(stored, infos) if isinstance(info, Exception)]
+        wanted = [(path, entry) for (path, entry), info in zip(stored, infos)
+                  if not isinstance(info, Exception) and _storage_owner(info) == owner_id]
+        skipped = len(stored) - len(wanted) - len(failed)
+        total = len(wanted) + len(failed)
+        checksums = self.index.checksums(legacy_folder, [path for path, _ in wanted])
+        moved = []
+        # Moves run concurrently, a batch at a time so progress can be reported
+        for start in range(0, len(wanted), DELETE_BATCH_SIZE):
+            batch = wanted[start:start + DELETE_BATCH_SIZE]
+            outcomes = self.io.run(gather_limited(
+                [self.storage.bucket.move(path, self.path(path[offset:])) for path, _ in batch]
+            ))
+            for (path, entry), outcome in zip(batch, outcomes):
+                name = path[offset:]
+                if isinstance(outcome, Exception):
+                    failed.append({"name": name, "ok": False, "error": str(outcome)})
+                    continue
+                moved.append(path)
+                metadata = (self.index.get(legacy_folder, path) or entry)["metadata"]
+                self.index.record(self.user_folder, self.path(name), metadata.get("size") or 0, metadata.get("mimetype"),
+                                  content_hash=metadata.get("sha256"), encoding=metadata.get("encoding") or "")
+                if path in checksums:
+                    row = checksums[path]
+                    self.index.record_checksum(self.user_folder, self.path(name), row["checksum"], row["blocks"],
+                                               row["block_size"])
+            if on_progress:
+                on_progress(len(moved) + len(failed), total)
+        self.index.forget(legacy_folder, moved)
+        self.share_links.forget(legacy_folder, moved)
+        self._remove(self.versions.forget(legacy_folder, moved) + forget_thumbnails(legacy_folder, moved))
+        self.listing_cache.invalidate(legacy_folder)
+        self.listing_cache.invalidate(self.user_folder)
+        return {"moved": len(moved), "skipped": skipped, "failed": failed}
+
+    def reindex(self):
+        """Resync the metadata index with the bucket
+
+        Returns:
+            Dict with the number of objects added, updated and removed
+        """
+        self.listing_cache.invalidate(self.user_folder)
+        return self.index.reconcile(self.bucket, self.user_folder, self.user_folder,
+                                    stored=self.io.run(self.storage.walk_folder(self.user_folder)))
+
+    def list_page(self, page, page_size, query="", sort="name", descending=False, category=None, folder=""):
+        """Return one page of the user's files
+
+        Plain name-ordered pages come from the listing of ``folder`` alone
+        and include its sub-folders (see file_cache.is_folder()); searches,
+        type filters and other sort orders are answered by the metadata
+        index and cover every file below ``folder``.
+
+        Args:
+            folder: Sub-folder relative to the user folder; "" for the top
+
+        Returns:
+            Tuple of (entries, has_more); entry names are relative to the
+            user folder
+        """
+        if query or category or sort != "name" or descending:
+            entries = self.index.search(self.user_folder, query, sort=sort, descending=descending,
+                                        limit=page_size + 1, offset=page * page_size, category=category,
+                                        folder=folder or None)
+            return entries[:page_size], len(entries) > page_size
+        # Only the current page of this folder is fetched; later pages and
+        # sub-folders load when visited
+        entries, has_more = self.listing_cache.get_page(self.bucket, self.folder_path(folder), page, page_size)
+        if folder:
+            entries = [{**entry, "name": f"{folder}/{entry['name']}"} for entry in entries]
+        return entries, has_more
+
+    def page_links(self, entries):
+        """Resolve everything a page of file cards links to
+
+        The page's files and its ready thumbnails are signed with one batch
+        request each, sent concurrently; both are served from cache on later
+        reruns.
+
+        Returns:
+            Dict with ``urls`` ({path: signed URL}), ``encodings`` ({path:
+            codec} for files stored compressed), ``thumbnails`` ({name:
+            thumbnail path or None}) and ``thumbnail_urls`` ({thumbnail path:
+            signed URL})
+        """
+        entries = [entry for entry in entries if not is_folder(entry)]
+        paths = [self.path(entry["name"]) for entry in entries]
+        thumbnails = {}
+        if self.thumbnail_service is not None:
+            # Entries come from storage listings, index searches or patched
+            # caches, so the indexed content hash is preferred over what they
+            # carry; storage's eTag stands in for files the index has no hash of
+            hashes = self.index.hashes(self.user_folder, paths)
+            requests = []
+            for path, entry in zip(paths, entries):
+                metadata = entry.get("metadata") or {}
+                content = hashes.get(path) or metadata.get("sha256") or metadata.get("eTag")
+                mime_type = classify(entry["name"], metadata.get("mimetype"))[0]
+                requests.append((path, content, metadata.get("size") or 0, mime_type))
+            found = self.thumbnail_service.request(lambda: self.bucket, self.user_folder, requests)
+            thumbnails = {entry["name"]: found.get(path) for path, entry in zip(paths, entries)}
+        urls, thumbnail_urls = self.io.gather(
+            self.signed_urls.get_many_async(self.storage.bucket, paths),
+            self.signed_urls.get_many_async(self.storage.bucket, [path for path in thumbnails.values() if path]),
+        )
+        return {
+            "urls": urls,
+            "encodings": self.index.encodings(self.user_folder, paths),
+            "thumbnails": thumbnails,
+            "thumbnail_urls": thumbnail_urls,
+        }
+
+    def share(self, name, ttl=SHARE_TTL):
+        """Create an expiring share link to a file
+
+        The file is signed for the lifetime of the link, served by
+        share_server.py, so recipients never load the app.
+
+        Args:
+            name: File name inside the user folder
+            ttl: Seconds the link works for, at most SHARE_MAX_TTL
+
+        Returns:
+            Dict with the ``token``, its public ``url`` and ``expires_at``
+
+        Raises:
+            FileNotFoundError: The file does not exist
+        """
+        path = self.path(name)
+        ttl = int(min(ttl, SHARE_MAX_TTL))
+        signed = self.bucket.create_signed_urls([path], ttl)
+        if not signed or signed[0].get("error") or not signed[0].get("signedURL"):
+            raise FileNotFoundError(f"{name} does not exist")
+        expires_at = time.time() + ttl
+        metadata = (self.index.get(self.user_folder, path) or {}).get("metadata") or {}
+        token = self.share_links.create(
+            self.user_folder, path, posixpath.basename(name), signed[0]["signedURL"], expires_at,
+            mime_type=classify(name, metadata.get("mimetype"))[0], encoding=metadata.get("encoding"),
+        )
+        return {"token": token, "url": share_url(token), "expires_at": expires_at}
+
+    def share_export(self, archive):
+        """Create a link to a finished zip export, see export_zip()
+
+        share_server.py streams the archive from the export directory, so
+        it is never loaded into the app. The link works until the archive
+        is purged.
+
+        Returns:
+            Dict with the ``token``, its public ``url`` and ``expires_at``
+        """
+        archive = os.path.abspath(archive)
+        expires_at = os.path.getmtime(archive) + EXPORT_MAX_AGE
+        token = self.share_links.create(self.user_folder, archive, "files.zip", Path(archive).as_uri(), expires_at,
+                                        mime_type="application/zip")
+        return {"token": token, "url": share_url(token), "expires_at": expires_at}
+
+    def shared_links(self):
+        """Return the user's share links that still work, newest first
+
+        Links to zip exports are not listed.
+        """
+        offset = len(self.user_folder) + 1
+        return [
+            {"token": link["token"], "name": link["path"][offset:], "url": share_url(link["token"]),
+             "created_at": link["created_at"], "expires_at": link["expires_at"]}
+            for link in self.share_links.links(self.user_folder)
+            if link["path"].startswith(f"{self.user_folder}/")
+        ]
+
+    def revoke_shares(self, tokens):
+        """Stop share links from working"""
+        self.share_links.revoke(self.user_folder, tokens)
+
+    def export_zip(self, archive, names=None, on_progress=None):
+        """Write files of the user folder into a zip archive
+
+        Args:
+            archive: Path of the archive to create
+            names: File names to include; None includes the whole folder
+            on_progress: Optional callback called with (done, total)
+
+        Returns:
+            Dict with the ``archive`` path, its ``size`` and the zip_files()
+            result dicts as ``files``
+        """
+        if names is None:
+            paths = [path for path, _ in self.io.run(self.storage.walk_folder(self.user_folder))]
+        else:
+            paths = [self.path(name) for name in names]
+        urls = self.signed_urls.get_many(self.bucket, paths)
+        encodings = self.index.encodings(self.user_folder, paths)
+        checksums = self.index.checksums(self.user_folder, paths)
+        offset = len(self.user_folder) + 1
+        results = zip_files(
+            self.http_client or get_client_manager().http_client,
+            [(path[offset:], urls[path], encodings.get(path), checksums.get(path)) for path in paths],
+            archive,
+            on_progress=on_progress,
+        )
+        return {"archive": archive, "size": os.path.getsize(archive), "files": results}
+
+    def download(self, name):
+        """Return a file's original content, see download_to()"""
+        out = io.BytesIO()
+        self.download_to(name, out)
+        return out.getvalue()
+
+    def download_to(self, name, out):
+        """Write a file's original content to a binary file object
+
+        The stored bytes are streamed into a spooled temporary file and
+        checked against the upload checksum as they arrive, then
+        decompressed into ``out`` in chunks, so neither the stored nor the
+        original content is held in memory whole.
+
+        Raises:
+            integrity.IntegrityError: The stored bytes are not the ones that
+                were uploaded; the file is marked corrupt in the index
+        """
+        path = self.path(name)
+        url = self.signed_urls.get_many(self.bucket, [path])[path]
+        recorded = self.index.checksums(self.user_folder, [path]).get(path)
+        try:
+            spool = fetch_object(self.http_client or get_client_manager().http_client, url, recorded)
+        except IntegrityError:
+            self.index.mark_verified(self.user_folder, path, CORRUPT)
+            raise IntegrityError(f"{name} is corrupt in storage: its checksum does not match the upload", path)
+        with spool:
+            if recorded is not None:
+                self.index.mark_verified(self.user_folder, path, VERIFIED)
+            encoding = self.index.encodings(self.user_folder, [path]).get(path)
+            shutil.copyfileobj(open_decoded(spool, encoding), out, STREAM_CHUNK_SIZE)
+
+    def _verify(self, rows, budget=None, on_progress=None):
+        """Read objects back and compare them with their recorded checksums
+
+        Large objects are checked with parallel range requests. The outcome
+        of every check is recorded in the index.
+
+        Args:
+            rows: MetadataIndex.checksums() rows of the objects to check
+            budget: Optional limits.TokenBucket limiting the read rate
+            on_progress: Optional callback called with (done, total)
+
+        Returns:
+            List of result dicts with name, ok, status and error
+        """
+        urls = self.signed_urls.get_many(self.bucket, [row["path"] for row in rows])
+        http_client = self.http_client or get_client_manager().http_client
+        offset = len(self.user_folder) + 1
+        results = []
+        for row in rows:
+            error = None
+            try:
+                mismatched = verify_url(http_client, urls[row["path"]], row["size"], row["blocks"],
+                                        row["block_size"], budget=budget)
+            except httpx.HTTPStatusError as e:
+                # Storage answers 400 for objects that do not exist; 416 means
+                # a range lies past the end, so the object shrank
+                status = {400: MISSING, 404: MISSING, 416: CORRUPT}.get(e.response.status_code)
+                error = f"HTTP {e.response.status_code}"
+            except Exception as e:
+                status, error = None, str(e)
+            else:
+                status = CORRUPT if mismatched else VERIFIED
+                if mismatched:
+                    error = f"{len(mismatched)} corrupt blocks, first at byte {mismatched[0] * row['block_size']}"
+            if status is not None:
+                self.index.mark_verified(self.user_folder, row["path"], status)
+            else:
+                # Could not be checked, e.g. a network error; retried on the next run
+                status = UNVERIFIED
+            if status == MISSING:
+                error = "File is missing from storage"
+            results.append({"name": row["path"][offset:], "ok": status == VERIFIED, "status": status, "error": error})
+            if on_progress:
+                on_progress(len(results), len(rows))
+        return results
+
+    def verify(self, names, on_progress=None):
+        """Check files against the checksums taken when they were uploaded
+
+        Returns:
+            List of result dicts with name, ok, status and error. Files
+            uploaded before checksums were kept are reported as ok with
+            status "unverified".
+        """
+        paths = [self.path(name) for name in names]
+        rows = self.index.checksums(self.user_folder, paths)
+        results = self._verify([rows[path] for path in paths if path in rows], on_progress=on_progress)
+        results.extend(
+            {"name": name, "ok": True, "status": UNVERIFIED, "error": None}
+            for name, path in zip(names, paths) if path not in rows
+        )
+        return results
+
+    def scrub(self, max_bytes=SCRUB_BYTES_PER_RUN, max_age=SCRUB_MAX_AGE, on_progress=None):
+        """Re-verify the files checked longest ago, within an I/O budget
+
+        Files never verified since their upload come first. A run reads at
+        most ``max_bytes`` (and at least one file), charged to the read
+        budget all users' scrubs share (FILESHARE_SCRUB_RATE_MB per second
+        for the whole server), so repeated runs work through the folder
+        incrementally without saturating the storage API.
+
+        Returns:
+            Dict with the number of files ``verified``, the ``bytes`` read
+            and the result dicts of the files that ``failed``
+        """
+        rows, total = [], 0
+        for row in self.index.checksums_due(self.user_folder, time.time() - max_age):
+            if rows and total + row["size"] > max_bytes:
+                break
+            rows.append(row)
+            total += row["size"]
+        results = self._verify(rows, self.limits.scrub_bytes, on_progress)
+        return {"verified": len(results), "bytes": total, "failed": [r for r in results if not r["ok"]]}
+
+    def stats(self, largest=10):
+        """Return the user's storage statistics from the maintained aggregates
+
+        Returns:
+            Dict with file_count, total_size and extensions as returned by
+            MetadataIndex.stats(), plus ``histogram``, ``categories``,
+            ``growth`` and the ``largest`` files
+        """
+        stats = self.index.stats(self.user_folder)
+        stats.update(
+            histogram=self.index.size_histogram(self.user_folder),
+            categories=self.index.category_totals(self.user_folder),
+            growth=self.index.growth(self.user_folder),
+            largest=self.index.largest(self.user_folder, largest),
+        )
+        return stats
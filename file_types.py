@@ -0,0 +1,198 @@
+import mimetypes
+import posixpath
+from functools import lru_cache
+
+DEFAULT_TYPE = "application/octet-stream"
+
+# Bytes read from the start of a file to recognise its format; tar
+# archives are only recognisable at offset 257
+SNIFF_SIZE = 264
+
+# Types the platform's mimetypes table often lacks or gets wrong
+EXTRA_TYPES = {
+    ".md": "text/markdown",
+    ".log": "text/plain",
+    ".ndjson": "application/x-ndjson",
+    ".yaml": "application/x-yaml",
+    ".yml": "application/x-yaml",
+    ".sql": "application/sql",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+    ".avif": "image/avif",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".flac": "audio/flac",
+    ".m4a": "audio/mp4",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".gz": "application/gzip",
+    ".tgz": "application/gzip",
+    ".7z": "application/x-7z-compressed",
+    ".rar": "application/vnd.rar",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+# Extension -> MIME type, built once instead of per lookup. init() loads the
+# system's mime.types files, which guess_type() would otherwise do lazily.
+mimetypes.init()
+EXTENSION_TYPES = {**mimetypes.types_map, **EXTRA_TYPES}
+
+# Exact types whose category the rules below would not find
+CATEGORY_TYPES = {
+    "application/json": "text",
+    "application/x-ndjson": "text",
+    "application/xml": "text",
+    "application/x-yaml": "text",
+    "application/gzip": "archive",
+    "application/x-tar": "archive",
+    "application/x-7z-compressed": "archive",
+    "application/vnd.rar": "archive",
+    "application/zstd": "archive",
+    "application/rtf": "document",
+}
+
+# (category, prefixes, substrings), tried in order. Spreadsheets and
+# presentations come before documents: the OOXML types of both contain
+# "officedocument".
+CATEGORY_RULES = (
+    ("image", ("image/",), ()),
+    ("video", ("video/",), ()),
+    ("audio", ("audio/",), ()),
+    ("text", ("text/",), ()),
+    ("pdf", (), ("pdf",)),
+    ("spreadsheet", (), ("excel", "spreadsheet")),
+    ("presentation", (), ("presentation", "powerpoint")),
+    ("document", (), ("word", "document")),
+    ("archive", (), ("zip", "compressed")),
+)
+
+CATEGORY_ICONS = {
+    "image": "🖼️",
+    "video": "🎬",
+    "audio": "🎵",
+    "text": "📝",
+    "pdf": "📑",
+    "document": "📄",
+    "spreadsheet": "📊",
+    "presentation": "📽️",
+    "archive": "🗜️",
+    "other": "📁",
+}
+
+# Magic bytes as (offset, signature, MIME type); the first match wins
+SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"\x28\xb5\x2f\xfd", "application/zstd"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"\x1a\x45\xdf\xa3", "video/webm"),
+    (257, b"ustar", "application/x-tar"),
+)
+
+# RIFF and ISO media files name their format a few bytes in
+RIFF_TYPES = {b"WEBP": "image/webp", b"WAVE": "audio/wav", b"AVI ": "video/x-msvideo"}
+FTYP_TYPES = {b"M4A ": "audio/mp4", b"heic": "image/heic", b"heix": "image/heic", b"avif": "image/avif",
+              b"qt  ": "video/quicktime"}
+
+# Formats other formats are built on (docx, xlsx, jar and epub are zip
+# files), so their signature only names a file nothing else names
+CONTAINER_TYPES = {"application/zip"}
+
+
+def extension(name):
+    """Lower-case extension of a file name, including the dot; '' if none"""
+    return posixpath.splitext(name)[1].lower()
+
+
+@lru_cache(maxsize=4096)
+def guess_type(name):
+    """MIME type of a file name from its extension, or None if unknown"""
+    return EXTENSION_TYPES.get(extension(name))
+
+
+@lru_cache(maxsize=1024)
+def mime_category(mime_type):
+    """Group a MIME type into the categories used for icons, stats and filtering"""
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    category = CATEGORY_TYPES.get(mime_type)
+    if category:
+        return category
+    for category, prefixes, substrings in CATEGORY_RULES:
+        if mime_type.startswith(prefixes) or any(part in mime_type for part in substrings):
+            return category
+    return "other"
+
+
+def file_icon(mime_type):
+    """Icon shown for files of a MIME type"""
+    return CATEGORY_ICONS[mime_category(mime_type)]
+
+
+@lru_cache(maxsize=4096)
+def classify(name, mime_type=None):
+    """Return (mime_type, category, icon) of a file
+
+    A recorded type (e.g. the ``mimetype`` of a listing entry) is used as
+    is; without one, or when it is the generic octet-stream, the type is
+    guessed from the extension.
+    """
+    if not mime_type or mime_type == DEFAULT_TYPE:
+        mime_type = guess_type(name) or DEFAULT_TYPE
+    category = mime_category(mime_type)
+    return mime_type, category, CATEGORY_ICONS[category]
+
+
+def sniff(head):
+    """MIME type recognised from the first bytes of a file, or None"""
+    for offset, signature, mime_type in SIGNATURES:
+        if head.startswith(signature, offset):
+            return mime_type
+    if head.startswith(b"RIFF"):
+        return RIFF_TYPES.get(head[8:12])
+    if head[4:8] == b"ftyp":
+        return FTYP_TYPES.get(head[8:12], "video/mp4")
+    return None
+
+
+def detect_type(name, fileobj=None, declared=None):
+    """Decide the MIME type to store a file with
+
+    The declared type (normally from the browser) or the extension is
+    trusted unless the file's magic bytes say it is something of another
+    category, e.g. a PNG named ``.txt``. Files without a usable name get
+    their sniffed type. The file is rewound afterwards.
+
+    Args:
+        name: File name
+        fileobj: Optional seekable binary file object to sniff
+        declared: Type the client sent with the file, if any
+
+    Returns:
+        MIME type, DEFAULT_TYPE when nothing is known
+    """
+    claimed = declared if declared and declared != DEFAULT_TYPE else guess_type(name)
+    if fileobj is None:
+        return claimed or DEFAULT_TYPE
+    fileobj.seek(0)
+    sniffed = sniff(fileobj.read(SNIFF_SIZE))
+    fileobj.seek(0)
+    if sniffed is None:
+        return claimed or DEFAULT_TYPE
+    if claimed is None:
+        return sniffed
+    if sniffed in CONTAINER_TYPES or mime_category(sniffed) == mime_category(claimed):
+        return claimed
+    return sniffed
@@ -0,0 +1,172 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+
+# Stored bytes are checksummed per block of this size, so any range of an
+# object can be verified on its own
+BLOCK_SIZE = 8 * MB
+
+# Objects at least this large are verified with parallel range requests
+PARALLEL_VERIFY_SIZE = 64 * MB
+
+# Range requests in flight at once while verifying one object
+VERIFY_WORKERS = 4
+
+# Blocks fetched per range request
+RANGE_BLOCKS = 4
+
+# Bytes read per step while streaming an object through the hasher
+READ_SIZE = 1 * MB
+
+# Background scrubbing: bytes per second it may read, bytes per run, and how
+# long a verified object is trusted before it is checked again (seconds)
+SCRUB_RATE = float(os.environ.get("FILESHARE_SCRUB_RATE_MB", 8)) * MB
+SCRUB_BYTES_PER_RUN = int(float(os.environ.get("FILESHARE_SCRUB_RUN_MB", 512)) * MB)
+SCRUB_MAX_AGE = float(os.environ.get("FILESHARE_SCRUB_MAX_AGE_DAYS", 30)) * 24 * 60 * 60
+
+# Verification status of an object, as kept by the metadata index
+UNVERIFIED = "unverified"
+VERIFIED = "ok"
+CORRUPT = "corrupt"
+MISSING = "missing"
+
+
+class IntegrityError(Exception):
+    """Raised when stored bytes do not match the checksum taken on upload"""
+
+    def __init__(self, message, path=None, bad_blocks=None):
+        super().__init__(message)
+        self.path = path
+        self.bad_blocks = bad_blocks or []
+
+
+def combine(blocks):
+    """Object checksum from its concatenated block digests"""
+    return hashlib.sha256(blocks).hexdigest()
+
+
+class BlockHasher:
+    """SHA-256 of every BLOCK_SIZE block of a byte stream
+
+    The object checksum is the SHA-256 of the concatenated block digests, so
+    it is computed in the same single pass, while the block digests let
+    ranges of the object be verified independently and in parallel.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.size = 0
+        self._digests = []
+        self._current = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.block_size - self._filled)
+            self._current.update(view[:take])
+            self._filled += take
+            self.size += take
+            view = view[take:]
+            if self._filled == self.block_size:
+                self._digests.append(self._current.digest())
+                self._current = hashlib.sha256()
+                self._filled = 0
+
+    def blocks(self):
+        """Concatenated digests of every block, including a final partial one"""
+        if self._filled:
+            return b"".join(self._digests) + self._current.digest()
+        return b"".join(self._digests)
+
+    def checksum(self):
+        return combine(self.blocks())
+
+
+def checksum_file(fileobj, block_size=BLOCK_SIZE):
+    """Return (checksum, blocks) of a file object, rewound before and after"""
+    hasher = BlockHasher(block_size)
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(READ_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    fileobj.seek(0)
+    return hasher.checksum(), hasher.blocks()
+
+
+def checksum_bytes(data, block_size=BLOCK_SIZE):
+    """Return (checksum, blocks) of bytes held in memory"""
+    hasher = BlockHasher(block_size)
+    hasher.update(data)
+    return hasher.checksum(), hasher.blocks()
+
+
+def bad_blocks(expected, actual):
+    """Indexes of the blocks whose digests differ, or that only one side has"""
+    size = hashlib.sha256().digest_size
+    count = max(len(expected), len(actual)) // size
+    return [i for i in range(count) if expected[i * size:(i + 1) * size] != actual[i * size:(i + 1) * size]]
+
+
+def _hash_range(http_client, url, block_size, start=None, end=None, budget=None):
+    """Stream an object, or bytes start..end (inclusive) of it, through a BlockHasher
+
+    Returns:
+        Tuple of (block digests, total object size reported by storage)
+    """
+    hasher = BlockHasher(block_size)
+    headers = {"Range": f"bytes={start}-{end}"} if start is not None else {}
+    with http_client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        if start is not None and response.status_code != 206:
+            raise IntegrityError("Storage ignored the Range request")
+        for chunk in response.iter_bytes(READ_SIZE):
+            if budget is not None:
+                budget.consume(len(chunk))
+            hasher.update(chunk)
+    total = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return hasher.blocks(), int(total) if total.isdigit() else hasher.size
+
+
+def verify_url(http_client, url, size, blocks, block_size=BLOCK_SIZE, workers=VERIFY_WORKERS, budget=None):
+    """Read an object back over HTTP and compare it with its block digests
+
+    Objects of PARALLEL_VERIFY_SIZE and up are fetched as RANGE_BLOCKS-block
+    ranges by up to ``workers`` concurrent requests; smaller ones in one
+    streamed request. Nothing is kept in memory beyond the read buffer.
+
+    Args:
+        http_client: httpx.Client used for the downloads
+        url: Signed URL of the object
+        size: Stored size of the object in bytes
+        blocks: Concatenated block digests recorded on upload
+        block_size: Block size the digests were taken with
+        workers: Maximum number of concurrent range requests
+        budget: Optional limits.TokenBucket the bytes read are charged to
+
+    Returns:
+        Sorted list of the indexes of mismatching blocks; empty if intact
+    """
+    if size < PARALLEL_VERIFY_SIZE or workers <= 1:
+        return bad_blocks(blocks, _hash_range(http_client, url, block_size, budget=budget)[0])
+
+    digest_size = hashlib.sha256().digest_size
+    block_count = -(-size // block_size)
+
+    def check(first_block):
+        start = first_block * block_size
+        end = min(start + RANGE_BLOCKS * block_size, size) - 1
+        actual, total = _hash_range(http_client, url, block_size, start, end, budget)
+        expected = blocks[first_block * digest_size:(first_block + RANGE_BLOCKS) * digest_size]
+        mismatched = [first_block + i for i in bad_blocks(expected, actual)]
+        if total != size and not mismatched:
+            # The object grew or shrank since the checksum was taken
+            mismatched = [block_count - 1]
+        return mismatched
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sorted({index for found in pool.map(check, range(0, block_count, RANGE_BLOCKS)) for index in found})
@@ -0,0 +1,263 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from local_db import ensure_schema
+
+# Jobs running at once across all users
+MAX_JOB_WORKERS = 4
+
+# Jobs running at once for a single user; the rest wait in the queue
+MAX_USER_JOBS = 2
+
+# Finished jobs are kept this long (seconds) so their outcome can be shown
+JOB_RETENTION = 24 * 60 * 60
+
+# Minimum seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 0.25
+
+# Priorities; lower runs first. Background work yields to what a user waits on
+PRIORITY_NORMAL = 0
+PRIORITY_BACKGROUND = 1
+
+# Workers background jobs may take at once; the rest stay free for users' own jobs
+MAX_BACKGROUND_WORKERS = MAX_JOB_WORKERS - 1
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, finished_at);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class Job:
+    """Handle passed to a running job's function for reporting progress"""
+
+    def __init__(self, queue, job_id, owner, kind, run, priority, limited=True):
+        self.queue = queue
+        self.id = job_id
+        self.owner = owner
+        self.kind = kind
+        self.run = run
+        self.priority = priority
+        self.limited = limited
+        self._last_write = 0
+
+    def progress(self, fraction, message=None):
+        """Record how far the job got
+
+        Args:
+            fraction: Completed share of the work, between 0 and 1
+            message: Short status line shown next to the progress bar
+        """
+        now = time.monotonic()
+        if fraction < 1 and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        self.queue._update(self.id, progress=min(max(fraction, 0.0), 1.0), message=message)
+
+
+class JobQueue:
+    """Run long storage operations on worker threads, tracked in SQLite
+
+    Jobs are Python callables taking a Job. Their status, progress and
+    result live in the local database, so a page that reloads (or a new
+    session of the same user) picks them up again by polling. At most
+    ``max_workers`` jobs run at once, and no more than ``max_per_user`` for
+    the same owner; queued jobs start in priority then submission order.
+    Jobs submitted with ``limited=False`` only take a worker, so background
+    upkeep never holds up a user's own jobs, and background jobs together
+    take at most ``max_background`` workers so one is always left for them.
+
+    The callables themselves only exist in memory, so jobs that were queued
+    or running when the process stopped are marked interrupted on start.
+    """
+
+    def __init__(self, max_workers=MAX_JOB_WORKERS, max_per_user=MAX_USER_JOBS, max_background=MAX_BACKGROUND_WORKERS):
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.max_background = max(min(max_background, max_workers - 1), 1)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._pending = []
+        # Limited jobs running per owner, jobs running in all, and background ones
+        self._running = {}
+        self._workers = 0
+        self._background = 0
+        self._lock = threading.Lock()
+        self._recover()
+
+    def _conn(self):
+        return ensure_schema(SCHEMA)
+
+    def _recover(self):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)",
+            (INTERRUPTED, "The server restarted before the job finished", now, *ACTIVE_STATUSES),
+        )
+        conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RETENTION,))
+
+    def _update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._conn().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def submit(self, owner, kind, description, run, priority=PRIORITY_NORMAL, limited=True):
+        """Queue a job
+
+        Args:
+            owner: User the job belongs to; limits are applied per owner
+            kind: Short job type, e.g. "upload" or "delete"
+            description: Human readable summary shown in the job list
+            run: Callable taking a Job; its return value must be JSON
+                serializable and is stored as the job result
+            priority: PRIORITY_NORMAL or PRIORITY_BACKGROUND
+            limited: Whether the job counts towards the owner's
+                ``max_per_user`` running jobs
+
+        Returns:
+            The job id
+        """
+        job = Job(self, uuid.uuid4().hex, owner, kind, run, priority, limited)
+        self._conn().execute(
+            "INSERT INTO jobs (id, owner, kind, description, status, priority, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job.id, owner, kind, description, QUEUED, priority, time.time()),
+        )
+        with self._lock:
+            self._pending.append(job)
+        self._dispatch()
+        return job.id
+
+    def _dispatch(self):
+        """Start queued jobs while worker slots are free"""
+        with self._lock:
+            # sort() is stable, so jobs of equal priority keep submission order
+            self._pending.sort(key=lambda job: job.priority)
+            for job in list(self._pending):
+                if self._workers >= self.max_workers:
+                    break
+                if job.limited and self._running.get(job.owner, 0) >= self.max_per_user:
+                    continue
+                if job.priority == PRIORITY_BACKGROUND and self._background >= self.max_background:
+                    continue
+                self._pending.remove(job)
+                self._workers += 1
+                if job.priority == PRIORITY_BACKGROUND:
+                    self._background += 1
+                if job.limited:
+                    self._running[job.owner] = self._running.get(job.owner, 0) + 1
+                self._pool.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            self._update(job.id, status=RUNNING, started_at=time.time())
+            try:
+                result = job.run(job)
+            except Exception as e:
+                # The error is kept on the job row for the user; the log gets the traceback
+                logger.exception("Job %s %s failed", job.kind, job.id)
+                self._update(job.id, status=FAILED, error=str(e), finished_at=time.time())
+            else:
+                self._update(job.id, status=DONE, progress=1.0, result=json.dumps(result, default=str),
+                             finished_at=time.time())
+        finally:
+            with self._lock:
+                self._workers -= 1
+                if job.priority == PRIORITY_BACKGROUND:
+                    self._background -= 1
+                if job.limited:
+                    self._running[job.owner] -= 1
+                    if not self._running[job.owner]:
+                        del self._running[job.owner]
+            self._dispatch()
+
+    def cancel(self, owner, job_id):
+        """Cancel a job that has not started yet
+
+        Returns:
+            True if the job was still queued and is now cancelled
+        """
+        with self._lock:
+            job = next((job for job in self._pending if job.id == job_id and job.owner == owner), None)
+            if job is None:
+                return False
+            self._pending.remove(job)
+        self._update(job_id, status=CANCELLED, finished_at=time.time())
+        return True
+
+    def get(self, job_id):
+        """Return a job's row as a dict, or None if unknown"""
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def jobs_for(self, owner, kinds=None, limit=20):
+        """Return an owner's most recent jobs, newest first
+
+        Args:
+            owner: User whose jobs to list
+            kinds: Only list jobs of these kinds; None lists every kind
+            limit: Maximum number of jobs returned
+        """
+        where, params = "owner = ?", [owner]
+        if kinds:
+            where += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params += list(kinds)
+        rows = self._conn().execute(
+            f"SELECT * FROM jobs WHERE {where} ORDER BY created_at DESC LIMIT ?", params + [limit]
+        ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def is_active(self, owner, kind):
+        """Whether the owner has a queued or running job of this kind"""
+        row = self._conn().execute(
+            "SELECT 1 FROM jobs WHERE owner = ? AND kind = ? AND status IN (?, ?) LIMIT 1",
+            (owner, kind, *ACTIVE_STATUSES),
+        ).fetchone()
+        return row is not None
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide JobQueue shared by all sessions"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
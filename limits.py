@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+
+from integrity import READ_SIZE, SCRUB_RATE
+from local_db import ensure_schema
+
+MB = 1024 * 1024
+
+# Storage quota of a user unless set per user with Limits.set_quota(); 0 means unlimited
+QUOTA_BYTES = int(float(os.environ.get("FILESHARE_QUOTA_MB", 0)) * MB)
+QUOTA_FILES = int(os.environ.get("FILESHARE_QUOTA_FILES", 0))
+
+# Files started per second, per user and for the whole server; 0 means unlimited
+USER_FILE_RATE = float(os.environ.get("FILESHARE_USER_FILES_PER_SEC", 0))
+GLOBAL_FILE_RATE = float(os.environ.get("FILESHARE_FILES_PER_SEC", 0))
+
+# Upload bandwidth in bytes per second, per user and for the whole server; 0 means unlimited
+USER_BANDWIDTH = float(os.environ.get("FILESHARE_USER_BANDWIDTH_MB", 0)) * MB
+GLOBAL_BANDWIDTH = float(os.environ.get("FILESHARE_BANDWIDTH_MB", 0)) * MB
+
+# Seconds worth of a rate that an idle bucket saves up and may spend at once
+BURST_SECONDS = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_quotas (
+    owner TEXT PRIMARY KEY,
+    max_bytes INTEGER,
+    max_files INTEGER
+);
+"""
+
+
+class QuotaExceeded(Exception):
+    """Raised when an upload would take a user over their storage quota"""
+
+
+class TokenBucket:
+    """Limits how many units (bytes, files, ...) per second are consumed
+
+    Tokens accrue at ``rate`` per second up to ``capacity``. Consuming more
+    than is available runs the bucket into debt and sleeps until it is
+    repaid, so requests larger than the capacity still go through at the
+    configured rate. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate * BURST_SECONDS, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def reserve(self, count):
+        """Take ``count`` units and return the seconds to wait before using them"""
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.waited += wait
+        return wait
+
+    def consume(self, count):
+        """Take ``count`` units, sleeping until they are available"""
+        wait = self.reserve(count)
+        if wait:
+            time.sleep(wait)
+
+
+class Reservation:
+    """Room taken in a user's quota by an upload that has not been indexed yet
+
+    Uploads are added to the maintained usage counters as each file
+    finishes, so the matching part of the reservation is released then;
+    close() releases whatever is left.
+    """
+
+    def __init__(self, limits, owner, size, count):
+        self.limits = limits
+        self.owner = owner
+        self.size = size
+        self.count = count
+
+    def release(self, size, count=1):
+        size, count = min(size, self.size), min(count, self.count)
+        self.size -= size
+        self.count -= count
+        self.limits._unreserve(self.owner, size, count)
+
+    def close(self):
+        self.release(self.size, self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Limits:
+    """Storage quotas and upload rate limits of all users of this server
+
+    Quotas are checked against the usage counters the metadata index
+    maintains plus the uploads admitted but not finished yet, so checking
+    never lists the bucket. File and bandwidth limits are token buckets
+    kept per user and for the whole server; uploads wait on them before
+    reading the bytes they are about to send. Background scrubs of all
+    users share one read budget, ``scrub_bytes``.
+    """
+
+    def __init__(self, quota_bytes=QUOTA_BYTES, quota_files=QUOTA_FILES, user_file_rate=USER_FILE_RATE,
+                 global_file_rate=GLOBAL_FILE_RATE, user_bandwidth=USER_BANDWIDTH, global_bandwidth=GLOBAL_BANDWIDTH,
+                 scrub_rate=SCRUB_RATE):
+        self.quota_bytes = quota_bytes
+        self.quota_files = quota_files
+        self.user_file_rate = user_file_rate
+        self.user_bandwidth = user_bandwidth
+        self.global_files = TokenBucket(global_file_rate)
+        self.global_bytes = TokenBucket(global_bandwidth)
+        self.scrub_bytes = TokenBucket(scrub_rate, max(scrub_rate, READ_SIZE))
+        self._user_files = {}
+        self._user_bytes = {}
+        self._reserved = {}
+        self._lock = threading.Lock()
+        self._admit_lock = threading.Lock()
+
+    def _conn(self):
+        return ensure_schema(SCHEMA)
+
+    def set_quota(self, owner, max_bytes=None, max_files=None):
+        """Give a user their own quota; None falls back to the default, 0 is unlimited"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO user_quotas (owner, max_bytes, max_files) VALUES (?, ?, ?)",
+            (owner, max_bytes, max_files),
+        )
+
+    def quota(self, owner):
+        """Return (max_bytes, max_files) of a user; 0 means unlimited"""
+        row = self._conn().execute("SELECT max_bytes, max_files FROM user_quotas WHERE owner = ?", (owner,)).fetchone()
+        if row is None:
+            return self.quota_bytes, self.quota_files
+        return (
+            self.quota_bytes if row["max_bytes"] is None else row["max_bytes"],
+            self.quota_files if row["max_files"] is None else row["max_files"],
+        )
+
+    def reserved(self, owner):
+        """Return (bytes, files) admitted for a user but not indexed yet"""
+        with self._lock:
+            return tuple(self._reserved.get(owner, (0, 0)))
+
+    def check(self, owner, usage, size, count=1):
+        """Raise QuotaExceeded if an upload does not fit the user's quota
+
+        Args:
+            owner: User folder the upload goes to
+            usage: Callable returning (file_count, total_size) from the
+                maintained counters; only called when a quota is set
+            size: Bytes about to be uploaded
+            count: Files about to be uploaded
+        """
+        max_bytes, max_files = self.quota(owner)
+        if not max_bytes and not max_files:
+            return
+        file_count, total_size = usage()
+        reserved_size, reserved_count = self.reserved(owner)
+        if max_bytes and total_size + reserved_size + size > max_bytes:
+            free = max(max_bytes - total_size - reserved_size, 0)
+            raise QuotaExceeded(f"Not enough storage left: {size / MB:.1f} MB needed, {free / MB:.1f} MB free "
+                                f"of your {max_bytes / MB:.0f} MB quota")
+        if max_files and file_count + reserved_count + count > max_files:
+            raise QuotaExceeded(f"Too many files: your quota allows {max_files} and you have "
+                                f"{file_count + reserved_count}")
+
+    def admit(self, owner, usage, size, count=1):
+        """Check an upload against the quota and reserve room for it
+
+        Returns:
+            Reservation to release as files finish
+
+        Raises:
+            QuotaExceeded: The upload does not fit
+        """
+        # Admissions are serialized so concurrent uploads of the same user
+        # cannot both fit into the last free space
+        with self._admit_lock:
+            self.check(owner, usage, size, count)
+            with self._lock:
+                reserved = self._reserved.setdefault(owner, [0, 0])
+                reserved[0] += size
+                reserved[1] += count
+        return Reservation(self, owner, size, count)
+
+    def _unreserve(self, owner, size, count):
+        with self._lock:
+            reserved = self._reserved.get(owner)
+            if reserved is None:
+                return
+            reserved[0] -= size
+            reserved[1] -= count
+            if reserved[0] <= 0 and reserved[1] <= 0:
+                del self._reserved[owner]
+
+    def _bucket(self, buckets, owner, rate):
+        with self._lock:
+            bucket = buckets.get(owner)
+            if bucket is None:
+                bucket = buckets[owner] = TokenBucket(rate)
+            return bucket
+
+    def wait_for_file(self, owner):
+        """Block until the user and the server may start another file"""
+        wait = max(self._bucket(self._user_files, owner, self.user_file_rate).reserve(1), self.global_files.reserve(1))
+        if wait:
+            time.sleep(wait)
+
+    def throttle(self, owner, size):
+        """Block until ``size`` more bytes may be sent for the user"""
+        wait = max(self._bucket(self._user_bytes, owner, self.user_bandwidth).reserve(size),
+                   self.global_bytes.reserve(size))
+        if wait:
+            time.sleep(wait)
+
+    def stats(self):
+        """Seconds uploads spent waiting on each limit, for the Performance tab"""
+        with self._lock:
+            return {
+                "reserved": {owner: {"bytes": size, "files": count} for owner, (size, count) in self._reserved.items()},
+                "waited_seconds": {
+                    "global_files": round(self.global_files.waited, 3),
+                    "global_bandwidth": round(self.global_bytes.waited, 3),
+                    "scrub": round(self.scrub_bytes.waited, 3),
+                    "user_files": {owner: round(b.waited, 3) for owner, b in self._user_files.items() if b.waited},
+                    "user_bandwidth": {owner: round(b.waited, 3) for owner, b in self._user_bytes.items() if b.waited},
+                },
+            }
+
+
+_limits = None
+_limits_lock = threading.Lock()
+
+
+def get_limits():
+    """Return the process-wide Limits shared by all sessions"""
+    global _limits
+    with _limits_lock:
+        if _limits is None:
+            _limits = Limits()
+        return _limits
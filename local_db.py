@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import threading
+
+# Directory holding the app's local state (indexes, job table, ...)
+DATA_DIR = os.environ.get("FILESHARE_DATA_DIR", ".fileshare")
+
+DB_FILENAME = "fileshare.db"
+
+_local = threading.local()
+
+
+def connect():
+    """Return this thread's connection to the local SQLite database
+
+    Connections are cached per thread, since Streamlit sessions and worker
+    pools each run on their own threads. WAL mode lets readers proceed while
+    another thread writes.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(DATA_DIR, DB_FILENAME), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+def ensure_schema(statements):
+    """Run CREATE statements once per thread connection"""
+    conn = connect()
+    done = getattr(_local, "schemas", None)
+    if done is None:
+        done = _local.schemas = set()
+    key = hash(statements)
+    if key not in done:
+        conn.executescript(statements)
+        done.add(key)
+    return conn
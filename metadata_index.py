@@ -0,0 +1,752 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from file_cache import walk_folder
+from file_types import classify, extension, mime_category
+from integrity import CORRUPT, MISSING, UNVERIFIED
+from local_db import ensure_schema
+
+# Re-list the bucket for an owner when its index is older than this (seconds)
+SYNC_MAX_AGE = 24 * 60 * 60
+
+# Uploads record the app's clock after storage wrote the object, so the
+# object's own timestamp may run this far ahead of the recorded one (seconds)
+CLOCK_SKEW = 60
+
+# Columns the file list may be sorted by
+SORT_COLUMNS = {"name": "name", "size": "size", "updated": "updated_at", "created": "created_at"}
+
+# Upper bounds (exclusive) and labels of the size histogram buckets
+SIZE_BUCKETS = [
+    (1024, "< 1 KB"),
+    (100 * 1024, "1-100 KB"),
+    (1024 * 1024, "100 KB-1 MB"),
+    (10 * 1024 * 1024, "1-10 MB"),
+    (100 * 1024 * 1024, "10-100 MB"),
+    (1024 * 1024 * 1024, "100 MB-1 GB"),
+    (None, ">= 1 GB"),
+]
+
+# Version of the schema below, stored in PRAGMA user_version
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    mime_type TEXT,
+    extension TEXT NOT NULL DEFAULT '',
+    created_at TEXT,
+    updated_at TEXT,
+    hash TEXT,
+    category TEXT NOT NULL DEFAULT 'other',
+    size_bucket INTEGER NOT NULL DEFAULT 0,
+    encoding TEXT,
+    PRIMARY KEY (owner, path)
+);
+CREATE INDEX IF NOT EXISTS objects_name ON objects (owner, name);
+CREATE INDEX IF NOT EXISTS objects_size ON objects (owner, size);
+CREATE INDEX IF NOT EXISTS objects_updated ON objects (owner, updated_at);
+CREATE INDEX IF NOT EXISTS objects_created ON objects (owner, created_at);
+CREATE INDEX IF NOT EXISTS objects_hash ON objects (owner, hash);
+
+CREATE TABLE IF NOT EXISTS owner_totals (
+    owner TEXT PRIMARY KEY,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS owner_extensions (
+    owner TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, extension)
+);
+CREATE TABLE IF NOT EXISTS index_sync (
+    owner TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS owner_categories (
+    owner TEXT NOT NULL,
+    category TEXT NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, category)
+);
+CREATE TABLE IF NOT EXISTS owner_size_buckets (
+    owner TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, bucket)
+);
+CREATE TABLE IF NOT EXISTS owner_daily (
+    owner TEXT NOT NULL,
+    day TEXT NOT NULL,
+    files_added INTEGER NOT NULL DEFAULT 0,
+    files_removed INTEGER NOT NULL DEFAULT 0,
+    bytes_delta INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, day)
+);
+
+-- Checksums of the stored bytes taken on upload, and when they were last
+-- checked against storage. Dropped with the object, or once its size changes.
+CREATE TABLE IF NOT EXISTS object_checksums (
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    block_size INTEGER NOT NULL,
+    blocks BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'unverified',
+    verified_at REAL,
+    PRIMARY KEY (owner, path)
+);
+CREATE INDEX IF NOT EXISTS object_checksums_verified ON object_checksums (owner, verified_at);
+CREATE TRIGGER IF NOT EXISTS objects_checksum_delete AFTER DELETE ON objects BEGIN
+    DELETE FROM object_checksums WHERE owner = old.owner AND path = old.path;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_checksum_resize AFTER UPDATE OF size ON objects WHEN new.size != old.size BEGIN
+    DELETE FROM object_checksums WHERE owner = old.owner AND path = old.path;
+END;
+
+-- Totals are kept up to date by triggers, so reading them never scans objects
+CREATE TRIGGER IF NOT EXISTS objects_totals_insert AFTER INSERT ON objects BEGIN
+    INSERT INTO owner_totals (owner, file_count, total_size) VALUES (new.owner, 1, new.size)
+        ON CONFLICT (owner) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+    INSERT INTO owner_extensions (owner, extension, file_count, total_size) VALUES (new.owner, new.extension, 1, new.size)
+        ON CONFLICT (owner, extension) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_totals_delete AFTER DELETE ON objects BEGIN
+    UPDATE owner_totals SET file_count = file_count - 1, total_size = total_size - old.size WHERE owner = old.owner;
+    UPDATE owner_extensions SET file_count = file_count - 1, total_size = total_size - old.size
+        WHERE owner = old.owner AND extension = old.extension;
+    DELETE FROM owner_extensions WHERE owner = old.owner AND extension = old.extension AND file_count <= 0;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_totals_update AFTER UPDATE OF size, extension ON objects BEGIN
+    UPDATE owner_totals SET total_size = total_size - old.size + new.size WHERE owner = new.owner;
+    UPDATE owner_extensions SET file_count = file_count - 1, total_size = total_size - old.size
+        WHERE owner = old.owner AND extension = old.extension;
+    DELETE FROM owner_extensions WHERE owner = old.owner AND extension = old.extension AND file_count <= 0;
+    INSERT INTO owner_extensions (owner, extension, file_count, total_size) VALUES (new.owner, new.extension, 1, new.size)
+        ON CONFLICT (owner, extension) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+END;
+"""
+
+# Aggregates added in schema version 2; created after the migration adds
+# the category and size_bucket columns to existing databases
+STATS_SCHEMA = """
+CREATE TRIGGER IF NOT EXISTS objects_stats_insert AFTER INSERT ON objects BEGIN
+    INSERT INTO owner_categories (owner, category, file_count, total_size) VALUES (new.owner, new.category, 1, new.size)
+        ON CONFLICT (owner, category) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+    INSERT INTO owner_size_buckets (owner, bucket, file_count, total_size) VALUES (new.owner, new.size_bucket, 1, new.size)
+        ON CONFLICT (owner, bucket) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+    INSERT INTO owner_daily (owner, day, files_added, bytes_delta)
+        VALUES (new.owner, COALESCE(substr(new.created_at, 1, 10), date('now')), 1, new.size)
+        ON CONFLICT (owner, day) DO UPDATE SET files_added = files_added + 1, bytes_delta = bytes_delta + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_stats_delete AFTER DELETE ON objects BEGIN
+    UPDATE owner_categories SET file_count = file_count - 1, total_size = total_size - old.size
+        WHERE owner = old.owner AND category = old.category;
+    DELETE FROM owner_categories WHERE owner = old.owner AND category = old.category AND file_count <= 0;
+    UPDATE owner_size_buckets SET file_count = file_count - 1, total_size = total_size - old.size
+        WHERE owner = old.owner AND bucket = old.size_bucket;
+    DELETE FROM owner_size_buckets WHERE owner = old.owner AND bucket = old.size_bucket AND file_count <= 0;
+    INSERT INTO owner_daily (owner, day, files_removed, bytes_delta) VALUES (old.owner, date('now'), 1, -old.size)
+        ON CONFLICT (owner, day) DO UPDATE SET files_removed = files_removed + 1, bytes_delta = bytes_delta - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_stats_update AFTER UPDATE OF size, category, size_bucket ON objects BEGIN
+    UPDATE owner_categories SET file_count = file_count - 1, total_size = total_size - old.size
+        WHERE owner = old.owner AND category = old.category;
+    DELETE FROM owner_categories WHERE owner = old.owner AND category = old.category AND file_count <= 0;
+    INSERT INTO owner_categories (owner, category, file_count, total_size) VALUES (new.owner, new.category, 1, new.size)
+        ON CONFLICT (owner, category) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+    UPDATE owner_size_buckets SET file_count = file_count - 1, total_size = total_size - old.size
+        WHERE owner = old.owner AND bucket = old.size_bucket;
+    DELETE FROM owner_size_buckets WHERE owner = old.owner AND bucket = old.size_bucket AND file_count <= 0;
+    INSERT INTO owner_size_buckets (owner, bucket, file_count, total_size) VALUES (new.owner, new.size_bucket, 1, new.size)
+        ON CONFLICT (owner, bucket) DO UPDATE SET file_count = file_count + 1, total_size = total_size + new.size;
+    INSERT INTO owner_daily (owner, day, bytes_delta) SELECT new.owner, date('now'), new.size - old.size
+        WHERE new.size != old.size
+        ON CONFLICT (owner, day) DO UPDATE SET bytes_delta = bytes_delta + new.size - old.size;
+END;
+"""
+
+# Substring search uses a trigram full-text index when SQLite supports it
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS objects_fts USING fts5 (
+    name, content='objects', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS objects_fts_insert AFTER INSERT ON objects BEGIN
+    INSERT INTO objects_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS objects_fts_delete AFTER DELETE ON objects BEGIN
+    INSERT INTO objects_fts (objects_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS objects_fts_update AFTER UPDATE OF name ON objects BEGIN
+    INSERT INTO objects_fts (objects_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO objects_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+"""
+
+
+def size_bucket(size):
+    """Return the index into SIZE_BUCKETS for a file size"""
+    for index, (limit, _) in enumerate(SIZE_BUCKETS):
+        if limit is None or size < limit:
+            return index
+
+
+def _statements(script):
+    """Split a SQL script into statements, keeping trigger bodies whole"""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def _like_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _timestamp(value):
+    """Parse an ISO 8601 timestamp into epoch seconds, or None"""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _unchanged(recorded, stored):
+    """Whether a stored (size, updated_at) matches the recorded one
+
+    Storage and uploads format their timestamps differently, and an upload
+    records its own time after the write, so the stored object only counts
+    as changed when it was written more than CLOCK_SKEW after the record.
+    """
+    if recorded == stored:
+        return True
+    if recorded[0] != stored[0]:
+        return False
+    recorded_at, stored_at = _timestamp(recorded[1]), _timestamp(stored[1])
+    return recorded_at is not None and stored_at is not None and stored_at <= recorded_at + CLOCK_SKEW
+
+
+class MetadataIndex:
+    """Local SQLite index of every stored object's metadata
+
+    Holds name, size, MIME type, timestamps and content hash per object,
+    partitioned by owner (the user folder). Uploads and deletes keep it up
+    to date, reconcile() resyncs it with the bucket, and per-owner totals
+    are maintained by triggers so stats never walk the objects.
+    """
+
+    def __init__(self):
+        self.has_fts = None
+        self._migrated = False
+        # Bumped whenever an owner's objects change, so results derived from
+        # the index (like the Stats tab) can be cached until they go stale
+        self._generations = {}
+        self._generations_lock = threading.Lock()
+
+    def _migrate(self, conn):
+        """Bring an existing database up to SCHEMA_VERSION"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2:
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(objects)")}
+                if "category" not in columns:
+                    conn.execute("ALTER TABLE objects ADD COLUMN category TEXT NOT NULL DEFAULT 'other'")
+                    conn.execute("ALTER TABLE objects ADD COLUMN size_bucket INTEGER NOT NULL DEFAULT 0")
+                    rows = conn.execute("SELECT rowid, size, mime_type FROM objects").fetchall()
+                    conn.executemany(
+                        "UPDATE objects SET category = ?, size_bucket = ? WHERE rowid = ?",
+                        [(mime_category(row["mime_type"]), size_bucket(row["size"]), row["rowid"]) for row in rows],
+                    )
+                # executescript() would commit, so run the triggers one by one
+                for statement in _statements(STATS_SCHEMA):
+                    conn.execute(statement)
+                self._rebuild_stats(conn)
+            if version < 3:
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(objects)")}
+                if "encoding" not in columns:
+                    conn.execute("ALTER TABLE objects ADD COLUMN encoding TEXT")
+            if version < 4:
+                # Categories now come from file_types, which also falls back
+                # to the extension; the stats triggers move the totals along
+                rows = conn.execute("SELECT rowid, name, mime_type, category FROM objects").fetchall()
+                updates = [(classify(row["name"], row["mime_type"])[1], row["rowid"], row["category"]) for row in rows]
+                conn.executemany(
+                    "UPDATE objects SET category = ? WHERE rowid = ?",
+                    [(category, rowid) for category, rowid, recorded in updates if category != recorded],
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS objects_category ON objects (owner, category)")
+            if version < SCHEMA_VERSION:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self):
+        conn = ensure_schema(SCHEMA)
+        if not self._migrated:
+            self._migrate(conn)
+            self._migrated = True
+        if self.has_fts is None:
+            try:
+                ensure_schema(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                # SQLite without FTS5 trigram support; fall back to LIKE scans
+                self.has_fts = False
+        return conn
+
+    def _touch(self, owner=None):
+        """Bump the generation of one owner, or of all owners when None"""
+        with self._generations_lock:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+
+    def generation(self, owner):
+        """Return a value that changes whenever the owner's objects change
+
+        Only changes made through this process are seen, which covers the
+        app since every upload, delete and resync goes through the index.
+        """
+        return self._generations.get(None, 0), self._generations.get(owner, 0)
+
+    @staticmethod
+    def _relative_name(owner, path):
+        prefix = f"{owner}/"
+        return path[len(prefix):] if path.startswith(prefix) else path
+
+    def record(self, owner, path, size, mime_type=None, content_hash=None, created_at=None, updated_at=None,
+               encoding=None):
+        """Insert or update one object
+
+        A None content_hash keeps the hash already recorded for the path.
+        ``encoding`` is the codec the object is stored compressed with; None
+        keeps the recorded one and an empty string marks it uncompressed.
+        """
+        name = self._relative_name(owner, path)
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        # A missing MIME type keeps the recorded one, so keep its category
+        # too; new rows without one are classified by extension
+        category = mime_category(mime_type) if mime_type else None
+        self._conn().execute(
+            """
+            INSERT INTO objects (owner, path, name, size, mime_type, extension, created_at, updated_at, hash,
+                                 category, size_bucket, encoding)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULLIF(?, ''))
+            ON CONFLICT (owner, path) DO UPDATE SET
+                size = excluded.size,
+                mime_type = COALESCE(excluded.mime_type, mime_type),
+                extension = excluded.extension,
+                updated_at = excluded.updated_at,
+                hash = COALESCE(excluded.hash, hash),
+                category = COALESCE(?, category),
+                size_bucket = excluded.size_bucket,
+                encoding = CASE WHEN ? IS NULL THEN encoding ELSE excluded.encoding END
+            """,
+            (owner, path, name, size, mime_type, extension(name), created_at or now, updated_at or now, content_hash,
+             category or classify(name)[1], size_bucket(size), encoding, category, encoding),
+        )
+        self._touch(owner)
+
+    def forget(self, owner, paths):
+        """Remove objects from the index"""
+        self._conn().executemany(
+            "DELETE FROM objects WHERE owner = ? AND path = ?", [(owner, path) for path in paths]
+        )
+        self._touch(owner)
+
+    def lookup(self, owner, path):
+        """Return (hash, size) recorded for a path, or None if unknown"""
+        row = self._conn().execute(
+            "SELECT hash, size FROM objects WHERE owner = ? AND path = ?", (owner, path)
+        ).fetchone()
+        return (row["hash"], row["size"]) if row else None
+
+    def encodings(self, owner, paths):
+        """Return {path: encoding} for the given paths that are stored compressed"""
+        paths = list(paths)
+        encodings = {}
+        conn = self._conn()
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = conn.execute(
+                f"SELECT path, encoding FROM objects WHERE owner = ? AND encoding IS NOT NULL "
+                f"AND path IN ({', '.join('?' for _ in chunk)})",
+                [owner, *chunk],
+            ).fetchall()
+            encodings.update((row["path"], row["encoding"]) for row in rows)
+        return encodings
+
+    def hashes(self, owner, paths):
+        """Return {path: content hash} for the given paths whose hash is known"""
+        paths = list(paths)
+        hashes = {}
+        conn = self._conn()
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = conn.execute(
+                f"SELECT path, hash FROM objects WHERE owner = ? AND hash IS NOT NULL "
+                f"AND path IN ({', '.join('?' for _ in chunk)})",
+                [owner, *chunk],
+            ).fetchall()
+            hashes.update((row["path"], row["hash"]) for row in rows)
+        return hashes
+
+    def find(self, owner, content_hash):
+        """Return every path of an owner holding the given content"""
+        # Sorted here rather than in SQL: ORDER BY path lets the planner walk
+        # the primary key over all of the owner's rows instead of objects_hash
+        rows = self._conn().execute(
+            "SELECT path FROM objects WHERE owner = ? AND hash = ?", (owner, content_hash)
+        ).fetchall()
+        return sorted(row["path"] for row in rows)
+
+    def record_checksum(self, owner, path, checksum, blocks, block_size):
+        """Remember the checksum of an object's stored bytes, as not yet verified"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO object_checksums (owner, path, checksum, block_size, blocks, status) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (owner, path, checksum, block_size, blocks, UNVERIFIED),
+        )
+
+    def copy_checksum(self, owner, source, path):
+        """Give a server-side copy the checksum of its source"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO object_checksums (owner, path, checksum, block_size, blocks, status) "
+            "SELECT owner, ?, checksum, block_size, blocks, ? FROM object_checksums WHERE owner = ? AND path = ?",
+            (path, UNVERIFIED, owner, source),
+        )
+
+    def checksums(self, owner, paths):
+        """Return {path: row} for the given paths that have a recorded checksum
+
+        Each row is a dict with path, size, checksum, blocks and block_size.
+        """
+        paths = list(paths)
+        found = {}
+        conn = self._conn()
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = conn.execute(
+                f"SELECT c.path, o.size, c.checksum, c.blocks, c.block_size "
+                f"FROM object_checksums c JOIN objects o ON o.owner = c.owner AND o.path = c.path "
+                f"WHERE c.owner = ? AND c.path IN ({', '.join('?' for _ in chunk)})",
+                [owner, *chunk],
+            ).fetchall()
+            found.update((row["path"], dict(row)) for row in rows)
+        return found
+
+    def checksums_due(self, owner, verified_before, limit=100):
+        """Checksummed objects never verified or last verified before a time
+
+        Never verified objects come first, then the longest unchecked.
+
+        Returns:
+            List of dicts with path, size, checksum, blocks and block_size
+        """
+        rows = self._conn().execute(
+            """
+            SELECT c.path, o.size, c.checksum, c.blocks, c.block_size
+            FROM object_checksums c JOIN objects o ON o.owner = c.owner AND o.path = c.path
+            WHERE c.owner = ? AND (c.verified_at IS NULL OR c.verified_at < ?)
+            ORDER BY c.verified_at
+            LIMIT ?
+            """,
+            (owner, verified_before, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_verified(self, owner, path, status):
+        """Record the outcome of checking an object against its checksum"""
+        self._conn().execute(
+            "UPDATE object_checksums SET status = ?, verified_at = ? WHERE owner = ? AND path = ?",
+            (status, time.time(), owner, path),
+        )
+
+    def integrity_issues(self, owner):
+        """Return {path: status} of an owner's objects that failed verification"""
+        rows = self._conn().execute(
+            "SELECT path, status FROM object_checksums WHERE owner = ? AND status IN (?, ?) ORDER BY path",
+            (owner, CORRUPT, MISSING),
+        ).fetchall()
+        return {row["path"]: row["status"] for row in rows}
+
+    def entries(self, owner):
+        """Return {path: (hash, size)} for every indexed object of an owner"""
+        rows = self._conn().execute(
+            "SELECT path, hash, size FROM objects WHERE owner = ?", (owner,)
+        ).fetchall()
+        return {row["path"]: (row["hash"], row["size"]) for row in rows}
+
+    def _match(self, owner, query, prefix, category=None, folder=None):
+        """Return (source, where, params) selecting an owner's matching objects"""
+        where = "o.owner = ?"
+        params = [owner]
+        source = "objects o"
+        if category:
+            where += " AND o.category = ?"
+            params.append(category)
+        if folder:
+            # A range on the (owner, name) index, like a prefix search
+            where += " AND o.name >= ? AND o.name < ?"
+            params += [f"{folder}/", f"{folder}/\U0010ffff"]
+        if query and prefix:
+            where += " AND o.name >= ? AND o.name < ?"
+            query = f"{folder}/{query}" if folder else query
+            params += [query, query + "\U0010ffff"]
+        elif query and self.has_fts and len(query) >= 3:
+            # The trigram index answers LIKE '%...%' without scanning every name
+            source = "objects_fts f JOIN objects o ON o.rowid = f.rowid"
+            where += " AND f.name LIKE ? ESCAPE '\\'"
+            params.append(_like_pattern(query))
+        elif query:
+            where += " AND o.name LIKE ? ESCAPE '\\'"
+            params.append(_like_pattern(query))
+        return source, where, params
+
+    def search(self, owner, query="", prefix=False, sort="name", descending=False, limit=50, offset=0,
+               category=None, folder=None):
+        """Search an owner's objects by name
+
+        Args:
+            owner: Index partition, normally the user folder
+            query: Text to look for in the name; empty matches everything
+            prefix: Match names starting with ``query`` instead of containing it
+            sort: One of SORT_COLUMNS
+            descending: Reverse the sort order
+            limit: Maximum number of results, or None for all
+            offset: Number of results to skip
+            category: Only return files of this file_types category
+            folder: Only return files under this folder, relative to the
+                owner's; searches then match names relative to it as well
+
+        Returns:
+            List of entries shaped like storage list() results, with names
+            relative to the owner's folder
+        """
+        conn = self._conn()
+        column = SORT_COLUMNS.get(sort, "name")
+        order = "DESC" if descending else "ASC"
+        source, where, params = self._match(owner, query, prefix, category, folder)
+        rows = conn.execute(
+            f"SELECT o.* FROM {source} WHERE {where} ORDER BY o.{column} {order}, o.name LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset],
+        ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row):
+        return {
+            "name": row["name"],
+            "id": row["path"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "metadata": {"size": row["size"], "mimetype": row["mime_type"], "sha256": row["hash"],
+                         "encoding": row["encoding"]},
+        }
+
+    def get(self, owner, path):
+        """Return the entry of one object, shaped like search() results, or None"""
+        row = self._conn().execute("SELECT * FROM objects WHERE owner = ? AND path = ?", (owner, path)).fetchone()
+        return self._entry(row) if row else None
+
+    def count(self, owner, query="", prefix=False, category=None, folder=None):
+        """Return the number of an owner's objects matching a search"""
+        conn = self._conn()
+        source, where, params = self._match(owner, query, prefix, category, folder)
+        return conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params).fetchone()[0]
+
+    def usage(self, owner):
+        """Return (file_count, total_size) of the owner from the maintained totals"""
+        row = self._conn().execute(
+            "SELECT file_count, total_size FROM owner_totals WHERE owner = ?", (owner,)
+        ).fetchone()
+        return (row["file_count"], row["total_size"]) if row else (0, 0)
+
+    def stats(self, owner):
+        """Return the owner's maintained totals without scanning objects
+
+        Returns:
+            Dict with file_count, total_size and extensions, a dict mapping
+            extension to (file_count, total_size)
+        """
+        conn = self._conn()
+        totals = conn.execute(
+            "SELECT file_count, total_size FROM owner_totals WHERE owner = ?", (owner,)
+        ).fetchone()
+        extensions = conn.execute(
+            "SELECT extension, file_count, total_size FROM owner_extensions WHERE owner = ?", (owner,)
+        ).fetchall()
+        return {
+            "file_count": totals["file_count"] if totals else 0,
+            "total_size": totals["total_size"] if totals else 0,
+            "extensions": {row["extension"]: (row["file_count"], row["total_size"]) for row in extensions},
+        }
+
+    def size_histogram(self, owner):
+        """Return [(label, file_count, total_size)] for every SIZE_BUCKETS bucket"""
+        rows = self._conn().execute(
+            "SELECT bucket, file_count, total_size FROM owner_size_buckets WHERE owner = ?", (owner,)
+        ).fetchall()
+        counts = {row["bucket"]: (row["file_count"], row["total_size"]) for row in rows}
+        return [(label, *counts.get(bucket, (0, 0))) for bucket, (_, label) in enumerate(SIZE_BUCKETS)]
+
+    def category_totals(self, owner):
+        """Return {category: (file_count, total_size)} for an owner"""
+        rows = self._conn().execute(
+            "SELECT category, file_count, total_size FROM owner_categories WHERE owner = ?", (owner,)
+        ).fetchall()
+        return {row["category"]: (row["file_count"], row["total_size"]) for row in rows}
+
+    def growth(self, owner):
+        """Return the owner's storage over time
+
+        Returns:
+            List of (day, file_count, total_size) with running totals after
+            each day that saw a change, oldest first
+        """
+        rows = self._conn().execute(
+            "SELECT day, files_added, files_removed, bytes_delta FROM owner_daily WHERE owner = ? ORDER BY day",
+            (owner,),
+        ).fetchall()
+        history = []
+        files = size = 0
+        for row in rows:
+            files += row["files_added"] - row["files_removed"]
+            size += row["bytes_delta"]
+            history.append((row["day"], files, size))
+        return history
+
+    def largest(self, owner, limit=10):
+        """Return the owner's ``limit`` largest objects, largest first"""
+        return self.search(owner, sort="size", descending=True, limit=limit)
+
+    def _rebuild_stats(self, conn, owner=None):
+        where, params = ("WHERE owner = ?", (owner,)) if owner is not None else ("", ())
+        for table in ("owner_totals", "owner_extensions", "owner_categories", "owner_size_buckets", "owner_daily"):
+            conn.execute(f"DELETE FROM {table} {where}", params)
+        conn.execute(
+            f"INSERT INTO owner_totals (owner, file_count, total_size) "
+            f"SELECT owner, COUNT(*), SUM(size) FROM objects {where} GROUP BY owner", params
+        )
+        for table, column in (("owner_extensions", "extension"), ("owner_categories", "category"),
+                              ("owner_size_buckets", "size_bucket")):
+            target = "bucket" if table == "owner_size_buckets" else column
+            conn.execute(
+                f"INSERT INTO {table} (owner, {target}, file_count, total_size) "
+                f"SELECT owner, {column}, COUNT(*), SUM(size) FROM objects {where} GROUP BY owner, {column}", params
+            )
+        # Removals are not kept per object, so rebuilt history only shows additions
+        conn.execute(
+            f"INSERT INTO owner_daily (owner, day, files_added, bytes_delta) "
+            f"SELECT owner, substr(created_at, 1, 10), COUNT(*), SUM(size) FROM objects {where} "
+            f"GROUP BY owner, substr(created_at, 1, 10)", params
+        )
+
+    def rebuild_stats(self, owner=None):
+        """Recompute the maintained aggregates from the objects table
+
+        The triggers keep them current; this repairs them after the database
+        was edited by hand or restored from an older copy.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._rebuild_stats(conn, owner)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._touch(owner)
+
+    def synced_at(self, owner):
+        row = self._conn().execute("SELECT synced_at FROM index_sync WHERE owner = ?", (owner,)).fetchone()
+        return row["synced_at"] if row else None
+
+    def reconcile(self, bucket, owner, folder, stored=None):
+        """Resync an owner's index with the bucket
+
+        Objects found in storage are added or updated, and index rows whose
+        object no longer exists are removed. Known content hashes are kept.
+
+        Args:
+            bucket: Storage bucket proxy
+            owner: Owner the rows belong to
+            folder: Folder to walk
+            stored: Optional [(path, entry)] of the folder already listed by
+                the caller, e.g. by AsyncStorage.walk_folder()
+
+        Returns:
+            Dict with the number of objects added, updated and removed
+        """
+        conn = self._conn()
+        known = {
+            row["path"]: (row["size"], row["updated_at"])
+            for row in conn.execute("SELECT path, size, updated_at FROM objects WHERE owner = ?", (owner,))
+        }
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        # List the bucket before taking the write lock so other sessions can
+        # keep recording uploads while the folder is walked
+        if stored is None:
+            stored = list(walk_folder(bucket, folder))
+        seen = set()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for path, entry in stored:
+                seen.add(path)
+                metadata = entry.get("metadata") or {}
+                size = metadata.get("size") or 0
+                updated_at = entry.get("updated_at")
+                if path in known and _unchanged(known[path], (size, updated_at)):
+                    continue
+                counts["updated" if path in known else "added"] += 1
+                self.record(owner, path, size, metadata.get("mimetype"),
+                            created_at=entry.get("created_at"), updated_at=updated_at)
+            stale = [path for path in known if path not in seen]
+            self.forget(owner, stale)
+            counts["removed"] = len(stale)
+            conn.execute(
+                "INSERT OR REPLACE INTO index_sync (owner, synced_at) VALUES (?, ?)", (owner, time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Readers may have cached the pre-commit state under the generations
+        # record() and forget() bumped inside the transaction
+        self._touch(owner)
+        return counts
+
+    def needs_sync(self, owner, max_age=SYNC_MAX_AGE):
+        """Whether an owner's index was never synced or is older than max_age"""
+        synced_at = self.synced_at(owner)
+        return synced_at is None or time.time() - synced_at > max_age
+
+    def ensure_synced(self, bucket, owner, folder, max_age=SYNC_MAX_AGE):
+        """Reconcile an owner's index if it was never synced or is too old"""
+        if self.needs_sync(owner, max_age):
+            return self.reconcile(bucket, owner, folder)
+        return None
+
+
+_index = MetadataIndex()
+
+
+def get_metadata_index():
+    """Return the shared MetadataIndex"""
+    return _index
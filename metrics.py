@@ -0,0 +1,484 @@
+import base64
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+# Upper bounds (seconds) of the latency histogram buckets, as Prometheus defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Number of recent failed requests kept for the Performance tab
+RECENT_ERRORS = 50
+
+# Address /metrics listens on; the metrics name users and their traffic, so
+# only set this to a wider address on a network Prometheus alone can reach
+METRICS_HOST = os.environ.get("FILESHARE_METRICS_HOST", "127.0.0.1")
+
+# Label used for requests made without a user session (anon key, login)
+ANONYMOUS = "anonymous"
+
+# Auth grant types mapped to operation names
+_GRANT_OPERATIONS = {"password": "auth.sign_in", "refresh_token": "auth.refresh"}
+
+_AUTH_OPERATIONS = {
+    "user": "auth.get_user",
+    "signup": "auth.sign_up",
+    "logout": "auth.sign_out",
+}
+
+# Storage routes by path prefix, checked in order, then by method
+_STORAGE_ROUTES = [
+    ("object/list/", {}, "storage.list"),
+    ("object/sign/", {"GET": "storage.download_signed"}, "storage.sign"),
+    ("object/info/", {}, "storage.info"),
+    ("object/copy", {}, "storage.copy"),
+    ("object/move", {}, "storage.move"),
+    ("object/public/", {}, "storage.download_public"),
+    ("object/", {"GET": "storage.download", "HEAD": "storage.exists", "DELETE": "storage.remove"}, "storage.upload"),
+    ("upload/resumable", {"HEAD": "storage.upload_offset", "PATCH": "storage.upload_chunk"}, "storage.upload_start"),
+]
+
+
+def operation_for(method, url):
+    """Name the Supabase API operation a request performs
+
+    Args:
+        method: HTTP method
+        url: httpx.URL or string of the request
+
+    Returns:
+        Operation name such as "storage.list" or "auth.refresh"
+    """
+    url = httpx.URL(str(url))
+    path = url.path
+    if "/storage/v1/" in path:
+        route = path.split("/storage/v1/", 1)[1]
+        for prefix, by_method, default in _STORAGE_ROUTES:
+            if route.startswith(prefix):
+                return by_method.get(method, default)
+        return "storage.other"
+    if "/auth/v1/" in path:
+        route = path.split("/auth/v1/", 1)[1].strip("/")
+        if route == "token":
+            return _GRANT_OPERATIONS.get(url.params.get("grant_type"), "auth.token")
+        return _AUTH_OPERATIONS.get(route, "auth.other")
+    return "http.other"
+
+
+@lru_cache(maxsize=1024)
+def _token_user(token):
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    # Storage folders are named after the user ID
+    return claims.get("sub")
+
+
+def user_for(headers, url=None):
+    """Name the user a request is made for
+
+    Authenticated requests carry the user's access token; its claims are
+    read without verification, since they only label metrics. Signed and
+    public object URLs carry no token and are attributed to the top-level
+    folder of the object instead.
+    """
+    authorization = headers.get("Authorization") or headers.get("authorization") or ""
+    if authorization.startswith("Bearer "):
+        user = _token_user(authorization[len("Bearer "):])
+        if user:
+            return user
+    if url is not None:
+        path = httpx.URL(str(url)).path
+        for prefix in ("/object/sign/", "/object/public/"):
+            if prefix in path:
+                parts = path.split(prefix, 1)[1].split("/")
+                if len(parts) > 2:
+                    return parts[1]
+    return ANONYMOUS
+
+
+class _Series:
+    """Counters and latency histogram of one (operation, user) pair"""
+
+    __slots__ = ("requests", "errors", "retries", "bytes_sent", "bytes_received", "buckets", "latency_sum")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.retries += other.retries
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.latency_sum += other.latency_sum
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def quantile(self, q):
+        """Estimate a latency quantile (seconds) from the histogram
+
+        Interpolates linearly inside the bucket holding the quantile; values
+        past the last bound are reported as that bound.
+        """
+        total = sum(self.buckets)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for count, upper in zip(self.buckets, LATENCY_BUCKETS):
+            if seen + count >= rank:
+                return lower + (upper - lower) * ((rank - seen) / count if count else 0)
+            seen += count
+            lower = upper
+        return LATENCY_BUCKETS[-1]
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "total_time": self.latency_sum,
+            "mean": self.latency_sum / self.requests if self.requests else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """Per-operation, per-user request metrics of the storage and auth APIs
+
+    Fed by InstrumentedTransport for every HTTP request and by the upload
+    code for retries. Everything is kept in memory since the process
+    started; render() exports it in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._series = {}
+        self._in_flight = {}
+        self._peak_in_flight = {}
+        self._errors = deque(maxlen=RECENT_ERRORS)
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _get(self, operation, user):
+        series = self._series.get((operation, user))
+        if series is None:
+            series = self._series[(operation, user)] = _Series()
+        return series
+
+    def begin(self, operation):
+        """Count a request as in flight; pair with observe()"""
+        with self._lock:
+            current = self._in_flight.get(operation, 0) + 1
+            self._in_flight[operation] = current
+            self._peak_in_flight[operation] = max(self._peak_in_flight.get(operation, 0), current)
+
+    def observe(self, operation, user, seconds, bytes_sent=0, bytes_received=0, error=None):
+        """Record a finished request
+
+        Args:
+            error: None on success, otherwise a short reason such as
+                "HTTP 503" or the exception class name
+        """
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            self._in_flight[operation] = max(self._in_flight.get(operation, 0) - 1, 0)
+            series = self._get(operation, user)
+            series.requests += 1
+            series.bytes_sent += bytes_sent
+            series.bytes_received += bytes_received
+            series.buckets[index] += 1
+            series.latency_sum += seconds
+            if error is not None:
+                series.errors += 1
+                self._errors.append({"time": time.time(), "operation": operation, "user": user, "error": error,
+                                     "seconds": seconds})
+
+    def retry(self, operation, user):
+        """Record that a request is being sent again after a failure"""
+        with self._lock:
+            self._get(operation, user).retries += 1
+
+    def by_operation(self):
+        """Return {operation: summary dict} over all users"""
+        return self._grouped(lambda operation, user: operation)
+
+    def by_user(self):
+        """Return {user: summary dict} over all operations"""
+        return self._grouped(lambda operation, user: user)
+
+    def series(self):
+        """Return {(operation, user): summary dict}"""
+        with self._lock:
+            return {key: series.summary() for key, series in self._series.items()}
+
+    def _grouped(self, key):
+        groups = {}
+        with self._lock:
+            for (operation, user), series in self._series.items():
+                groups.setdefault(key(operation, user), _Series()).merge(series)
+        return {name: series.summary() for name, series in groups.items()}
+
+    def in_flight(self):
+        """Return {operation: (current, peak)} concurrent requests"""
+        with self._lock:
+            return {operation: (self._in_flight.get(operation, 0), peak)
+                    for operation, peak in self._peak_in_flight.items()}
+
+    def recent_errors(self):
+        """Return the latest failed requests, newest first"""
+        with self._lock:
+            return list(reversed(self._errors))
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self._series.items())
+            in_flight = sorted(self._in_flight.items())
+            lines = []
+
+            def family(name, kind, help_text):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+            def labels(operation, user, **extra):
+                pairs = {"operation": operation, "user": user, **extra}
+                return ",".join(f'{key}="{_escape(value)}"' for key, value in pairs.items())
+
+            for name, attribute, help_text in (
+                ("fileshare_requests_total", "requests", "Requests sent to the Supabase APIs"),
+                ("fileshare_request_errors_total", "errors", "Requests that failed or returned an error status"),
+                ("fileshare_request_retries_total", "retries", "Requests sent again after a transient failure"),
+                ("fileshare_request_sent_bytes_total", "bytes_sent", "Request body bytes sent"),
+                ("fileshare_request_received_bytes_total", "bytes_received", "Response body bytes received"),
+            ):
+                family(name, "counter", help_text)
+                for (operation, user), series in items:
+                    lines.append(f"{name}{{{labels(operation, user)}}} {getattr(series, attribute)}")
+
+            family("fileshare_request_duration_seconds", "histogram", "Request latency including the response body")
+            for (operation, user), series in items:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), series.buckets):
+                    cumulative += count
+                    lines.append(f"fileshare_request_duration_seconds_bucket{{{labels(operation, user, le=bound)}}} {cumulative}")
+                lines.append(f"fileshare_request_duration_seconds_sum{{{labels(operation, user)}}} {series.latency_sum}")
+                lines.append(f"fileshare_request_duration_seconds_count{{{labels(operation, user)}}} {series.requests}")
+
+            family("fileshare_requests_in_flight", "gauge", "Requests currently waiting on the Supabase APIs")
+            for operation, current in in_flight:
+                lines.append(f'fileshare_requests_in_flight{{operation="{_escape(operation)}"}} {current}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _MeteredStream(httpx.SyncByteStream):
+    """Response body wrapper that records the request once the body is done"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._received = 0
+        self._error = None
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._received += len(chunk)
+                yield chunk
+        except Exception as e:
+            self._error = type(e).__name__
+            raise
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close is not None:
+                on_close, self._on_close = self._on_close, None
+                on_close(self._received, self._error)
+
+
+def _is_error(operation, status):
+    if status < 400:
+        return False
+    # "Not found" is how exists() and resumable uploads learn an answer
+    if operation in ("storage.exists", "storage.upload_offset") and status in (400, 404, 410):
+        return False
+    return True
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """httpx transport that records every request in a Metrics registry
+
+    Latency runs from sending the request until its response body has been
+    read or closed, so streamed downloads are timed in full.
+    """
+
+    def __init__(self, transport, metrics=None):
+        self._transport = transport
+        self._metrics = metrics
+
+    @property
+    def metrics(self):
+        return self._metrics or get_metrics()
+
+    def handle_request(self, request):
+        metrics = self.metrics
+        operation = operation_for(request.method, request.url)
+        user = user_for(request.headers, request.url)
+        sent = int(request.headers.get("Content-Length") or 0)
+        started = time.perf_counter()
+        metrics.begin(operation)
+        try:
+            response = self._transport.handle_request(request)
+        except Exception as e:
+            metrics.observe(operation, user, time.perf_counter() - started, sent, error=type(e).__name__)
+            raise
+
+        status = response.status_code
+
+        def finished(received, error):
+            if error is None and _is_error(operation, status):
+                error = f"HTTP {status}"
+            metrics.observe(operation, user, time.perf_counter() - started, sent, received, error)
+
+        response.stream = _MeteredStream(response.stream, finished)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class _MeteredAsyncStream(httpx.AsyncByteStream):
+    """Async twin of _MeteredStream"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._received = 0
+        self._error = None
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._received += len(chunk)
+                yield chunk
+        except Exception as e:
+            self._error = type(e).__name__
+            raise
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                on_close, self._on_close = self._on_close, None
+                on_close(self._received, self._error)
+
+
+class InstrumentedAsyncTransport(httpx.AsyncBaseTransport):
+    """Async twin of InstrumentedTransport, recording into the same registry"""
+
+    def __init__(self, transport, metrics=None):
+        self._transport = transport
+        self._metrics = metrics
+
+    @property
+    def metrics(self):
+        return self._metrics or get_metrics()
+
+    async def handle_async_request(self, request):
+        metrics = self.metrics
+        operation = operation_for(request.method, request.url)
+        user = user_for(request.headers, request.url)
+        sent = int(request.headers.get("Content-Length") or 0)
+        started = time.perf_counter()
+        metrics.begin(operation)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as e:
+            metrics.observe(operation, user, time.perf_counter() - started, sent, error=type(e).__name__)
+            raise
+
+        status = response.status_code
+
+        def finished(received, error):
+            if error is None and _is_error(operation, status):
+                error = f"HTTP {status}"
+            metrics.observe(operation, user, time.perf_counter() - started, sent, received, error)
+
+        response.stream = _MeteredAsyncStream(response.stream, finished)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = get_metrics().render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+_server = None
+
+
+def get_metrics():
+    """Return the process-wide Metrics registry"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """Serve /metrics for Prometheus on a background thread
+
+    Safe to call on every Streamlit rerun; the server is started once per
+    process.
+
+    Returns:
+        The server's (host, port)
+    """
+    global _server
+    with _metrics_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server.server_address[:2]
@@ -0,0 +1,234 @@
+"""Standalone download endpoint for share links
+
+Serves ``/s/<token>`` without loading the Streamlit app: the token is
+resolved against the share_links table and the object is streamed from
+storage through its signed URL. Range and conditional requests are passed
+on to storage, so downloads can be resumed and media seeked, and
+responses carry caching headers bounded by the link's lifetime. Links to
+zip exports (file: URLs) are streamed from the local export directory.
+
+    python share_server.py --port 8502
+
+FILESHARE_DATA_DIR must point at the same local database as the app.
+"""
+import argparse
+import io
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlsplit
+from urllib.request import url2pathname
+
+import httpx
+
+from compression import STREAM_CHUNK_SIZE, open_decoded
+from file_actions import EXPORT_DIR
+from file_types import classify
+from metadata_index import get_metadata_index
+from metrics import InstrumentedTransport, start_metrics_server
+from shares import get_share_links
+
+# Longest a browser or proxy may cache a shared file (seconds); shorter
+# when the link expires sooner
+MAX_CACHE_AGE = 60 * 60
+
+# Request headers passed on to storage
+FORWARDED_HEADERS = ("Range", "If-Range", "If-None-Match", "If-Modified-Since")
+
+# Response headers passed back from storage
+RELAYED_HEADERS = ("Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+
+_http_client = httpx.Client(
+    transport=InstrumentedTransport(httpx.HTTPTransport(
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+    )),
+    timeout=httpx.Timeout(30.0),
+    follow_redirects=True,
+)
+
+
+class _ResponseReader(io.RawIOBase):
+    """Read an httpx streaming response like a file, for the decompressors"""
+
+    def __init__(self, response):
+        self._chunks = response.iter_raw(STREAM_CHUNK_SIZE)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _stored_as(link):
+    """Return (encoding, mime_type) the linked object is stored with now
+
+    A new or restored version may be stored differently from the one the
+    link was created for, so the metadata index is asked on every request;
+    the link's own columns only cover objects the index does not know.
+    """
+    entry = get_metadata_index().get(link["owner"], link["path"])
+    if entry is None:
+        return link["encoding"], link["mime_type"]
+    return entry["metadata"]["encoding"], classify(link["name"], entry["metadata"]["mimetype"])[0]
+
+
+class ShareHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FileShareHub"
+    # Headers and body go out in separate writes; without this every
+    # small response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._serve()
+
+    def do_HEAD(self):
+        self._serve()
+
+    def _error(self, status, message):
+        body = message.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _serve(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "s":
+            return self._error(404, "Not found")
+        links = get_share_links()
+        link = links.resolve(parts[1])
+        if link is None:
+            return self._error(404, "This link does not exist")
+        if not links.active(link):
+            return self._error(410, "This link has expired or was revoked")
+        if link["source_url"].startswith("file:"):
+            return self._serve_export(link)
+
+        # Compressed objects are decoded on the way out, which rules out
+        # byte ranges and storage's validators of the stored bytes
+        encoding, mime_type = _stored_as(link)
+        encoded = bool(encoding)
+        headers = {} if encoded else {name: self.headers[name] for name in FORWARDED_HEADERS if name in self.headers}
+        # Bytes are relayed as they arrive, so they must not be transfer-compressed.
+        # HEAD is answered from the headers of a GET, since signed URLs only
+        # promise GET; the body is never read.
+        headers["Accept-Encoding"] = "identity"
+        try:
+            response = _http_client.send(_http_client.build_request("GET", link["source_url"], headers=headers),
+                                         stream=True)
+        except httpx.TransportError as e:
+            return self._error(502, f"Storage is unreachable: {e}")
+        try:
+            if response.status_code in (400, 404):
+                return self._error(404, "The shared file no longer exists")
+            if response.status_code not in (200, 206, 304, 416):
+                return self._error(502, f"Storage answered HTTP {response.status_code}")
+
+            status = response.status_code
+            etag = response.headers.get("ETag")
+            if status in (200, 206) and etag and etag in self.headers.get("If-None-Match", "").split(", "):
+                # Storage does not always answer conditional requests itself
+                status = 304
+            bodiless = status in (304, 416)
+            self.send_response(status)
+            self._send_file_headers(link, mime_type)
+            if encoded:
+                self.send_header("Accept-Ranges", "none")
+                # The decoded length is not known up front
+                self.send_header("Connection", "close")
+                self.close_connection = True
+            else:
+                for name in RELAYED_HEADERS:
+                    if name in response.headers and not (bodiless and name == "Content-Length"):
+                        self.send_header(name, response.headers[name])
+                if bodiless:
+                    self.send_header("Content-Length", "0")
+            self.end_headers()
+            if self.command == "HEAD" or bodiless:
+                return
+            if encoded:
+                stream = open_decoded(io.BufferedReader(_ResponseReader(response), STREAM_CHUNK_SIZE), encoding)
+                while True:
+                    chunk = stream.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+            else:
+                for chunk in response.iter_raw(STREAM_CHUNK_SIZE):
+                    self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # The recipient went away, e.g. a player seeking elsewhere
+            self.close_connection = True
+        finally:
+            response.close()
+
+    def _send_file_headers(self, link, mime_type):
+        self.send_header("Content-Type", mime_type or "application/octet-stream")
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(link['name'])}")
+        self.send_header("X-Content-Type-Options", "nosniff")
+        max_age = int(min(MAX_CACHE_AGE, link["expires_at"] - time.time()))
+        self.send_header("Cache-Control", f"private, max-age={max(max_age, 0)}")
+
+    def _serve_export(self, link):
+        """Stream a zip export from the export directory in chunks"""
+        path = os.path.realpath(url2pathname(urlsplit(link["source_url"]).path))
+        if os.path.dirname(path) != os.path.realpath(EXPORT_DIR):
+            return self._error(404, "Not found")
+        try:
+            archive = open(path, "rb")
+        except FileNotFoundError:
+            return self._error(404, "The export no longer exists")
+        with archive:
+            self.send_response(200)
+            self._send_file_headers(link, link["mime_type"])
+            self.send_header("Content-Length", str(os.fstat(archive.fileno()).st_size))
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+            try:
+                while True:
+                    chunk = archive.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="0.0.0.0", port=8502):
+    """Run the share endpoint until interrupted"""
+    server = ThreadingHTTPServer((host, port), ShareHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve FileShare Hub share links")
+    parser.add_argument("--host", default=os.environ.get("FILESHARE_SHARE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("FILESHARE_SHARE_PORT", 8502)))
+    args = parser.parse_args()
+    # A port of its own, so the app and the share server can run on one host
+    if os.environ.get("FILESHARE_SHARE_METRICS_PORT"):
+        start_metrics_server(int(os.environ["FILESHARE_SHARE_METRICS_PORT"]))
+    print(f"Serving share links on http://{args.host}:{args.port}/s/<token>")
+    serve(args.host, args.port)
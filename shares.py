@@ -0,0 +1,158 @@
+import os
+import secrets
+import threading
+import time
+
+from local_db import ensure_schema
+
+# Lifetime of a share link unless another is picked, and the longest allowed (seconds)
+SHARE_TTL = float(os.environ.get("FILESHARE_SHARE_TTL_HOURS", 24)) * 60 * 60
+SHARE_MAX_TTL = float(os.environ.get("FILESHARE_SHARE_MAX_DAYS", 7)) * 24 * 60 * 60
+
+# Where share_server.py is reachable from recipients' browsers
+SHARE_BASE_URL = os.environ.get("FILESHARE_SHARE_URL", "http://localhost:8502").rstrip("/")
+
+# Random bytes per token; 12 give 16 URL-safe characters
+TOKEN_BYTES = 12
+
+# How long a process trusts a token it looked up before reading it again,
+# so a link revoked in another process stops working within this time
+RESOLVE_CACHE_SECONDS = 10
+
+# Expired links are kept this long, so opening one says it expired rather than not found
+EXPIRED_RETENTION = 7 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS share_links (
+    token TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mime_type TEXT,
+    encoding TEXT,
+    source_url TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    revoked_at REAL
+);
+CREATE INDEX IF NOT EXISTS share_links_owner ON share_links (owner, path);
+CREATE INDEX IF NOT EXISTS share_links_expires ON share_links (expires_at);
+"""
+
+
+def share_url(token, base_url=SHARE_BASE_URL):
+    """Public URL of a share link"""
+    return f"{base_url}/s/{token}"
+
+
+class ShareLinks:
+    """Expiring, revocable download links to single objects
+
+    A link is a random token mapped to an object and a signed storage URL
+    that lives as long as the link. The token is all a recipient gets; the
+    signed URL never leaves the server, so revoking the token cuts off
+    access. Lookups hit an in-memory dict first and the token's primary
+    key row otherwise, so resolving a token is O(1) on every request.
+    """
+
+    def __init__(self, cache_seconds=RESOLVE_CACHE_SECONDS):
+        self.cache_seconds = cache_seconds
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        return ensure_schema(SCHEMA)
+
+    def create(self, owner, path, name, source_url, expires_at, mime_type=None, encoding=None):
+        """Issue a token for an object
+
+        Args:
+            owner: User folder the object belongs to
+            path: Object path inside the bucket
+            name: File name offered to the recipient
+            source_url: Signed URL of the object, valid until ``expires_at``
+            expires_at: Unix time the link stops working
+            mime_type: Content type to serve the file with
+            encoding: Codec the object is stored compressed with, if any;
+                share_server.py prefers the metadata index's current
+                values of both, which change with new versions
+
+        Returns:
+            The token
+        """
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO share_links (token, owner, path, name, mime_type, encoding, source_url, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (token, owner, path, name, mime_type, encoding, source_url, now, expires_at),
+        )
+        conn.execute("DELETE FROM share_links WHERE expires_at < ?", (now - EXPIRED_RETENTION,))
+        return token
+
+    def resolve(self, token):
+        """Return the link row of a token as a dict, or None if unknown
+
+        The caller checks ``expires_at`` and ``revoked_at``; see active().
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(token)
+        if cached is not None and now - cached[1] < self.cache_seconds:
+            return cached[0]
+        row = self._conn().execute("SELECT * FROM share_links WHERE token = ?", (token,)).fetchone()
+        link = dict(row) if row else None
+        with self._lock:
+            if len(self._cache) > 10000:
+                self._cache = {key: value for key, value in self._cache.items() if now - value[1] < self.cache_seconds}
+            self._cache[token] = (link, now)
+        return link
+
+    @staticmethod
+    def active(link):
+        """Whether a resolved link may still be used"""
+        return link is not None and link["revoked_at"] is None and link["expires_at"] > time.time()
+
+    def links(self, owner):
+        """Return the owner's usable links, newest first"""
+        rows = self._conn().execute(
+            "SELECT * FROM share_links WHERE owner = ? AND revoked_at IS NULL AND expires_at > ? "
+            "ORDER BY created_at DESC",
+            (owner, time.time()),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def revoke(self, owner, tokens):
+        """Stop links of an owner from working"""
+        self._conn().executemany(
+            "UPDATE share_links SET revoked_at = ? WHERE owner = ? AND token = ? AND revoked_at IS NULL",
+            [(time.time(), owner, token) for token in tokens],
+        )
+        with self._lock:
+            for token in tokens:
+                self._cache.pop(token, None)
+
+    def forget(self, owner, paths):
+        """Revoke every link to objects that were deleted"""
+        conn = self._conn()
+        tokens = []
+        for path in paths:
+            tokens.extend(row["token"] for row in conn.execute(
+                "SELECT token FROM share_links WHERE owner = ? AND path = ? AND revoked_at IS NULL", (owner, path)
+            ))
+        if tokens:
+            self.revoke(owner, tokens)
+
+
+_links = None
+_links_lock = threading.Lock()
+
+
+def get_share_links():
+    """Return the process-wide ShareLinks"""
+    global _links
+    with _links_lock:
+        if _links is None:
+            _links = ShareLinks()
+        return _links
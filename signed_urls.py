@@ -0,0 +1,131 @@
+import threading
+import time
+from urllib.parse import quote
+
+# Lifetime of generated signed URLs, in seconds
+SIGNED_URL_TTL = 60 * 60
+
+# Signed URLs are regenerated once they are this close to expiring (seconds)
+SIGNED_URL_REFRESH_MARGIN = 5 * 60
+
+
+def download_url(url, file_name):
+    """Turn a signed URL into one that downloads as an attachment
+
+    Storage honours a ``download`` query parameter on signed URLs by sending
+    Content-Disposition, so no extra signing request is needed.
+    """
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}download={quote(file_name)}"
+
+
+class SignedUrlCache:
+    """Batch-generated signed URLs, cached until shortly before they expire
+
+    A page of files is signed with a single create_signed_urls() call, and
+    the same URL is handed out on every rerun while it stays valid, so
+    browsers and the storage CDN keep serving it from cache. Signed URLs
+    point straight at the storage object endpoint, which answers HTTP Range
+    requests, so media can be seeked and downloads resumed.
+    """
+
+    def __init__(self, ttl=SIGNED_URL_TTL, refresh_margin=SIGNED_URL_REFRESH_MARGIN):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._urls = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.cache_hits = 0
+
+    def get_many(self, bucket, paths):
+        """Return {path: url} for objects in a bucket, signing missing ones
+
+        Args:
+            bucket: Storage bucket proxy, e.g. client.storage.from_("fileuploads")
+            paths: Object paths inside the bucket
+
+        Returns:
+            Dict mapping every path to a URL. Paths storage refuses to sign
+            fall back to their public URL.
+        """
+        urls, missing = self._cached(bucket.id, paths)
+        if not missing:
+            return urls
+        self._remember(bucket.id, bucket.create_signed_urls(missing, self.ttl), urls)
+        for path in missing:
+            if path not in urls:
+                urls[path] = bucket.get_public_url(path)
+        return urls
+
+    async def get_many_async(self, bucket, paths):
+        """get_many() for a storage3 async bucket, e.g. AsyncStorage.bucket
+
+        URLs signed either way share the cache.
+        """
+        urls, missing = self._cached(bucket.id, paths)
+        if not missing:
+            return urls
+        self._remember(bucket.id, await bucket.create_signed_urls(missing, self.ttl), urls)
+        for path in missing:
+            if path not in urls:
+                urls[path] = await bucket.get_public_url(path)
+        return urls
+
+    def _cached(self, bucket_id, paths):
+        """Split paths into ({path: cached url}, [paths to sign])"""
+        now = time.monotonic()
+        urls = {}
+        missing = []
+        with self._lock:
+            for path in dict.fromkeys(paths):
+                cached = self._urls.get((bucket_id, path))
+                if cached is not None and cached[1] - now > self.refresh_margin:
+                    urls[path] = cached[0]
+                    self.cache_hits += 1
+                else:
+                    missing.append(path)
+        return urls, missing
+
+    def _remember(self, bucket_id, signed, urls):
+        """Cache a create_signed_urls() result and add it to ``urls``"""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self.batches += 1
+            self._purge_expired()
+            for item in signed:
+                if item.get("error") or not item.get("signedURL"):
+                    continue
+                urls[item["path"]] = item["signedURL"]
+                self._urls[(bucket_id, item["path"])] = (item["signedURL"], expires_at)
+
+    def get(self, bucket, path):
+        """Return a URL for one object"""
+        return self.get_many(bucket, [path])[path]
+
+    def forget(self, bucket, paths):
+        """Drop cached URLs of objects that were deleted or overwritten
+
+        A new upload under the same path gets a fresh URL, so caches never
+        serve the old content for it.
+        """
+        with self._lock:
+            for path in paths:
+                self._urls.pop((bucket.id, path), None)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self._urls.items() if expires_at <= now]:
+            del self._urls[key]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_signed_url_cache():
+    """Return the process-wide SignedUrlCache shared by all sessions"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SignedUrlCache()
+        return _cache
@@ -1,25 +1,215 @@
 import os
-from supabase import create_client
+import threading
+import time
 
-def get_client(access_token=None, refresh_token=None):
+import httpx
+from dotenv import load_dotenv
+from supabase import ClientOptions, create_client
+
+from metrics import InstrumentedTransport
+
+# Load environment variables
+load_dotenv()
+
+# Refresh an access token when it is this close (in seconds) to expiring
+TOKEN_REFRESH_MARGIN = 60
+
+# Drop cached clients that have not been used for this many seconds
+CLIENT_IDLE_TIMEOUT = 30 * 60
+
+
+def get_client(access_token=None, refresh_token=None, http_client=None):
     """Create and configure Supabase client
-    
+
     Args:
         access_token: Optional access token for authenticated requests
         refresh_token: Optional refresh token for session renewal
-    
+        http_client: Optional shared httpx.Client whose connections are reused
+
     Returns:
         Configured Supabase client
     """
     # Get credentials from environment variables
-    supabase_url = 
-    supabase_key = 
-    
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_KEY")
+
+    options = None
+    if http_client is not None:
+        # Tokens are refreshed explicitly by ClientManager, on reruns and
+        # through ensure_fresh(), so there is no need for the per-client
+        # background refresh timer
+        options = ClientOptions(httpx_client=http_client, auto_refresh_token=False)
+
     # Create the base client
-    client = create_client(supabase_url, supabase_key)
-    
+    client = create_client(supabase_url, supabase_key, options)
+
     # If we have both tokens, set the session for authenticated requests
     if access_token and refresh_token:
         client.auth.set_session(access_token, refresh_token)
-    
+
     return client
+
+
+class _ClientEntry:
+    """A cached authenticated client and the session it was built for"""
+
+    def __init__(self, client, access_token, refresh_token, expires_at):
+        self.client = client
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        # Refresh tokens this entry has since replaced; a session may still
+        # hold one when a background job refreshed the client
+        self.superseded = set()
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class ClientManager:
+    """Keep one authenticated Supabase client per user session
+
+    Clients share a single pooled httpx.Client, so HTTP connections are
+    reused across reruns and across sessions. A client is only rebuilt when
+    the session tokens change, and its access token is only refreshed when it
+    is within ``refresh_margin`` seconds of expiring.
+    """
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN, idle_timeout=CLIENT_IDLE_TIMEOUT, http_client=None):
+        self.refresh_margin = refresh_margin
+        self.idle_timeout = idle_timeout
+        # Every storage and auth request of every session goes through this
+        # client, so it is where request metrics are recorded
+        self.http_client = http_client or httpx.Client(
+            transport=InstrumentedTransport(httpx.HTTPTransport(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                http2=True,
+            )),
+            timeout=httpx.Timeout(20.0),
+            follow_redirects=True,
+        )
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "clients_created": 0,
+            "token_refreshes": 0,
+            "cache_hits": 0,
+            "evictions": 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, session_id, access_token, refresh_token):
+        """Return the authenticated client for a user session
+
+        Args:
+            session_id: Stable identifier of the browser session
+            access_token: Current access token stored for the session
+            refresh_token: Current refresh token stored for the session
+
+        Returns:
+            Tuple of (client, access_token, refresh_token). The tokens differ
+            from the ones passed in when the session was refreshed, and the
+            caller should store them for the next rerun.
+        """
+        self.evict_idle()
+
+        with self._lock:
+            entry = self._entries.get(session_id)
+
+        # A different refresh token means the user logged in again, unless
+        # the client was refreshed since the session last saw it
+        if entry is None or (entry.refresh_token != refresh_token and refresh_token not in entry.superseded):
+            entry = self._create_entry(session_id, access_token, refresh_token)
+        else:
+            self._count("cache_hits")
+
+        with entry.lock:
+            entry.last_used = time.monotonic()
+            if entry.expires_at - time.time() <= self.refresh_margin:
+                self._refresh(entry)
+            return entry.client, entry.access_token, entry.refresh_token
+
+    def _create_entry(self, session_id, access_token, refresh_token):
+        client = get_client(access_token, refresh_token, http_client=self.http_client)
+        session = client.auth.get_session()
+        if session is not None:
+            access_token = session.access_token
+            refresh_token = session.refresh_token
+            expires_at = session.expires_at or 0
+        else:
+            expires_at = 0
+
+        entry = _ClientEntry(client, access_token, refresh_token, expires_at)
+        with self._lock:
+            self._entries[session_id] = entry
+            self._counters["clients_created"] += 1
+        return entry
+
+    def _refresh(self, entry):
+        response = entry.client.auth.refresh_session(entry.refresh_token)
+        if response.session is None:
+            return
+        entry.superseded.add(entry.refresh_token)
+        entry.access_token = response.session.access_token
+        entry.refresh_token = response.session.refresh_token
+        entry.expires_at = response.session.expires_at or 0
+        self._count("token_refreshes")
+
+    def ensure_fresh(self, client):
+        """Refresh a cached client's access token if it is about to expire
+
+        For work that outlives the rerun that got the client, e.g. background
+        jobs, which would otherwise keep sending the token it had then. Also
+        keeps the client from being evicted while that work runs. Clients
+        this manager did not create are left alone.
+        """
+        with self._lock:
+            entry = next((entry for entry in self._entries.values() if entry.client is client), None)
+        if entry is None:
+            return
+        with entry.lock:
+            entry.last_used = time.monotonic()
+            if entry.expires_at - time.time() <= self.refresh_margin:
+                self._refresh(entry)
+
+    def remove(self, session_id):
+        """Forget the client cached for a session (e.g. on logout)"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        return entry.client if entry else None
+
+    def evict_idle(self):
+        """Drop clients that have been idle for longer than idle_timeout
+
+        Returns:
+            Number of clients evicted
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.last_used < cutoff]
+            for key in stale:
+                del self._entries[key]
+            self._counters["evictions"] += len(stale)
+        return len(stale)
+
+    def stats(self):
+        """Return a snapshot of the manager's counters"""
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot["active_clients"] = len(self._entries)
+        return snapshot
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager():
+    """Return the process-wide ClientManager shared by all Streamlit sessions"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ClientManager()
+        return _manager
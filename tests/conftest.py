@@ -0,0 +1,42 @@
+"""Fixtures running the project code against the local storage stub"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import ANON_KEY, StubServer  # noqa: E402
+
+# Keep the local database and credentials of test runs away from the app's
+# own; both must be set before the project modules are imported
+os.environ["FILESHARE_DATA_DIR"] = tempfile.mkdtemp(prefix="fileshare-test-")
+os.environ["SUPABASE_KEY"] = ANON_KEY
+
+from file_service import FileService  # noqa: E402
+from signed_urls import SignedUrlCache  # noqa: E402
+from supabase_client import ClientManager, get_client  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stub():
+    server = StubServer()
+    os.environ["SUPABASE_URL"] = server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def manager(stub):
+    return ClientManager()
+
+
+@pytest.fixture
+def files(manager):
+    """A FileService on a fresh user folder"""
+    session = get_client().auth.sign_in_with_password({"email": "test@example.com", "password": "test"}).session
+    client = manager.get(uuid.uuid4().hex, session.access_token, session.refresh_token)[0]
+    return FileService(client, uuid.uuid4().hex, signed_urls=SignedUrlCache(), http_client=manager.http_client,
+                       clients=manager)
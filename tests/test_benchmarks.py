@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# Cases quick enough for every test run; peak memory does not depend on the
+# machine the baseline was recorded on, so only it is compared here
+QUICK_CASES = "page"
+
+
+def run_benchmarks(*args):
+    return subprocess.run([sys.executable, "-m", "benchmarks.run", *args], cwd=ROOT, capture_output=True,
+                          text=True, timeout=600)
+
+
+def test_page_cases_stay_within_baseline_memory():
+    result = run_benchmarks("--only", QUICK_CASES, "--repeat", "3", "--metric", "peak_mb")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "No regressions" in result.stdout
+
+
+def test_regressions_fail_the_run(tmp_path):
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    for result in baseline["results"].values():
+        result["peak_mb"] = 0.0
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps(baseline))
+
+    result = run_benchmarks("--only", "list folder 1k", "--repeat", "1", "--metric", "peak_mb", "--threshold", "0",
+                            "--baseline", str(path))
+    assert result.returncode == 1
+    assert "REGRESSION list folder 1k: peak_mb" in result.stdout
+
+
+@pytest.mark.skipif(not os.environ.get("FILESHARE_BENCHMARKS"),
+                    reason="timings only compare on the machine that recorded the baseline")
+def test_quick_scale_matches_baseline():
+    result = run_benchmarks()
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,23 @@
+import io
+
+from file_service import FileService
+from supabase_client import ClientManager, get_client
+from uploads import BatchItem
+
+
+def test_jobs_refresh_the_token_the_session_still_holds(stub):
+    # Every token is within the margin, so each check refreshes
+    manager = ClientManager(refresh_margin=10 ** 9)
+    session = get_client().auth.sign_in_with_password({"email": "job@example.com", "password": "test"}).session
+    client, access_token, refresh_token = manager.get("session", session.access_token, session.refresh_token)
+    files = FileService(client, "job", http_client=manager.http_client, clients=manager)
+    before = client.options.headers["Authorization"]
+
+    results = files.upload_batch([BatchItem(f"{i}.txt", f"job/{i}.txt", 1, lambda: io.BytesIO(b"x")) for i in range(3)])
+
+    assert all(result["ok"] for result in results)
+    assert client.options.headers["Authorization"] != before
+    assert manager.stats()["token_refreshes"] >= 3
+    # The next rerun still has the tokens the job replaced
+    assert manager.get("session", access_token, refresh_token)[0] is client
+    assert manager.stats()["clients_created"] == 1
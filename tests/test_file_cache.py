@@ -0,0 +1,143 @@
+import io
+
+import pytest
+
+import file_cache
+from file_cache import ListingCache, list_folder, make_entry, make_folder_entry, walk_folder
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeBucket:
+    """Serves name-ordered list() pages of an in-memory folder tree"""
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.calls = []
+
+    def list(self, folder, options):
+        self.calls.append((folder, options["offset"], options["limit"]))
+        rows = sorted(self.folders.get(folder, []), key=lambda row: row["name"])
+        return rows[options["offset"]:options["offset"] + options["limit"]]
+
+
+def objects(*names):
+    return [make_entry(name, 1, "text/plain") for name in names]
+
+
+def names(entries):
+    return [entry["name"] for entry in entries]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(file_cache, "time", fake)
+    return fake
+
+
+def test_pages_load_only_what_is_shown(clock):
+    bucket = FakeBucket({"u": objects(*(f"f{i:02}" for i in range(10)))})
+    cache = ListingCache()
+
+    entries, has_more = cache.get_page(bucket, "u", 0, 3)
+    assert names(entries) == ["f00", "f01", "f02"] and has_more
+    assert bucket.calls == [("u", 0, 4)]
+    assert names(cache.get_page(bucket, "u", 0, 3)[0]) == ["f00", "f01", "f02"]
+    assert cache.fetches == 1
+
+    entries, has_more = cache.get_page(bucket, "u", 3, 3)
+    assert names(entries) == ["f09"] and not has_more
+    assert names(cache.get(bucket, "u")) == [f"f{i:02}" for i in range(10)]
+
+
+def test_listings_are_fetched_again_after_the_ttl(clock):
+    bucket = FakeBucket({"u": objects("a")})
+    cache = ListingCache(ttl=60)
+    cache.get(bucket, "u")
+
+    clock.now += 59
+    cache.get(bucket, "u")
+    assert cache.fetches == 1
+    clock.now += 1
+    cache.get(bucket, "u")
+    assert cache.fetches == 2
+
+
+def test_patched_entries_keep_later_pages_aligned(clock):
+    bucket = FakeBucket({"u": objects("b", "d", "f", "h", "j")})
+    cache = ListingCache()
+    cache.get_page(bucket, "u", 0, 2)
+
+    # Uploaded before the loaded frontier: shown at once, and the next
+    # list() offset moves past the row the server now has there
+    bucket.folders["u"] += objects("a")
+    cache.add_entry("u", make_entry("a", 1, "text/plain"))
+    # Past the frontier: arrives with the page that covers it
+    bucket.folders["u"] += objects("i")
+    cache.add_entry("u", make_entry("i", 1, "text/plain"))
+    bucket.folders["u"] = [row for row in bucket.folders["u"] if row["name"] != "b"]
+    cache.remove_entries("u", ["b"])
+
+    assert names(cache.get(bucket, "u")) == ["a", "d", "f", "h", "i", "j"]
+
+
+def test_complete_listings_are_patched_in_place(clock):
+    bucket = FakeBucket({"u": objects("a", "c")})
+    cache = ListingCache()
+    cache.get(bucket, "u")
+
+    cache.add_entry("u", make_entry("b", 5, "text/plain"))
+    cache.add_entry("u", make_entry("c", 9, "text/plain"))
+    cache.remove_entries("u", ["a", "missing"])
+    cache.add_entry("other", make_entry("x", 1, "text/plain"))
+
+    listing = cache.get(bucket, "u")
+    assert names(listing) == ["b", "c"]
+    assert listing[1]["metadata"]["size"] == 9
+    assert cache.fetches == 1
+    cache.invalidate("u")
+    assert names(cache.get(bucket, "u")) == ["a", "c"]
+
+
+def test_folders_are_walked_page_by_page():
+    bucket = FakeBucket({
+        "u": objects("a", "b", "c") + [make_folder_entry("sub"), make_folder_entry(".thumbnails")],
+        "u/sub": objects("d"),
+        "u/.thumbnails": objects("t.jpg"),
+    })
+
+    assert names(list_folder(bucket, "u", page_size=2)) == [".thumbnails", "a", "b", "c", "sub"]
+    assert [offset for folder, offset, _ in bucket.calls] == [0, 2, 4]
+    assert [path for path, _ in walk_folder(bucket, "u")] == ["u/a", "u/b", "u/c", "u/sub/d"]
+
+
+def test_uploads_and_deletes_patch_the_shared_listing(files):
+    cache = files.listing_cache
+    files.store("b.txt", io.BytesIO(b"b"), 1, "text/plain")
+    files.list_page(0, 10)
+    fetches = cache.fetches
+
+    files.store("a.txt", io.BytesIO(b"a"), 1, "text/plain")
+    files.store("sub/c.txt", io.BytesIO(b"c"), 1, "text/plain")
+    files.delete(["b.txt"])
+
+    entries, has_more = files.list_page(0, 10)
+    assert names(entries) == ["a.txt", "sub"] and not has_more
+    assert cache.fetches == fetches
+
+
+def test_async_walk_matches_the_sync_walk(files):
+    for name in ("b.txt", "a/c.txt", "a/d/e.txt"):
+        files.store(name, io.BytesIO(name.encode()), len(name), "text/plain")
+    files.bucket.upload(f"{files.user_folder}/.thumbnails/x.jpg", b"x", {"content-type": "image/jpeg"})
+
+    walked = [path for path, _ in walk_folder(files.bucket, files.user_folder)]
+    assert sorted(walked) == [files.path(name) for name in ("a/c.txt", "a/d/e.txt", "b.txt")]
+    assert [path for path, _ in files.io.run(files.storage.walk_folder(files.user_folder))] == walked
@@ -0,0 +1,33 @@
+import io
+import uuid
+
+from file_service import FileService
+from signed_urls import SignedUrlCache
+from supabase_client import get_client
+
+
+def _sign_in(manager, email, folder):
+    """Return (user ID, FileService on ``folder`` acting as ``email``)"""
+    session = get_client().auth.sign_in_with_password({"email": email, "password": "test"}).session
+    client = manager.get(uuid.uuid4().hex, session.access_token, session.refresh_token)[0]
+    return session.user.id, FileService(client, folder, signed_urls=SignedUrlCache(),
+                                        http_client=manager.http_client, clients=manager)
+
+
+def test_adopt_moves_only_own_uploads(manager):
+    legacy_folder = uuid.uuid4().hex[:8]
+    alice_id, alice_legacy = _sign_in(manager, f"{legacy_folder}@a.example", legacy_folder)
+    _, bob_legacy = _sign_in(manager, f"{legacy_folder}@b.example", legacy_folder)
+    alice_legacy.store("mine.txt", io.BytesIO(b"mine"), 4, "text/plain")
+    bob_legacy.store("theirs.txt", io.BytesIO(b"theirs"), 6, "text/plain")
+    alice = FileService(alice_legacy.client, alice_id, signed_urls=SignedUrlCache(),
+                        http_client=manager.http_client, clients=manager)
+
+    assert alice.has_legacy_files(legacy_folder)
+    result = alice.adopt_folder(legacy_folder, alice_id)
+
+    assert result == {"moved": 1, "skipped": 1, "failed": []}
+    assert alice.download("mine.txt") == b"mine"
+    assert bob_legacy.download("theirs.txt") == b"theirs"
+    assert alice.index.lookup(legacy_folder, f"{legacy_folder}/mine.txt") is None
+    assert alice.adopt_folder(legacy_folder, alice_id)["moved"] == 0
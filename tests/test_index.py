@@ -0,0 +1,23 @@
+import io
+
+from metadata_index import _unchanged
+
+
+def test_reindex_keeps_uploaded_files(files):
+    files.store("a.txt", io.BytesIO(b"alpha"), 5, "text/plain")
+    files.store("b.txt", io.BytesIO(b"beta"), 4, "text/plain")
+
+    assert files.reindex() == {"added": 0, "updated": 0, "removed": 0}
+
+    files.bucket.upload(files.path("b.txt"), b"changed", {"content-type": "text/plain", "upsert": "true"})
+    assert files.reindex()["updated"] == 1
+    assert files.reindex()["updated"] == 0
+
+
+def test_timestamps_compare_across_formats():
+    recorded = (5, "2024-05-01T10:00:00Z")
+    assert _unchanged(recorded, (5, "2024-05-01T10:00:00.123456+00:00"))
+    assert _unchanged(recorded, (5, "2024-05-01T09:59:58.5+00:00"))
+    assert not _unchanged(recorded, (6, "2024-05-01T10:00:00Z"))
+    assert not _unchanged(recorded, (5, "2024-05-01T10:05:00.000Z"))
+    assert not _unchanged(recorded, (5, None))
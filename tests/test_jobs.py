@@ -0,0 +1,100 @@
+import threading
+import time
+
+from jobs import CANCELLED, DONE, FAILED, PRIORITY_BACKGROUND, QUEUED, RUNNING, JobQueue
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class Blocker:
+    """Job functions that record when they start and wait to be released"""
+
+    def __init__(self):
+        self.started = []
+        self.release = threading.Event()
+
+    def __call__(self, name):
+        def run(job):
+            self.started.append(name)
+            self.release.wait(10)
+            return name
+        return run
+
+
+def statuses(queue, job_ids):
+    return [queue.get(job_id)["status"] for job_id in job_ids]
+
+
+def test_per_user_limit_spares_unlimited_jobs_and_other_users():
+    queue, block = JobQueue(max_workers=4, max_per_user=2), Blocker()
+    mine = [queue.submit("alice", "upload", "", block(f"upload {i}")) for i in range(3)]
+    upkeep = queue.submit("alice", "scrub", "", block("scrub"), limited=False)
+    theirs = queue.submit("bob", "upload", "", block("bob"))
+
+    wait_for(lambda: len(block.started) == 4)
+    assert statuses(queue, mine) == [RUNNING, RUNNING, QUEUED]
+    assert statuses(queue, [upkeep, theirs]) == [RUNNING, RUNNING]
+
+    block.release.set()
+    wait_for(lambda: statuses(queue, mine + [upkeep, theirs]) == [DONE] * 5)
+    assert queue.get(mine[2])["result"] == "upload 2"
+
+
+def test_queued_jobs_start_by_priority_then_submission_order():
+    queue, block = JobQueue(max_workers=1, max_per_user=5), Blocker()
+    first = queue.submit("alice", "upload", "", block("first"))
+    wait_for(lambda: block.started == ["first"])
+    queue.submit("alice", "thumbnail", "", block("background"), priority=PRIORITY_BACKGROUND)
+    queue.submit("alice", "upload", "", block("second"))
+    last = queue.submit("bob", "upload", "", block("third"))
+
+    block.release.set()
+    wait_for(lambda: len(block.started) == 4)
+    assert block.started == ["first", "second", "third", "background"]
+    assert queue.get(first)["status"] == DONE and queue.get(last)["status"] == DONE
+
+
+def test_background_jobs_leave_a_worker_for_users():
+    queue, block = JobQueue(max_workers=2, max_per_user=2), Blocker()
+    upkeep = [queue.submit(owner, "scrub", "", block(owner), priority=PRIORITY_BACKGROUND, limited=False)
+              for owner in ("alice", "bob")]
+    wait_for(lambda: len(block.started) == 1)
+    assert sorted(statuses(queue, upkeep)) == [QUEUED, RUNNING]
+
+    upload = queue.submit("carol", "upload", "", block("upload"))
+    wait_for(lambda: len(block.started) == 2)
+    assert queue.get(upload)["status"] == RUNNING
+    block.release.set()
+    wait_for(lambda: statuses(queue, upkeep + [upload]) == [DONE] * 3)
+
+
+def test_only_queued_jobs_can_be_cancelled():
+    queue, block = JobQueue(max_workers=1, max_per_user=1), Blocker()
+    running = queue.submit("alice", "upload", "", block("running"))
+    waiting = queue.submit("alice", "upload", "", block("waiting"))
+    wait_for(lambda: block.started == ["running"])
+
+    assert not queue.cancel("bob", waiting)
+    assert queue.cancel("alice", waiting)
+    assert not queue.cancel("alice", running)
+    block.release.set()
+    wait_for(lambda: queue.get(running)["status"] == DONE)
+    assert queue.get(waiting)["status"] == CANCELLED
+    assert block.started == ["running"]
+
+
+def test_failures_are_kept_on_the_job_row():
+    queue = JobQueue()
+
+    def run(job):
+        raise ValueError("storage said no")
+
+    job_id = queue.submit("alice", "upload", "", run)
+    wait_for(lambda: queue.get(job_id)["status"] == FAILED)
+    assert queue.get(job_id)["error"] == "storage said no"
+    assert not queue.is_active("alice", "upload")
@@ -0,0 +1,102 @@
+import uuid
+
+import pytest
+
+import limits
+from limits import Limits, QuotaExceeded, TokenBucket
+
+
+class FakeTime:
+    """Stands in for the time module in limits; sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(limits, "time", fake)
+    return fake
+
+
+def test_bucket_allows_a_burst_then_holds_the_rate(clock):
+    bucket = TokenBucket(100)
+
+    bucket.consume(100)
+    assert clock.slept == []
+    bucket.consume(50)
+    assert clock.slept == [0.5]
+    clock.now += 10
+    # Idle time saves up no more than the capacity
+    assert bucket.reserve(150) == pytest.approx(0.5)
+    assert bucket.waited == pytest.approx(1.0)
+
+
+def test_requests_larger_than_the_capacity_still_pass_at_the_rate(clock):
+    bucket = TokenBucket(10, capacity=5)
+
+    assert bucket.reserve(25) == pytest.approx(2.0)
+    clock.now += 2
+    assert bucket.reserve(1) == pytest.approx(0.1)
+
+
+def test_zero_rate_never_waits(clock):
+    bucket = TokenBucket(0)
+
+    assert bucket.reserve(10 ** 12) == 0
+    assert bucket.waited == 0
+
+
+def test_throttle_waits_on_the_slower_of_user_and_server_budgets(clock):
+    server = Limits(user_bandwidth=100, global_bandwidth=1000)
+
+    server.throttle("alice", 100)
+    server.throttle("bob", 100)
+    assert clock.slept == []
+    server.throttle("alice", 50)
+    assert clock.slept == [pytest.approx(0.5)]
+    assert server.stats()["waited_seconds"]["user_bandwidth"] == {"alice": 0.5}
+
+
+def test_admission_reserves_room_until_released():
+    owner = uuid.uuid4().hex
+    server = Limits(quota_bytes=1000, quota_files=3)
+    usage = lambda: (1, 400)
+
+    reservation = server.admit(owner, usage, 500, count=2)
+    assert server.reserved(owner) == (500, 2)
+    with pytest.raises(QuotaExceeded):
+        server.admit(owner, usage, 200)
+    with pytest.raises(QuotaExceeded):
+        server.check(owner, usage, 0, count=1)
+
+    # A finished file is in the usage counters now
+    reservation.release(300)
+    assert server.reserved(owner) == (200, 1)
+    with reservation:
+        pass
+    assert server.reserved(owner) == (0, 0)
+    server.admit(owner, usage, 600, count=2).close()
+
+
+def test_per_user_quota_overrides_the_default():
+    owner = uuid.uuid4().hex
+    server = Limits(quota_bytes=100)
+    server.set_quota(owner, max_bytes=0)
+
+    assert server.quota(owner) == (0, 0)
+    server.check(owner, lambda: (0, 10 ** 9), 10 ** 9)
+    with pytest.raises(QuotaExceeded):
+        server.check(uuid.uuid4().hex, lambda: (0, 0), 101)
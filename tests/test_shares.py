@@ -0,0 +1,64 @@
+import io
+import os
+import threading
+import time
+import uuid
+import zipfile
+from http.server import ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import share_server
+from file_actions import export_path
+
+TEXT = b"all work and no play makes jack a dull boy\n" * 2000
+
+
+@pytest.fixture(scope="module")
+def share_base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), share_server.ShareHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("first, second", [(True, False), (False, True)])
+def test_link_serves_new_version_with_its_encoding(files, share_base_url, first, second):
+    files.store("notes.txt", io.BytesIO(TEXT), len(TEXT), "text/plain", compress=first)
+    link = files.share("notes.txt")
+    replacement = TEXT.upper()
+    files.store("notes.txt", io.BytesIO(replacement), len(replacement), "text/plain", compress=second)
+
+    response = httpx.get(f"{share_base_url}/s/{link['token']}")
+
+    assert response.status_code == 200
+    assert response.content == replacement
+
+    versions = files.versions_of("notes.txt")
+    files.restore("notes.txt", versions[-1]["version"])
+    assert httpx.get(f"{share_base_url}/s/{link['token']}").content == TEXT
+
+
+def test_export_is_streamed_from_disk_and_not_listed(files, share_base_url):
+    files.store("a.txt", io.BytesIO(TEXT), len(TEXT), "text/plain")
+    result = files.export_zip(export_path(f"{uuid.uuid4().hex}.zip"))
+    link = files.share_export(result["archive"])
+
+    response = httpx.get(f"{share_base_url}/s/{link['token']}")
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/zip"
+    assert zipfile.ZipFile(io.BytesIO(response.content)).read("a.txt") == TEXT
+    assert files.shared_links() == []
+    os.remove(result["archive"])
+    assert httpx.get(f"{share_base_url}/s/{link['token']}").status_code == 404
+
+
+def test_export_links_only_reach_the_export_directory(files, share_base_url):
+    token = files.share_links.create(files.user_folder, "/etc/passwd", "passwd", "file:///etc/passwd",
+                                     time.time() + 60, mime_type="text/plain")
+
+    assert httpx.get(f"{share_base_url}/s/{token}").status_code == 404
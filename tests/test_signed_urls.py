@@ -0,0 +1,99 @@
+import asyncio
+import io
+
+import pytest
+
+import signed_urls
+from signed_urls import SignedUrlCache
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeBucket:
+    """Signs every path except the refused ones and records each batch"""
+
+    id = "fileuploads"
+
+    def __init__(self, refused=()):
+        self.batches = []
+        self.refused = set(refused)
+
+    def create_signed_urls(self, paths, expires_in):
+        self.batches.append(list(paths))
+        return [{"path": path, "signedURL": f"https://signed/{path}?batch={len(self.batches)}", "error": None}
+                for path in paths if path not in self.refused]
+
+    def get_public_url(self, path):
+        return f"https://public/{path}"
+
+
+class AsyncFakeBucket(FakeBucket):
+    async def create_signed_urls(self, paths, expires_in):
+        return FakeBucket.create_signed_urls(self, paths, expires_in)
+
+    async def get_public_url(self, path):
+        return FakeBucket.get_public_url(self, path)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(signed_urls, "time", fake)
+    return fake
+
+
+def test_pages_are_signed_in_one_batch_and_reused(clock):
+    cache, bucket = SignedUrlCache(), FakeBucket()
+
+    first = cache.get_many(bucket, ["a", "b", "a"])
+    assert bucket.batches == [["a", "b"]]
+    assert cache.get_many(bucket, ["a", "b"]) == first
+    cache.get_many(bucket, ["b", "c"])
+    assert bucket.batches == [["a", "b"], ["c"]]
+    assert cache.cache_hits == 3
+
+
+def test_urls_are_signed_again_within_the_refresh_margin(clock):
+    cache, bucket = SignedUrlCache(ttl=3600, refresh_margin=300), FakeBucket()
+    cache.get(bucket, "a")
+
+    clock.now += 3600 - 301
+    cache.get(bucket, "a")
+    assert len(bucket.batches) == 1
+    clock.now += 2
+    assert cache.get(bucket, "a") == "https://signed/a?batch=2"
+
+
+def test_forgotten_and_refused_paths_are_not_served_from_cache(clock):
+    cache, bucket = SignedUrlCache(), FakeBucket(refused={"gone"})
+
+    assert cache.get_many(bucket, ["a", "gone"]) == {"a": "https://signed/a?batch=1", "gone": "https://public/gone"}
+    cache.forget(bucket, ["a"])
+    cache.get_many(bucket, ["a", "gone"])
+    assert bucket.batches == [["a", "gone"], ["a", "gone"]]
+
+
+def test_async_and_sync_signing_share_the_cache(clock):
+    cache, bucket = SignedUrlCache(), AsyncFakeBucket()
+
+    urls = asyncio.run(cache.get_many_async(bucket, ["a"]))
+    assert cache.get_many(bucket, ["a"]) == urls
+    assert len(bucket.batches) == 1
+
+
+def test_overwrite_and_delete_drop_cached_urls(files):
+    files.store("a.txt", io.BytesIO(b"one"), 3, "text/plain")
+    path = files.path("a.txt")
+    files.signed_urls.get(files.bucket, path)
+
+    files.store("a.txt", io.BytesIO(b"two"), 3, "text/plain")
+    assert files.signed_urls._cached(files.bucket.id, [path]) == ({}, [path])
+    files.signed_urls.get(files.bucket, path)
+    files.delete(["a.txt"])
+    assert files.signed_urls._cached(files.bucket.id, [path]) == ({}, [path])
@@ -0,0 +1,89 @@
+import io
+import threading
+import time
+
+from PIL import Image
+
+from file_cache import list_folder
+from jobs import JobQueue
+from thumbnails import THUMBNAIL_FOLDER, ThumbnailService
+
+
+def png():
+    out = io.BytesIO()
+    Image.new("RGB", (640, 480), "red").save(out, format="PNG")
+    return out.getvalue()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def stored_thumbnails(files):
+    return list_folder(files.bucket, f"{files.user_folder}/{THUMBNAIL_FOLDER}")
+
+
+def test_thumbnails_are_batched_outside_user_job_slots_and_deleted_with_files(files):
+    jobs = JobQueue(max_workers=3, max_per_user=2)
+    files.thumbnail_service = ThumbnailService(jobs)
+    release = threading.Event()
+    for _ in range(2):
+        jobs.submit(files.user_folder, "upload", "Blocking upload", lambda job: release.wait(10))
+    data = png()
+    for i in range(3):
+        files.store(f"pics/{i}.png", io.BytesIO(data + bytes([i])), len(data) + 1, "image/png")
+
+    # Found through an index search, whose entries carry no eTag
+    entries = files.list_page(0, 10, query="png")[0]
+    assert files.page_links(entries)["thumbnails"] == {f"pics/{i}.png": None for i in range(3)}
+    assert len(jobs.jobs_for(files.user_folder, ["thumbnail"])) == 1
+
+    wait_for(lambda: all(files.page_links(entries)["thumbnails"].values()))
+    release.set()
+    assert len(stored_thumbnails(files)) == 3
+    # Listed from storage, the same thumbnails are found
+    listed = files.list_page(0, 10, folder="pics")[0]
+    assert all(files.page_links(listed)["thumbnails"].values())
+
+    files.delete(["pics/0.png"])
+    assert len(stored_thumbnails(files)) == 2
+
+
+def test_new_version_replaces_its_thumbnail(files):
+    files.thumbnail_service = ThumbnailService(JobQueue())
+    data = png()
+    files.store("a.png", io.BytesIO(data), len(data), "image/png")
+    entries = files.list_page(0, 10)[0]
+    files.page_links(entries)
+    wait_for(lambda: files.page_links(files.list_page(0, 10)[0])["thumbnails"]["a.png"])
+    first = files.page_links(entries)["thumbnails"]["a.png"]
+
+    files.store("a.png", io.BytesIO(data + b"\0"), len(data) + 1, "image/png")
+    assert files.page_links(files.list_page(0, 10)[0])["thumbnails"]["a.png"] is None
+    wait_for(lambda: files.page_links(files.list_page(0, 10)[0])["thumbnails"]["a.png"])
+    second = files.page_links(files.list_page(0, 10)[0])["thumbnails"]["a.png"]
+
+    assert second != first
+    assert [f"{files.user_folder}/{THUMBNAIL_FOLDER}/{entry['name']}" for entry in stored_thumbnails(files)] == [second]
+
+
+def test_identical_content_shares_one_thumbnail(files):
+    jobs = JobQueue()
+    files.thumbnail_service = ThumbnailService(jobs)
+    data = png()
+    files.store("a.png", io.BytesIO(data), len(data), "image/png")
+    files.store("copy.png", io.BytesIO(data), len(data), "image/png")
+
+    wait_for(lambda: all(files.page_links(files.list_page(0, 10)[0])["thumbnails"].values()))
+    thumbnails = files.page_links(files.list_page(0, 10)[0])["thumbnails"]
+    assert thumbnails["a.png"] == thumbnails["copy.png"]
+    assert len(stored_thumbnails(files)) == 1
+    assert len(jobs.jobs_for(files.user_folder, ["thumbnail"])) == 1
+
+    files.delete(["a.png"])
+    assert len(stored_thumbnails(files)) == 1
+    files.delete(["copy.png"])
+    assert stored_thumbnails(files) == []
@@ -0,0 +1,63 @@
+import io
+import zipfile
+
+import pytest
+
+from integrity import CORRUPT, IntegrityError
+from uploads import items_from_zip
+
+# Compresses well and is of a compressible type
+TEXT = b"all work and no play makes jack a dull boy\n" * 2000
+
+
+def store(files, name, compress):
+    return files.store(name, io.BytesIO(TEXT), len(TEXT), "text/plain", compress=compress)
+
+
+def test_copy_of_compressed_content_keeps_source_encoding(files):
+    source = store(files, "a.txt", compress=True)
+    assert source["encoding"] == "gzip"
+
+    copy = store(files, "b.txt", compress=False)
+
+    assert copy["status"] == "copied"
+    assert (copy["encoding"], copy["size"]) == ("gzip", source["size"])
+    assert files.index.encodings(files.user_folder, [files.path("b.txt")]) == {files.path("b.txt"): "gzip"}
+    assert files.download("b.txt") == TEXT
+    assert files.usage()["total_size"] == 2 * source["size"]
+
+
+def test_copy_of_plain_content_is_not_marked_compressed(files):
+    store(files, "a.txt", compress=False)
+
+    copy = store(files, "b.txt", compress=True)
+
+    assert copy["status"] == "copied"
+    assert (copy["encoding"], copy["size"]) == (None, len(TEXT))
+    assert files.index.encodings(files.user_folder, [files.path("b.txt")]) == {}
+    assert files.download("b.txt") == TEXT
+    assert files.usage()["total_size"] == 2 * len(TEXT)
+
+
+def test_zip_members_keep_dot_names_but_not_hidden_folders():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for name in ["..notes.txt", ".gitignore", "docs/a.txt", "../escape.txt", "a/../../up.txt",
+                     ".versions/x.txt", "docs/.thumbnails/y.png", "__MACOSX/._a.txt"]:
+            zip_file.writestr(name, b"x")
+
+    items = items_from_zip(archive, "user/upload")
+
+    assert sorted(item.name for item in items) == ["..notes.txt", ".gitignore", "docs/a.txt"]
+
+
+def test_download_streams_compressed_content_and_detects_corruption(files):
+    store(files, "a.txt", compress=True)
+    out = io.BytesIO()
+    files.download_to("a.txt", out)
+    assert out.getvalue() == TEXT
+
+    files.bucket.upload(files.path("a.txt"), b"garbage", {"content-type": "text/plain", "upsert": "true"})
+    with pytest.raises(IntegrityError):
+        files.download("a.txt")
+    assert files.index.integrity_issues(files.user_folder) == {files.path("a.txt"): CORRUPT}
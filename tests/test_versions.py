@@ -0,0 +1,36 @@
+import io
+
+from file_cache import list_folder
+from limits import QuotaExceeded
+from versions import VERSIONS_FOLDER
+
+import pytest
+
+
+def stored_versions(files, name):
+    return [entry["name"] for entry in list_folder(files.bucket, f"{files.user_folder}/{VERSIONS_FOLDER}/{name}")]
+
+
+def test_current_version_is_stored_once(files):
+    files.store("a.txt", io.BytesIO(b"one"), 3, "text/plain")
+    assert stored_versions(files, "a.txt") == []
+
+    files.store("a.txt", io.BytesIO(b"two!"), 4, "text/plain")
+    first, second = files.versions_of("a.txt")[::-1]
+    assert stored_versions(files, "a.txt") == [first["version"]]
+    assert files.usage()["total_size"] == 3 + 4
+
+    files.restore("a.txt", first["version"])
+    assert stored_versions(files, "a.txt") == [second["version"]]
+    assert files.download("a.txt") == b"one"
+    assert files.usage()["total_size"] == 3 + 4
+
+
+def test_earlier_versions_count_against_quota(files):
+    files.limits.set_quota(files.user_folder, 10, 0)
+    files.store("a.txt", io.BytesIO(b"x" * 6), 6, "text/plain")
+    with pytest.raises(QuotaExceeded):
+        files.store("a.txt", io.BytesIO(b"y" * 6), 6, "text/plain")
+    files.store("a.txt", io.BytesIO(b"y" * 4), 4, "text/plain")
+    with pytest.raises(QuotaExceeded):
+        files.store("b.txt", io.BytesIO(b"z"), 1, "text/plain")
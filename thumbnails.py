@@ -0,0 +1,314 @@
+import hashlib
+import io
+import logging
+import shutil
+import subprocess
+import threading
+import time
+
+from PIL import Image
+
+from jobs import PRIORITY_BACKGROUND, get_job_queue
+from local_db import ensure_schema
+
+try:
+    import fitz  # PyMuPDF, only needed for PDF thumbnails
+except ImportError:
+    fitz = None
+
+# Longest edge of a generated thumbnail, in pixels
+THUMBNAIL_SIZE = 320
+
+# Thumbnails live next to the user's files under this folder
+THUMBNAIL_FOLDER = ".thumbnails"
+
+# Originals larger than this are not downloaded to build an image thumbnail
+MAX_SOURCE_SIZE = 50 * 1024 * 1024
+
+# Position in seconds of the frame used as a video poster
+VIDEO_POSTER_AT = 1
+
+# Lifetime of the URL a thumbnail job signs to read a video (seconds)
+SOURCE_URL_TTL = 10 * 60
+
+READY = "ready"
+PENDING = "pending"
+UNSUPPORTED = "unsupported"
+
+# A pending thumbnail not built after this long is requested again (seconds)
+PENDING_TIMEOUT = 10 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnail_images (
+    owner TEXT NOT NULL,
+    content TEXT NOT NULL,
+    status TEXT NOT NULL,
+    storage_key TEXT NOT NULL,
+    requested_at REAL NOT NULL,
+    PRIMARY KEY (owner, content)
+);
+CREATE TABLE IF NOT EXISTS thumbnail_refs (
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (owner, path)
+);
+CREATE INDEX IF NOT EXISTS thumbnail_refs_content ON thumbnail_refs (owner, content);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_path(owner, content):
+    """Derived storage path of the thumbnail of a content hash"""
+    key = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{owner}/{THUMBNAIL_FOLDER}/{key}.jpg"
+
+
+def _rows(conn, sql, owner, values):
+    """Run a query of the form "... IN ({})" over values in chunks"""
+    rows = []
+    # Stay well below SQLite's bound parameter limit
+    for start in range(0, len(values), 500):
+        chunk = values[start:start + 500]
+        rows.extend(conn.execute(sql.format(", ".join("?" for _ in chunk)), [owner, *chunk]).fetchall())
+    return rows
+
+
+def _release(conn, owner, contents):
+    """Drop thumbnails no file refers to any more
+
+    Returns:
+        Their storage paths, for the caller to delete
+    """
+    contents = list(set(contents))
+    used = {row["content"] for row in _rows(
+        conn, "SELECT DISTINCT content FROM thumbnail_refs WHERE owner = ? AND content IN ({})", owner, contents
+    )}
+    unused = [content for content in contents if content not in used]
+    keys = [row["storage_key"] for row in _rows(
+        conn, "SELECT storage_key FROM thumbnail_images WHERE owner = ? AND content IN ({})", owner, unused
+    )]
+    conn.executemany("DELETE FROM thumbnail_images WHERE owner = ? AND content = ?",
+                     [(owner, content) for content in unused])
+    return keys
+
+
+def can_thumbnail(mime_type):
+    """Whether a thumbnail can be generated for this kind of file"""
+    if mime_type.startswith("image/") and mime_type != "image/svg+xml":
+        return True
+    if mime_type == "application/pdf":
+        return fitz is not None
+    if mime_type.startswith("video/"):
+        return shutil.which("ffmpeg") is not None
+    return False
+
+
+def _encode(image):
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=80, optimize=True)
+    return out.getvalue()
+
+
+def image_thumbnail(data):
+    """Build a JPEG thumbnail from image bytes"""
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        return _encode(image)
+
+
+def pdf_thumbnail(data):
+    """Build a JPEG thumbnail of the first page of a PDF"""
+    with fitz.open(stream=data, filetype="pdf") as document:
+        page = document[0]
+        zoom = THUMBNAIL_SIZE / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        return _encode(Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples))
+
+
+def video_poster(url):
+    """Grab one frame of a video with ffmpeg
+
+    ffmpeg reads the URL with range requests, so only the start of the video
+    is transferred.
+    """
+    result = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-ss", str(VIDEO_POSTER_AT), "-i", url,
+         "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+        capture_output=True, timeout=60, check=True,
+    )
+    return image_thumbnail(result.stdout)
+
+
+def forget_thumbnails(owner, paths):
+    """Forget which thumbnails deleted or moved files had
+
+    Returns:
+        Storage paths of thumbnails no other file shares, for the caller to
+        delete
+    """
+    conn = ensure_schema(SCHEMA)
+    paths = list(paths)
+    contents = [row["content"] for row in _rows(
+        conn, "SELECT content FROM thumbnail_refs WHERE owner = ? AND path IN ({})", owner, paths
+    )]
+    conn.executemany("DELETE FROM thumbnail_refs WHERE owner = ? AND path = ?", [(owner, path) for path in paths])
+    return _release(conn, owner, contents)
+
+
+class ThumbnailService:
+    """Generate thumbnails in the background and remember which exist
+
+    Thumbnails are keyed by content hash, so identical content under other
+    names, or uploaded again, shares one thumbnail and is never built
+    twice. The local database maps each file path to the content it showed
+    last, so a thumbnail is found whichever way the file was listed and is
+    deleted once no file refers to it. Requests are queued per owner and
+    built by a single background job that drains the queue and does not
+    take one of the owner's job slots.
+    """
+
+    def __init__(self, jobs=None):
+        self._jobs = jobs or get_job_queue()
+        # owner -> {content: (path, size, mime_type)} waiting to be built
+        self._queued = {}
+        # owner -> thumbnail storage paths no file refers to any more
+        self._stale = {}
+        # owner -> callable returning a storage bucket with a current token
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        return ensure_schema(SCHEMA)
+
+    def request(self, get_bucket, owner, files):
+        """Return thumbnail paths for files, scheduling missing ones
+
+        Args:
+            get_bucket: Callable returning the storage bucket proxy; called
+                by the job, so its token is current when the job runs
+            owner: User folder of the files and their thumbnails
+            files: Iterable of (path, content, size, mime_type); content is
+                a hash identifying the file's bytes
+
+        Returns:
+            Dict mapping each path to its thumbnail's storage path once it
+            is ready, otherwise None
+        """
+        files = [item for item in files if item[1] is not None]
+        conn = self._conn()
+        refs = {row["path"]: row["content"] for row in _rows(
+            conn, "SELECT path, content FROM thumbnail_refs WHERE owner = ? AND path IN ({})", owner,
+            [path for path, _, _, _ in files]
+        )}
+        changed = [(owner, path, content) for path, content, _, _ in files if refs.get(path) != content]
+        stale = []
+        if changed:
+            conn.executemany("INSERT OR REPLACE INTO thumbnail_refs (owner, path, content) VALUES (?, ?, ?)", changed)
+            # The thumbnails of content the files no longer hold may be unused now
+            stale = _release(conn, owner, [refs[path] for _, path, _ in changed if path in refs])
+        images = {row["content"]: row for row in _rows(
+            conn, "SELECT content, status, storage_key, requested_at FROM thumbnail_images "
+                  "WHERE owner = ? AND content IN ({})", owner, list({content for _, content, _, _ in files})
+        )}
+
+        found = {}
+        wanted = {}
+        for path, content, size, mime_type in files:
+            row = images.get(content)
+            if row is not None and row["status"] == READY:
+                found[path] = row["storage_key"]
+                continue
+            found[path] = None
+            if not can_thumbnail(mime_type):
+                continue
+            # Pending rows outlive the in-memory queue when the process restarts
+            if row is None or (row["status"] == PENDING and row["requested_at"] < time.time() - PENDING_TIMEOUT):
+                wanted[content] = (path, size, mime_type)
+        if not wanted and not stale:
+            return found
+
+        conn.executemany(
+            "INSERT OR REPLACE INTO thumbnail_images (owner, content, status, storage_key, requested_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(owner, content, PENDING, thumbnail_path(owner, content), time.time()) for content in wanted],
+        )
+        with self._lock:
+            self._buckets[owner] = get_bucket
+            scheduled = owner in self._queued
+            self._queued.setdefault(owner, {}).update(wanted)
+            self._stale.setdefault(owner, []).extend(stale)
+        if not scheduled:
+            self._jobs.submit(owner, "thumbnail", "Build thumbnails", lambda job: self._drain(owner),
+                              priority=PRIORITY_BACKGROUND, limited=False)
+        return found
+
+    def _drain(self, owner):
+        """Build queued thumbnails of an owner and remove stale ones until none are left"""
+        built = 0
+        try:
+            while True:
+                with self._lock:
+                    queued = self._queued.get(owner)
+                    stale = self._stale.pop(owner, [])
+                    get_bucket = self._buckets.get(owner)
+                    if not queued and not stale:
+                        self._queued.pop(owner, None)
+                        self._buckets.pop(owner, None)
+                        return {"built": built}
+                    item = queued.popitem() if queued else None
+                if stale:
+                    try:
+                        get_bucket().remove(stale)
+                    except Exception:
+                        logger.exception("Could not remove %d unused thumbnails", len(stale))
+                if item is not None:
+                    content, (path, size, mime_type) = item
+                    built += self._generate(get_bucket(), owner, content, path, size, mime_type)
+        except BaseException:
+            # The rest stay pending and are requested again after PENDING_TIMEOUT
+            with self._lock:
+                self._queued.pop(owner, None)
+                self._stale.pop(owner, None)
+                self._buckets.pop(owner, None)
+            raise
+
+    def _generate(self, bucket, owner, content, path, size, mime_type):
+        target = thumbnail_path(owner, content)
+        status = READY
+        try:
+            if mime_type.startswith("video/"):
+                data = video_poster(bucket.create_signed_url(path, SOURCE_URL_TTL)["signedURL"])
+            elif size > MAX_SOURCE_SIZE:
+                data = None
+                status = UNSUPPORTED
+            elif mime_type == "application/pdf":
+                data = pdf_thumbnail(bucket.download(path))
+            else:
+                data = image_thumbnail(bucket.download(path))
+            if data is not None:
+                bucket.upload(target, file=data, file_options={"content-type": "image/jpeg", "upsert": "true"})
+        except Exception:
+            logger.exception("Could not build a thumbnail for %s", path)
+            status = UNSUPPORTED
+        self._conn().execute(
+            "UPDATE thumbnail_images SET status = ? WHERE owner = ? AND content = ?", (status, owner, content)
+        )
+        return status == READY
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_thumbnail_service():
+    """Return the process-wide ThumbnailService shared by all sessions"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService()
+        return _service
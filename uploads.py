@@ -0,0 +1,582 @@
+import base64
+import json
+import posixpath
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+
+from compression import maybe_compress
+from dedup import hash_file
+from file_types import detect_type, guess_type
+from integrity import BLOCK_SIZE, BlockHasher, checksum_file
+from metrics import get_metrics, operation_for, user_for
+from versions import version_key
+
+# Supabase Storage requires resumable (TUS) uploads to be sent in 6 MB chunks
+CHUNK_SIZE = 6 * 1024 * 1024
+
+# How many times a failed request is retried before the upload gives up
+MAX_ATTEMPTS = 5
+
+# Base delay in seconds for exponential backoff between retries
+RETRY_BACKOFF = 0.5
+
+# Default number of files uploaded at the same time by upload_many()
+MAX_CONCURRENT_UPLOADS = 4
+
+# How many times upload_many() tries a single file before reporting failure
+FILE_ATTEMPTS = 3
+
+TUS_VERSION = "1.0.0"
+
+# Status codes worth retrying: the server or a proxy was temporarily unhappy
+RETRYABLE_STATUSES = {408, 423, 429, 500, 502, 503, 504}
+
+
+class UploadError(Exception):
+    """Raised when an upload cannot be completed"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def _encode_metadata(values):
+    """Encode a dict as a TUS Upload-Metadata header"""
+    pairs = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        encoded = base64.b64encode(str(value).encode("utf-8")).decode("ascii")
+        pairs.append(f"{key} {encoded}")
+    return ",".join(pairs)
+
+
+class ResumableUpload:
+    """A single TUS upload to Supabase Storage
+
+    Only one chunk of the source file is held in memory at a time. The upload
+    URL is remembered in a process-wide registry, so if a transfer fails and
+    is started again for the same object it continues from the last offset
+    the server acknowledged instead of from the beginning.
+    """
+
+    def __init__(self, storage_url, bucket, path, size, headers, http_client,
+                 content_type=None, upsert=False, metadata=None, chunk_size=CHUNK_SIZE):
+        self.endpoint = str(storage_url).rstrip("/") + "/upload/resumable"
+        self.bucket = bucket
+        self.path = path
+        self.size = size
+        self.headers = {**headers, "Tus-Resumable": TUS_VERSION}
+        self.http_client = http_client
+        self.content_type = content_type or "application/octet-stream"
+        self.upsert = upsert
+        self.metadata = metadata
+        self.chunk_size = chunk_size
+        self.location = None
+        self.offset = 0
+
+    @property
+    def resume_key(self):
+        return (self.endpoint, self.bucket, self.path, self.size)
+
+    def _request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures with backoff"""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = self.http_client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise UploadError(f"Network error during upload: {e}") from e
+            else:
+                if response.status_code not in RETRYABLE_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                    return response
+            get_metrics().retry(operation_for(method, url), user_for(self.headers))
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    def _create(self):
+        metadata = {
+            "bucketName": self.bucket,
+            "objectName": self.path,
+            "contentType": self.content_type,
+            "cacheControl": "3600",
+            "metadata": json.dumps(self.metadata) if self.metadata else None,
+        }
+        response = self._request("POST", self.endpoint, headers={
+            **self.headers,
+            "Upload-Length": str(self.size),
+            "Upload-Metadata": _encode_metadata(metadata),
+            "x-upsert": "true" if self.upsert else "false",
+        })
+        if response.status_code != 201:
+            raise UploadError(_error_message(response), response.status_code)
+        self.location = httpx.URL(self.endpoint).join(response.headers["Location"])
+        self.offset = 0
+        _remember(self.resume_key, self.location)
+
+    def _fetch_offset(self):
+        """Ask the server how many bytes it already has
+
+        Returns:
+            True if the upload still exists on the server
+        """
+        response = self._request("HEAD", self.location, headers=self.headers)
+        if response.status_code in (404, 410):
+            return False
+        if response.status_code >= 400:
+            raise UploadError(_error_message(response), response.status_code)
+        self.offset = int(response.headers.get("Upload-Offset", 0))
+        return True
+
+    def start(self):
+        """Create the upload, or pick up an earlier one for the same object"""
+        self.location = _recall(self.resume_key)
+        if self.location is None or not self._fetch_offset():
+            self._create()
+        return self.offset
+
+    def send(self, fileobj, progress=None, throttle=None):
+        """Stream the file to the server, chunk by chunk
+
+        Args:
+            fileobj: Seekable binary file object positioned anywhere
+            progress: Optional callback called with (bytes_sent, total_bytes)
+            throttle: Optional callback called with the size of each chunk
+                before it is read; it may block to limit the bandwidth
+        """
+        if self.location is None:
+            self.start()
+
+        while self.offset < self.size:
+            if progress:
+                progress(self.offset, self.size)
+            if throttle:
+                throttle(min(self.chunk_size, self.size - self.offset))
+            fileobj.seek(self.offset)
+            chunk = fileobj.read(self.chunk_size)
+            if not chunk:
+                raise UploadError("Source file ended before the upload was complete")
+
+            response = self._request("PATCH", self.location, content=chunk, headers={
+                **self.headers,
+                "Upload-Offset": str(self.offset),
+                "Content-Type": "application/offset+octet-stream",
+            })
+            if response.status_code == 409:
+                # Offset mismatch, e.g. a previous PATCH landed after its
+                # response was lost. Resync with the server and carry on.
+                if not self._fetch_offset():
+                    raise UploadError("Upload expired on the server", 409)
+                continue
+            if response.status_code != 204:
+                raise UploadError(_error_message(response), response.status_code)
+            self.offset = int(response.headers.get("Upload-Offset", self.offset + len(chunk)))
+
+        _forget(self.resume_key)
+        if progress:
+            progress(self.size, self.size)
+        return self.path
+
+
+def _error_message(response):
+    try:
+        body = response.json()
+        return body.get("message") or body.get("error") or response.text
+    except ValueError:
+        return response.text or f"HTTP {response.status_code}"
+
+
+# Upload URLs of unfinished transfers, keyed by target object and size
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _remember(key, location):
+    with _pending_lock:
+        _pending[key] = location
+
+
+def _recall(key):
+    with _pending_lock:
+        return _pending.get(key)
+
+
+def _forget(key):
+    with _pending_lock:
+        _pending.pop(key, None)
+
+
+_http_client = None
+
+
+def _default_http_client():
+    global _http_client
+    with _pending_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(timeout=httpx.Timeout(60.0))
+        return _http_client
+
+
+def _client_headers(client):
+    return {
+        "apikey": client.supabase_key,
+        "Authorization": client.options.headers["Authorization"],
+    }
+
+
+def copy_object(client, bucket, source, destination, upsert=False):
+    """Copy an object server-side, optionally replacing the destination
+
+    The storage client's copy() cannot overwrite, so the request is sent
+    directly; with ``upsert`` the destination is replaced in one step and
+    readers see either the old object or the new one.
+
+    Raises:
+        UploadError: Storage refused the copy, e.g. the source is missing
+    """
+    http_client = client.options.httpx_client or _default_http_client()
+    headers = {**_client_headers(client), "x-upsert": "true" if upsert else "false"}
+    url = str(client.storage_url).rstrip("/") + "/object/copy"
+    body = {"bucketId": bucket, "sourceKey": source, "destinationKey": destination}
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            response = http_client.post(url, headers=headers, json=body)
+        except httpx.TransportError as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise UploadError(f"Network error during copy: {e}") from e
+        else:
+            if response.status_code == 200:
+                return destination
+            if response.status_code not in RETRYABLE_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                raise UploadError(_error_message(response), response.status_code)
+        get_metrics().retry("storage.copy", user_for(headers))
+        time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+def publish_version(client, bucket, versions, owner, path, source):
+    """Overwrite an object with a stored version, keeping the one it replaces
+
+    The current version is only stored at ``path``, so it is first copied
+    to its own version key. Call with versions.lock(owner, path) held, move
+    the pointer, then remove ``source``: the published bytes are at
+    ``path`` from then on.
+
+    Raises:
+        UploadError: Storage refused a copy
+    """
+    current = versions.current(owner, path)
+    if current is not None:
+        try:
+            copy_object(client, bucket, path, version_key(owner, path, current), upsert=True)
+        except UploadError as e:
+            if e.status not in (400, 404):
+                raise
+            # The live object is gone, so there is nothing to keep
+    copy_object(client, bucket, source, path, upsert=True)
+
+
+def upload_file(client, bucket, path, fileobj, size, content_type=None,
+                upsert=False, metadata=None, progress=None, chunk_size=CHUNK_SIZE, throttle=None):
+    """Upload a file object to storage without reading it all into memory
+
+    Files that fit in a single chunk go through the regular upload endpoint.
+    Larger files use the resumable TUS endpoint, sending one chunk at a time
+    and resuming from the server's offset after a failure.
+
+    Args:
+        client: Authenticated Supabase client
+        bucket: Bucket name
+        path: Object path inside the bucket
+        fileobj: Seekable binary file object, e.g. a Streamlit UploadedFile
+        size: Size of the file in bytes
+        content_type: Optional MIME type of the file
+        upsert: Overwrite an existing object with the same path
+        metadata: Optional dict stored as user metadata on the object
+        progress: Optional callback called with (bytes_sent, total_bytes)
+        throttle: Optional callback called with a byte count before that
+            many bytes are read to be sent, e.g. limits.Limits.throttle
+
+    Returns:
+        The object path
+    """
+    fileobj.seek(0)
+    if size <= chunk_size:
+        if throttle:
+            throttle(size)
+        file_options = {"content-type": content_type or "application/octet-stream"}
+        if upsert:
+            file_options["upsert"] = "true"
+        if metadata:
+            file_options["metadata"] = metadata
+        client.storage.from_(bucket).upload(path, file=fileobj.read(), file_options=file_options)
+        if progress:
+            progress(size, size)
+        return path
+
+    http_client = client.options.httpx_client or _default_http_client()
+    upload = ResumableUpload(
+        client.storage_url, bucket, path, size, _client_headers(client), http_client,
+        content_type=content_type, upsert=upsert, metadata=metadata, chunk_size=chunk_size,
+    )
+    upload.start()
+    return upload.send(fileobj, progress=progress, throttle=throttle)
+
+
+def store_file(client, bucket, path, fileobj, size, owner, index, content_type=None,
+               upsert=False, metadata=None, progress=None, compress=False, throttle=None, versions=None):
+    """Upload a file unless identical content is already stored
+
+    The file is hashed first. If the index shows the same content already
+    at ``path`` nothing is sent; if it is stored under another name of the
+    same owner, the object is copied server-side instead of re-uploaded;
+    the copy keeps the source's stored bytes, so its encoding, stored size
+    and checksum are recorded rather than this upload's.
+
+    With ``compress`` set, files of a compressible type are stored
+    compressed and the codec is recorded as ``encoding`` in the object
+    metadata and the index. The hash is always of the original content.
+
+    A checksum of the bytes actually stored (see integrity.BlockHasher) is
+    sent as ``checksum`` object metadata and recorded in the index, so
+    downloads and the background scrubber can verify the object later.
+
+    The stored content type is decided by file_types.detect_type(), which
+    checks ``content_type`` against the file's magic bytes, so listings
+    can show the object's type without guessing from its name.
+
+    With ``versions`` the content is first written to a key of its own (see
+    versions.VersionStore) and then published to ``path`` with one
+    server-side overwrite, so a file is never half-written or missing
+    while it is replaced, and uploads of the same name become new versions
+    instead of failing. ``upsert`` is implied. The staged object is removed
+    once published; see publish_version().
+
+    Args:
+        owner: Index partition the path belongs to, normally the user folder
+        index: metadata_index.MetadataIndex
+        compress: Store compressible files compressed
+        versions: Optional versions.VersionStore keeping the file's history
+        (other arguments as for upload_file)
+
+    Returns:
+        Dict with the object ``path``, its ``hash``, the stored ``size``,
+        its ``encoding`` (None when stored as-is), the stored bytes'
+        ``checksum``, its ``content_type`` and a ``status`` of "uploaded",
+        "copied" or "unchanged"
+    """
+    content_type = detect_type(path, fileobj, content_type)
+    # Object metadata goes out with the first request of an upload and
+    # cannot be changed afterwards, so the checksum is taken in the read
+    # that hashes the content rather than while the bytes are sent
+    hasher = BlockHasher()
+    content_hash = hash_file(fileobj, hasher=hasher)
+    checksum, blocks = hasher.checksum(), hasher.blocks()
+    storage = client.storage.from_(bucket)
+    source_file = fileobj
+    original_size = size
+    encoding = None
+    if compress:
+        fileobj, size, encoding = maybe_compress(fileobj, size, content_type)
+        if encoding:
+            checksum, blocks = checksum_file(fileobj)
+
+    if index.lookup(owner, path) == (content_hash, size) and storage.exists(path):
+        status = "unchanged"
+        if not index.checksums(owner, [path]):
+            # Uploaded before checksums were kept
+            index.record_checksum(owner, path, checksum, blocks, BLOCK_SIZE)
+    else:
+        status = None
+        # With versions, content goes to a staging key first and is published below
+        target = path
+        if versions is not None:
+            version, target = versions.stage(owner, path, content_hash)
+            # A retry may find its staging key already (partly) written
+            upsert = True
+        for source in index.find(owner, content_hash):
+            if source != path and storage.exists(source):
+                copy_object(client, bucket, source, target, upsert=upsert)
+                status = "copied"
+                # The copy holds the source's bytes, stored the way the
+                # source was, whatever this upload would have stored
+                stored_as = index.get(owner, source)["metadata"]
+                size, encoding = stored_as["size"], stored_as["encoding"]
+                checksum = (index.checksums(owner, [source]).get(source) or {}).get("checksum")
+                break
+            # The indexed copy is gone; stop pointing at it
+            index.forget(owner, [source])
+        if status is None:
+            metadata = {**(metadata or {}), "sha256": content_hash, "checksum": checksum,
+                        "checksum_block_size": BLOCK_SIZE}
+            if encoding:
+                metadata.update(encoding=encoding, original_size=original_size)
+            upload_file(client, bucket, target, fileobj, size, content_type=content_type,
+                        upsert=upsert, metadata=metadata, progress=progress, throttle=throttle)
+            status = "uploaded"
+        if versions is not None:
+            # Publishing and moving the pointer happen together, so the
+            # last version to commit is also the one stored at the path
+            stored = {"checksum": checksum, "blocks": blocks, "block_size": BLOCK_SIZE}
+            if status == "copied":
+                stored = index.checksums(owner, [source]).get(source) or {}
+            with versions.lock(owner, path):
+                publish_version(client, bucket, versions, owner, path, target)
+                versions.commit(owner, path, version, size, content_hash, content_type=content_type,
+                                encoding=encoding, checksum=stored.get("checksum"), blocks=stored.get("blocks"),
+                                block_size=stored.get("block_size"))
+            storage.remove([target])
+        index.record(owner, path, size, content_type, content_hash=content_hash, encoding=encoding or "")
+        if status == "copied":
+            index.copy_checksum(owner, source, path)
+        else:
+            index.record_checksum(owner, path, checksum, blocks, BLOCK_SIZE)
+
+    if fileobj is not source_file:
+        # The compressed spool
+        fileobj.close()
+    if progress:
+        progress(size, size)
+    return {"path": path, "hash": content_hash, "size": size, "encoding": encoding, "checksum": checksum,
+            "content_type": content_type, "status": status}
+
+
+class BatchItem:
+    """One file of a batch upload
+
+    ``opener`` returns a seekable binary file object and is called by the
+    worker for every attempt, so zip members are only decompressed while
+    they are being uploaded.
+    """
+
+    def __init__(self, name, path, size, opener, content_type=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.opener = opener
+        self.content_type = content_type
+
+
+def _is_retryable(error):
+    """Whether a failed file upload is worth trying again"""
+    status = getattr(error, "status", None)
+    if status is None:
+        return not isinstance(error, (ValueError, zipfile.BadZipFile))
+    try:
+        return int(status) in RETRYABLE_STATUSES
+    except (TypeError, ValueError):
+        return False
+
+
+def _upload_item(client, bucket, item, upsert, owner, index, compress, before_item, throttle, versions):
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            size, content_type = item.size, item.content_type
+            if before_item:
+                before_item()
+            if index is not None:
+                stored = store_file(client, bucket, item.path, item.opener(), item.size, owner, index,
+                                    content_type=item.content_type, upsert=upsert, compress=compress,
+                                    throttle=throttle, versions=versions)
+                status, size, content_type = stored["status"], stored["size"], stored["content_type"]
+            else:
+                upload_file(client, bucket, item.path, item.opener(), item.size,
+                            content_type=item.content_type, upsert=upsert, throttle=throttle)
+                status = "uploaded"
+            return {"name": item.name, "path": item.path, "size": size, "content_type": content_type, "ok": True, "status": status, "error": None, "attempts": attempts}
+        except Exception as e:
+            if attempts >= FILE_ATTEMPTS or not _is_retryable(e):
+                return {"name": item.name, "path": item.path, "size": item.size, "content_type": item.content_type, "ok": False, "status": "failed", "error": str(e), "attempts": attempts}
+            get_metrics().retry("upload.file", user_for(_client_headers(client)))
+            time.sleep(RETRY_BACKOFF * (2 ** attempts))
+
+
+def upload_many(client, bucket, items, max_workers=MAX_CONCURRENT_UPLOADS, upsert=False, on_result=None,
+                owner=None, index=None, compress=False, before_item=None, throttle=None, versions=None):
+    """Upload many files concurrently with a bounded thread pool
+
+    A failing file is retried with backoff and then reported, but never
+    aborts the rest of the batch.
+
+    Args:
+        client: Authenticated Supabase client
+        bucket: Bucket name
+        items: Iterable of BatchItem
+        max_workers: Maximum number of files uploaded at the same time
+        upsert: Overwrite existing objects with the same path
+        on_result: Optional callback called with each result dict as files
+            finish. It runs in the calling thread, so it may update the UI.
+        owner: Index partition for deduplication, normally the user folder
+        index: Optional metadata_index.MetadataIndex; when given files go through
+            store_file() and identical content is not uploaded again
+        compress: Store compressible files compressed; needs ``index``
+        before_item: Optional callback the worker calls before opening each
+            file; it may block to limit how fast files are started
+        throttle: Optional bandwidth callback passed on to upload_file()
+        versions: Optional versions.VersionStore passed on to store_file()
+
+    Returns:
+        List of result dicts with name, path, stored size, content_type, ok,
+        status, error and attempts
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(_upload_item, client, bucket, item, upsert, owner, index, compress,
+                               before_item, throttle, versions) for item in items]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def _safe_member_path(name):
+    """Normalise a zip member name
+
+    Returns:
+        The path, or None if it escapes the folder or goes into a hidden
+        folder such as .versions; file names may start with a dot
+    """
+    path = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if path in ("", ".", ".."):
+        return None
+    folders = path.split("/")[:-1]
+    if folders[:1] == ["__MACOSX"] or any(folder.startswith(".") for folder in folders):
+        return None
+    return path
+
+
+def items_from_zip(archive, folder):
+    """Build batch items for every file inside a zip archive
+
+    Members keep their relative paths under ``folder``. Each member is
+    decompressed on demand by the worker that uploads it.
+
+    Args:
+        archive: Seekable binary file object containing the zip archive
+        folder: Destination folder inside the bucket
+
+    Returns:
+        List of BatchItem
+    """
+    zip_file = zipfile.ZipFile(archive)
+    items = []
+    for member in zip_file.infolist():
+        if member.is_dir():
+            continue
+        relative_path = _safe_member_path(member.filename)
+        if relative_path is None:
+            continue
+        items.append(BatchItem(
+            relative_path,
+            f"{folder}/{relative_path}",
+            member.file_size,
+            lambda member=member: zip_file.open(member),
+            content_type=guess_type(relative_path),
+        ))
+    return items
@@ -0,0 +1,253 @@
+import os
+import secrets
+import threading
+import time
+
+from local_db import ensure_schema
+
+# Earlier versions of a file kept besides the current one
+KEEP_VERSIONS = int(os.environ.get("FILESHARE_KEEP_VERSIONS", 3))
+
+# Staged versions never committed (a crashed or abandoned upload) are
+# removed once they are this old (seconds)
+PENDING_GRACE = 24 * 60 * 60
+
+# Hidden folder of a user folder holding every stored version; listings
+# skip folders starting with a dot
+VERSIONS_FOLDER = ".versions"
+
+PENDING = "pending"
+COMMITTED = "committed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_versions (
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    version TEXT NOT NULL,
+    storage_key TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    size INTEGER,
+    hash TEXT,
+    content_type TEXT,
+    encoding TEXT,
+    checksum TEXT,
+    block_size INTEGER,
+    blocks BLOB,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (owner, path, version)
+);
+CREATE INDEX IF NOT EXISTS file_versions_state ON file_versions (state, created_at);
+
+-- The version each path's live object currently holds
+CREATE TABLE IF NOT EXISTS version_pointers (
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL,
+    version TEXT NOT NULL,
+    PRIMARY KEY (owner, path)
+);
+"""
+
+
+def new_version():
+    """A unique version id that sorts by creation time"""
+    return f"{time.time_ns():016x}-{secrets.token_hex(4)}"
+
+
+def version_key(owner, path, version):
+    """Storage key of one version of an object"""
+    return f"{owner}/{VERSIONS_FOLDER}/{path[len(owner) + 1:]}/{version}"
+
+
+class VersionStore:
+    """Per-file version history and the pointer to the current version
+
+    Every upload is staged under its own key in the user's .versions folder,
+    so retried and concurrent uploads of one file never collide. Committing
+    publishes the staged object to the file's live key with one
+    server-side overwrite and moves the version pointer in the same step,
+    under a per-file lock; readers only ever see the live key, whole.
+
+    The current version's bytes are kept at the live key only: publishing
+    copies the outgoing version back to its own key and removes the staged
+    object of the new one (see uploads.publish_version()), so a file with
+    no earlier versions takes its own size in storage.
+    """
+
+    def __init__(self, keep=KEEP_VERSIONS):
+        self.keep = keep
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _conn(self):
+        return ensure_schema(SCHEMA)
+
+    def lock(self, owner, path):
+        """The lock serializing commits of one file within this process"""
+        with self._locks_lock:
+            return self._locks.setdefault((owner, path), threading.Lock())
+
+    def stage(self, owner, path, content_hash):
+        """Reserve a version of a file about to be written
+
+        A retried upload of the same content gets its earlier pending
+        version back, so a resumable transfer continues where it stopped.
+        The row is pending until commit(); collectable() hands out pending
+        versions older than PENDING_GRACE for removal.
+
+        Returns:
+            Tuple of (version, storage_key)
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT version, storage_key FROM file_versions WHERE owner = ? AND path = ? AND hash = ? AND state = ? "
+            "AND created_at > ? ORDER BY version DESC LIMIT 1",
+            (owner, path, content_hash, PENDING, time.time() - PENDING_GRACE),
+        ).fetchone()
+        if row is not None:
+            return row["version"], row["storage_key"]
+        version = new_version()
+        key = version_key(owner, path, version)
+        conn.execute(
+            "INSERT INTO file_versions (owner, path, version, storage_key, hash, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (owner, path, version, key, content_hash, time.time()),
+        )
+        return version, key
+
+    def commit(self, owner, path, version, size, content_hash, content_type=None, encoding=None,
+               checksum=None, blocks=None, block_size=None):
+        """Mark a staged version written and make it the current one"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE file_versions SET state = ?, size = ?, hash = ?, content_type = ?, encoding = ?, "
+                "checksum = ?, blocks = ?, block_size = ? WHERE owner = ? AND path = ? AND version = ?",
+                (COMMITTED, size, content_hash, content_type, encoding, checksum, blocks, block_size,
+                 owner, path, version),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO version_pointers (owner, path, version) VALUES (?, ?, ?)",
+                (owner, path, version),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def point(self, owner, path, version):
+        """Move the pointer to an earlier committed version, e.g. on restore"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO version_pointers (owner, path, version) VALUES (?, ?, ?)",
+            (owner, path, version),
+        )
+
+    def current(self, owner, path):
+        """Return the version id the live object holds, or None"""
+        row = self._conn().execute(
+            "SELECT version FROM version_pointers WHERE owner = ? AND path = ?", (owner, path)
+        ).fetchone()
+        return row["version"] if row else None
+
+    def stored_size(self, owner):
+        """Return the bytes an owner's earlier versions take in storage
+
+        Committed versions other than the current ones are stored under
+        their own keys; the current ones are the live files, counted by the
+        metadata index.
+        """
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(v.size), 0) FROM file_versions v "
+            "LEFT JOIN version_pointers p ON p.owner = v.owner AND p.path = v.path "
+            "WHERE v.owner = ? AND v.state = ? AND v.version IS NOT p.version",
+            (owner, COMMITTED),
+        ).fetchone()
+        return row[0]
+
+    def get(self, owner, path, version):
+        """Return one committed version as a dict, or None"""
+        row = self._conn().execute(
+            "SELECT * FROM file_versions WHERE owner = ? AND path = ? AND version = ? AND state = ?",
+            (owner, path, version, COMMITTED),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def history(self, owner, path):
+        """Return the committed versions of a file, newest first
+
+        Each is a dict of its file_versions row plus ``current``.
+        """
+        current = self.current(owner, path)
+        rows = self._conn().execute(
+            "SELECT version, storage_key, size, hash, content_type, encoding, created_at FROM file_versions "
+            "WHERE owner = ? AND path = ? AND state = ? ORDER BY version DESC",
+            (owner, path, COMMITTED),
+        ).fetchall()
+        return [{**dict(row), "current": row["version"] == current} for row in rows]
+
+    def collectable(self, owner, keep=None, pending_before=None):
+        """Return (owner, path, version, storage_key) of versions to delete
+
+        These are committed versions beyond the current one and ``keep``
+        newer ones, and pending versions staged before ``pending_before``.
+        """
+        keep = self.keep if keep is None else keep
+        pending_before = time.time() - PENDING_GRACE if pending_before is None else pending_before
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT v.path, v.version, v.storage_key, p.version AS current FROM file_versions v "
+            "LEFT JOIN version_pointers p ON p.owner = v.owner AND p.path = v.path "
+            "WHERE v.owner = ? AND v.state = ? ORDER BY v.path, v.version DESC",
+            (owner, COMMITTED),
+        ).fetchall()
+        doomed = []
+        kept = {}
+        for row in rows:
+            if row["version"] == row["current"]:
+                continue
+            kept[row["path"]] = kept.get(row["path"], 0) + 1
+            if kept[row["path"]] > keep:
+                doomed.append((owner, row["path"], row["version"], row["storage_key"]))
+        doomed.extend(
+            (owner, row["path"], row["version"], row["storage_key"])
+            for row in conn.execute(
+                "SELECT path, version, storage_key FROM file_versions WHERE owner = ? AND state = ? AND created_at < ?",
+                (owner, PENDING, pending_before),
+            )
+        )
+        return doomed
+
+    def drop(self, versions):
+        """Forget versions whose objects were deleted"""
+        self._conn().executemany(
+            "DELETE FROM file_versions WHERE owner = ? AND path = ? AND version = ?",
+            [(owner, path, version) for owner, path, version, _ in versions],
+        )
+
+    def forget(self, owner, paths):
+        """Forget every version of deleted files
+
+        Returns:
+            Storage keys of the versions, for the caller to delete
+        """
+        conn = self._conn()
+        keys = []
+        for path in paths:
+            keys.extend(row["storage_key"] for row in conn.execute(
+                "SELECT storage_key FROM file_versions WHERE owner = ? AND path = ?", (owner, path)
+            ))
+        conn.executemany("DELETE FROM file_versions WHERE owner = ? AND path = ?", [(owner, path) for path in paths])
+        conn.executemany("DELETE FROM version_pointers WHERE owner = ? AND path = ?", [(owner, path) for path in paths])
+        return keys
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_version_store():
+    """Return the process-wide VersionStore"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = VersionStore()
+        return _store